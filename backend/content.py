@@ -0,0 +1,289 @@
+"""Product content generation in the DM Sports style.
+
+The HTML description is assembled from fragments compiled once at import
+time. The care guide, services and table headers are static. Brand and
+gender variants are rendered once per combination and memoized. Each call
+only renders the per-product slots (short description, features, material,
+sizes, colors) and joins a handful of strings.
+
+Generated content is also cached by a hash of the generator inputs, so the
+same brand/model/features combination is rendered once across all users.
+
+Large batches are fanned out in chunks over a process pool
+(:data:`content_pool`) so they use every core instead of the event loop thread.
+"""
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from cache import TTLCache
+from metrics import timed
+
+CONTENT_CACHE_SIZE = int(os.getenv("CONTENT_CACHE_SIZE", "10000"))
+CONTENT_WORKERS = int(os.getenv("CONTENT_WORKERS", str(os.cpu_count() or 1)))
+CONTENT_CHUNK_SIZE = int(os.getenv("CONTENT_CHUNK_SIZE", "50"))
+
+# Template data
+BRAND_INTROS = {
+    'Nike': 'Performance et innovation au service du sport',
+    'Adidas': 'L\'excellence sportive depuis 1949',
+    'Lacoste': 'L\'élégance sportive à la française',
+    'Hugo Boss': 'Le luxe et la sophistication',
+    'The North Face': 'L\'aventure sans limites',
+    'Puma': 'Forever Faster - La vitesse au service du style'
+}
+DEFAULT_INTRO = 'Qualité et style garantis'
+
+GENDER_TEXTS = {
+    'homme': "l'homme moderne",
+    'femme': 'la femme active',
+}
+DEFAULT_GENDER_TEXT = 'tous'
+
+SHOE_CARE = [
+    '🧽 Nettoyer avec un chiffon humide',
+    '💧 Imperméabiliser régulièrement',
+    '☀️ Éviter l\'exposition prolongée au soleil',
+    '👟 Utiliser des embauchoirs pour maintenir la forme',
+]
+CLOTHING_CARE = [
+    '🌡️ Lavage en machine à 30°C',
+    '🚫 Ne pas utiliser de javel',
+    '♨️ Repassage à température moyenne',
+    '🌀 Séchage en tambour autorisé à basse température',
+]
+SERVICES = [
+    '✅ Livraison gratuite dès 80€ d\'achat',
+    '📦 Expédition sous 24h (jours ouvrés)',
+    '🔄 Retours sous 14 jours',
+    '💯 Garantie authenticité 100%',
+    '💳 Paiement sécurisé (CB, PayPal, Apple Pay)',
+    '🏪 Retrait gratuit en boutique Lyon - 11 rue de la République',
+]
+
+# Compiled static fragments
+def _list_items(items: List[str]) -> str:
+    return ''.join(f'<li>{item}</li>' for item in items)
+
+FEATURES_OPEN = '<h4>✨ Points forts du produit</h4><ul>'
+FEATURES_CLOSE = '</ul>'
+TABLE_OPEN = '<h4>📋 Informations techniques</h4><table style="width: 100%; margin: 15px 0;">'
+
+_SERVICES_BLOCK = '<h4>🚚 Livraison & Services DM Sports</h4><ul>' + _list_items(SERVICES) + '</ul>'
+# Everything after the last technical row, by product kind
+CLOSING_FOR_SHOES = '</table><h4>🧺 Conseils d\'entretien</h4><ul>' + _list_items(SHOE_CARE) + '</ul>' + _SERVICES_BLOCK
+CLOSING_FOR_CLOTHING = '</table><h4>🧺 Conseils d\'entretien</h4><ul>' + _list_items(CLOTHING_CARE) + '</ul>' + _SERVICES_BLOCK
+
+VARIANT_CACHE_SIZE = 4096
+
+# Brand and gender variants
+@lru_cache(maxsize=VARIANT_CACHE_SIZE)
+def intro_fragment(brand: str) -> str:
+    return f"<p><strong>{BRAND_INTROS.get(brand, DEFAULT_INTRO)}</strong></p>"
+
+@lru_cache(maxsize=VARIANT_CACHE_SIZE)
+def table_head_fragment(brand: str, gender: str) -> str:
+    return (
+        f'{TABLE_OPEN}'
+        f'<tr><td><strong>Marque :</strong></td><td>{brand}</td></tr>'
+        f'<tr><td><strong>Genre :</strong></td><td>{gender.capitalize()}</td></tr>'
+    )
+
+@lru_cache(maxsize=VARIANT_CACHE_SIZE)
+def default_paragraph(category: str, brand: str, gender: str) -> str:
+    gender_text = GENDER_TEXTS.get(gender, DEFAULT_GENDER_TEXT)
+    return (
+        f"<p>Ce {category} {brand} incarne le parfait équilibre entre style et performance. "
+        f"Conçu pour {gender_text}, il offre un confort optimal au quotidien.</p>"
+    )
+
+@lru_cache(maxsize=VARIANT_CACHE_SIZE)
+def closing_fragment(category: str) -> str:
+    return CLOSING_FOR_SHOES if 'chaussures' in category.lower() else CLOSING_FOR_CLOTHING
+
+
+def render_description(product_data: dict) -> str:
+    brand = product_data.get("brand", "")
+    category = product_data.get("category", "")
+    gender = product_data.get("gender", "")
+    short_desc = product_data.get("short_description", "")
+    features = product_data.get("features", [])
+    material = product_data.get("material", "")
+    sizes = product_data.get("sizes", [])
+    colors = product_data.get("colors", [])
+
+    parts = [intro_fragment(brand)]
+    parts.append(f"<p>{short_desc}</p>" if short_desc else default_paragraph(category, brand, gender))
+
+    if features:
+        parts.append(FEATURES_OPEN)
+        parts.extend(f'<li>• {feature}</li>' for feature in features)
+        parts.append(FEATURES_CLOSE)
+
+    parts.append(table_head_fragment(brand, gender))
+    if material:
+        parts.append(f'<tr><td><strong>Composition :</strong></td><td>{material}</td></tr>')
+    if sizes:
+        parts.append(f'<tr><td><strong>Tailles disponibles :</strong></td><td>{", ".join(sizes)}</td></tr>')
+    if colors:
+        parts.append(f'<tr><td><strong>Coloris disponibles :</strong></td><td>{", ".join(colors)}</td></tr>')
+    parts.append(closing_fragment(category))
+
+    return ''.join(parts)
+
+
+def render_title(product_data: dict) -> str:
+    name = product_data.get("name", "")
+    brand = product_data.get("brand", "")
+    return f"{name} - {brand}" if name and brand else "Produit DM Sports"
+
+
+# Content-addressed cache
+# Every input read by render_title/render_description, with the same defaults
+CONTENT_INPUTS = {
+    "name": "",
+    "brand": "",
+    "category": "",
+    "gender": "",
+    "material": "",
+    "short_description": "",
+    "features": [],
+    "sizes": [],
+    "colors": [],
+}
+
+content_cache = TTLCache(maxsize=CONTENT_CACHE_SIZE, name="content")
+
+
+def canonical_hash(data: dict, fields: Iterable[str], defaults: Dict[str, Any] = None) -> str:
+    """SHA-256 of the given fields serialized canonically (sorted keys, no whitespace)."""
+    defaults = defaults or {}
+    canonical = json.dumps(
+        {field: data.get(field, defaults.get(field)) for field in fields},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def content_hash(product_data: dict) -> str:
+    return canonical_hash(product_data, CONTENT_INPUTS, CONTENT_INPUTS)
+
+
+def _rendered(product_data: dict) -> Dict[str, str]:
+    key = content_hash(product_data)
+    rendered = content_cache.get(key)
+    if rendered is None:
+        rendered = {
+            "title": render_title(product_data),
+            "description": render_description(product_data),
+            "content_hash": key,
+        }
+        content_cache.set(key, rendered)
+    return rendered
+
+
+def generate_product_content(product_data: dict) -> dict:
+    """Generate AI-powered product content like the original generator"""
+    with timed("content_generation"):
+        return {**_rendered(product_data), "generated_at": datetime.utcnow().isoformat()}
+
+
+def generate_product_contents(products: List[dict]) -> List[Dict[str, str]]:
+    """Generate content for several products with a single timestamp."""
+    generated_at = datetime.utcnow().isoformat()
+    return [{**_rendered(product_data), "generated_at": generated_at} for product_data in products]
+
+
+def generate_chunk(products: List[dict]) -> List[Dict[str, Any]]:
+    """Process pool entry point: ``{"content": ...}`` or ``{"error": ...}`` per product."""
+    generated_at = datetime.utcnow().isoformat()
+    results = []
+    for product_data in products:
+        try:
+            results.append({"content": {**_rendered(product_data), "generated_at": generated_at}})
+        except Exception as e:
+            results.append({"error": f"{type(e).__name__}: {e}"})
+    return results
+
+
+class ContentPool:
+    """Generates content for batches of products across worker processes."""
+
+    def __init__(self, workers: int = CONTENT_WORKERS, chunk_size: int = CONTENT_CHUNK_SIZE):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.pending_chunks = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def warm_up(self) -> None:
+        """Spawn every worker and render each brand variant once, here and in the workers."""
+        self.start()
+        samples = [{"brand": brand, "category": "chaussures", "gender": "homme"} for brand in BRAND_INTROS]
+        generate_chunk(samples)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, generate_chunk, samples) for _ in range(self.workers)))
+
+    async def _run_chunk(self, start: int, chunk: List[dict]) -> Tuple[int, List[Dict[str, Any]]]:
+        self.pending_chunks += 1
+        try:
+            # Timed here: metrics recorded inside a worker process are lost
+            with timed("content_chunk"):
+                return start, await asyncio.get_running_loop().run_in_executor(self._executor, generate_chunk, chunk)
+        finally:
+            self.pending_chunks -= 1
+
+    async def iter_generate(self, products: List[dict]) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """Yield ``(index, result)`` pairs chunk by chunk, as soon as each chunk finishes."""
+        if len(products) <= self.chunk_size:
+            # A single chunk costs less inline than a round-trip to a worker
+            with timed("content_chunk"):
+                results = generate_chunk(products)
+            for index, result in enumerate(results):
+                yield index, result
+            return
+
+        self.start()
+        tasks = [
+            asyncio.ensure_future(self._run_chunk(start, products[start:start + self.chunk_size]))
+            for start in range(0, len(products), self.chunk_size)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                start, results = await next_done
+                for offset, result in enumerate(results):
+                    yield start + offset, result
+        finally:
+            # Client went away: drop chunks that have not started yet
+            for task in tasks:
+                task.cancel()
+
+    async def generate(self, products: List[dict]) -> List[Dict[str, Any]]:
+        """Results for every product, in input order."""
+        results: List[Dict[str, Any]] = [{}] * len(products)
+        async for index, result in self.iter_generate(products):
+            results[index] = result
+        return results
+
+
+content_pool = ContentPool()
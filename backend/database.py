@@ -0,0 +1,598 @@
+"""MongoDB data layer for the DM Sports AI Generator API.
+
+Every route goes through the repositories defined here instead of touching
+collections directly. They use the async Motor driver, so a slow query only
+suspends the request that issued it instead of the whole event loop.
+
+Run ``python database.py indexes`` to create and verify indexes,
+``python database.py explain`` to check that no API query shape falls back
+to a collection scan, or ``python database.py reindex-search`` to rebuild
+product search terms.
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pymongo
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from metrics import mongo_command_metrics, mongo_pool_metrics
+from search import build_search_document
+
+# Configuration
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://127.0.0.1:27017")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "dm_sports_generator")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+# Upper bound for a whole operation (server selection, pool checkout and query)
+MONGO_OPERATION_TIMEOUT_MS = int(os.getenv("MONGO_OPERATION_TIMEOUT_MS", "10000"))
+# Matches scored per search, most recently updated first; deeper pages come back empty
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "1000"))
+MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "true").lower() in ("1", "true", "yes")
+
+
+class IndexBootstrapError(RuntimeError):
+    """Raised when an index cannot be created or does not match its declaration."""
+
+
+class Database:
+    """Owns the Motor client and hands out collections."""
+
+    def __init__(self, url: str = MONGO_URL, name: str = MONGO_DB_NAME):
+        self.url = url
+        self.name = name
+        self.client: Optional[AsyncIOMotorClient] = None
+
+    def connect(self) -> None:
+        if self.client is not None:
+            return
+        self.client = AsyncIOMotorClient(
+            self.url,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            timeoutMS=MONGO_OPERATION_TIMEOUT_MS,
+            event_listeners=[mongo_command_metrics, mongo_pool_metrics],
+        )
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    async def ping(self, timeout_seconds: float) -> None:
+        """One round-trip to the server; raises PyMongoError if it takes longer than ``timeout_seconds``."""
+        self.connect()
+        with pymongo.timeout(timeout_seconds):
+            await self.client.admin.command("ping")
+
+    def collection(self, name: str):
+        # Scripts and tests may use a repository without the app lifecycle
+        self.connect()
+        return self.client[self.name][name]
+
+    def gridfs_bucket(self, name: str) -> AsyncIOMotorGridFSBucket:
+        self.connect()
+        return AsyncIOMotorGridFSBucket(self.client[self.name], bucket_name=name)
+
+
+class UserRepository:
+    collection_name = "users"
+
+    def __init__(self, database: Database):
+        self.database = database
+        self._change_listeners: List[Callable[[str], None]] = []
+
+    def on_change(self, listener: Callable[[str], None]) -> None:
+        """Register a callback run with the username after its account changes."""
+        self._change_listeners.append(listener)
+
+    @property
+    def collection(self):
+        return self.database.collection(self.collection_name)
+
+    async def find_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"username": username})
+
+    async def find_by_username_or_email(self, username: str, email: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"$or": [{"username": username}, {"email": email}]})
+
+    async def create(self, user_data: Dict[str, Any]) -> None:
+        await self.collection.insert_one(user_data)
+
+    async def update(self, username: str, fields: Dict[str, Any]) -> None:
+        await self.collection.update_one({"username": username}, {"$set": fields})
+        for listener in self._change_listeners:
+            listener(username)
+
+    async def set_active(self, username: str, is_active: bool) -> None:
+        await self.update(username, {"is_active": is_active})
+
+    async def replace_password_hash(self, username: str, old_hash: str, new_hash: str) -> None:
+        """Swap in a rehashed password unless the password changed meanwhile."""
+        await self.collection.update_one({"username": username, "password": old_hash}, {"$set": {"password": new_hash}})
+
+    async def set_password(self, username: str, hashed_password: str) -> None:
+        # Tokens issued before this instant are rejected by get_current_user
+        await self.update(username, {"password": hashed_password, "password_changed_at": datetime.utcnow()})
+
+
+# Fields returned by the lightweight library listing (no HTML, first image only)
+PRODUCT_SUMMARY_PROJECTION = {
+    "name": 1,
+    "brand": 1,
+    "category": 1,
+    "gender": 1,
+    "price": 1,
+    "old_price": 1,
+    "sku": 1,
+    "season": 1,
+    "images": {"$slice": 1},
+    "generated_content.title": 1,
+    "created_at": 1,
+    "updated_at": 1,
+}
+
+# Full documents still leave out the search terms, which only serve the index
+PRODUCT_FULL_PROJECTION = {"search": 0}
+
+# Archived products are hidden from listings, search and exports until restored;
+# products without the field are active
+ARCHIVED = {"$ne": None}
+
+# Sort keys allowed for keyset pagination; _id breaks ties between equal values
+PRODUCT_SORT_FIELDS = ("created_at", "updated_at", "name", "price")
+
+
+class ProductRepository:
+    collection_name = "products"
+
+    def __init__(self, database: Database):
+        self.database = database
+
+    @property
+    def collection(self):
+        return self.database.collection(self.collection_name)
+
+    async def list_page(
+        self,
+        user_id: str,
+        sort_field: str = "created_at",
+        descending: bool = True,
+        limit: int = 50,
+        after: Optional[Tuple[Any, str]] = None,
+        projection: Optional[Dict[str, int]] = None,
+        archived: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Return up to ``limit`` products following the ``(value, _id)`` keyset position."""
+        query, sort = self.page_query(user_id, sort_field, descending, after, archived)
+        cursor = self.collection.find(query, projection or PRODUCT_FULL_PROJECTION).sort(sort)
+        return await cursor.limit(limit).to_list(length=limit)
+
+    @staticmethod
+    def page_query(
+        user_id: str,
+        sort_field: str,
+        descending: bool,
+        after: Optional[Tuple[Any, str]] = None,
+        archived: bool = False,
+    ) -> Tuple[Dict[str, Any], List[Tuple[str, int]]]:
+        if sort_field not in PRODUCT_SORT_FIELDS:
+            raise ValueError(f"Unsupported sort field: {sort_field}")
+
+        query: Dict[str, Any] = {"user_id": user_id, "archived_at": ARCHIVED if archived else None}
+        if after is not None:
+            value, last_id = after
+            op = "$lt" if descending else "$gt"
+            query["$or"] = [
+                {sort_field: {op: value}},
+                {sort_field: value, "_id": {op: last_id}},
+            ]
+
+        direction = DESCENDING if descending else ASCENDING
+        return query, [(sort_field, direction), ("_id", direction)]
+
+    def export_cursor(
+        self,
+        user_id: str,
+        brand: Optional[str] = None,
+        category: Optional[str] = None,
+        updated_since: Optional[datetime] = None,
+        updated_before: Optional[datetime] = None,
+        batch_size: int = 500,
+    ):
+        """Cursor over every matching product, oldest change first, fetched ``batch_size`` at a time."""
+        query = self.export_query(user_id, brand, category, updated_since, updated_before)
+        cursor = self.collection.find(query, PRODUCT_FULL_PROJECTION)
+        return cursor.sort([("updated_at", ASCENDING), ("_id", ASCENDING)]).batch_size(batch_size)
+
+    @staticmethod
+    def export_query(
+        user_id: str,
+        brand: Optional[str] = None,
+        category: Optional[str] = None,
+        updated_since: Optional[datetime] = None,
+        updated_before: Optional[datetime] = None,
+    ) -> Dict[str, Any]:
+        query: Dict[str, Any] = {"user_id": user_id, "archived_at": None}
+        if brand:
+            query["brand"] = brand
+        if category:
+            query["category"] = category
+        updated_at: Dict[str, datetime] = {}
+        if updated_since:
+            updated_at["$gte"] = updated_since
+        if updated_before:
+            updated_at["$lt"] = updated_before
+        if updated_at:
+            query["updated_at"] = updated_at
+        return query
+
+    async def search(
+        self,
+        user_id: str,
+        terms: List[str],
+        offset: int = 0,
+        limit: int = 20,
+        projection: Optional[Dict[str, int]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Products matching every term (as a word prefix), best matches first.
+
+        Each term scores 3 when it prefixes a word of the name, brand or SKU
+        and 2 more when it is a whole word. Only the ``SEARCH_MAX_CANDIDATES``
+        most recently updated matches are scored, on their search terms
+        alone; the page is then read by ``_id``.
+        """
+        pipeline = [
+            {"$match": self.search_query(user_id, terms)},
+            {"$sort": {"updated_at": DESCENDING, "_id": DESCENDING}},
+            {"$limit": SEARCH_MAX_CANDIDATES},
+            {"$project": {"search.title_terms": 1, "search.keywords": 1, "updated_at": 1}},
+            {"$addFields": {"_score": {"$add": [
+                {"$multiply": [3, {"$size": {"$setIntersection": ["$search.title_terms", terms]}}]},
+                {"$multiply": [2, {"$size": {"$setIntersection": ["$search.keywords", terms]}}]},
+            ]}}},
+            {"$sort": {"_score": DESCENDING, "updated_at": DESCENDING, "_id": DESCENDING}},
+            {"$skip": offset},
+            {"$limit": limit},
+            {"$project": {"_id": 1}},
+        ]
+        ranked = [document["_id"] for document in await self.collection.aggregate(pipeline).to_list(length=limit)]
+        if not ranked:
+            return []
+        cursor = self.collection.find({"_id": {"$in": ranked}, "user_id": user_id}, projection or PRODUCT_FULL_PROJECTION)
+        documents = {document["_id"]: document for document in await cursor.to_list(length=len(ranked))}
+        return [documents[product_id] for product_id in ranked if product_id in documents]
+
+    @staticmethod
+    def search_query(user_id: str, terms: List[str]) -> Dict[str, Any]:
+        return {"user_id": user_id, "search.terms": {"$all": terms}, "archived_at": None}
+
+    async def get_for_user(self, product_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"_id": product_id, "user_id": user_id}, PRODUCT_FULL_PROJECTION)
+
+    async def find_many_for_user(self, product_ids: List[str], user_id: str) -> List[Dict[str, Any]]:
+        cursor = self.collection.find({"_id": {"$in": product_ids}, "user_id": user_id}, PRODUCT_FULL_PROJECTION)
+        return await cursor.to_list(length=len(product_ids))
+
+    async def find_by_skus(
+        self, user_id: str, skus: List[str], projection: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        cursor = self.collection.find({"user_id": user_id, "sku": {"$in": skus}}, projection or PRODUCT_FULL_PROJECTION)
+        return await cursor.to_list(length=len(skus))
+
+    async def insert(self, product_data: Dict[str, Any]) -> None:
+        await self.collection.insert_one(product_data)
+
+    @staticmethod
+    def version_filter(version: int) -> Dict[str, Any]:
+        # Products written before versioning have no field: they are version 0
+        return {"version": version} if version else {"version": {"$in": [0, None]}}
+
+    @classmethod
+    def update_operation(
+        cls,
+        product_id: str,
+        user_id: str,
+        fields: Dict[str, Any],
+        version: Optional[int] = None,
+        only_if_changed: bool = False,
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """``(filter, update)`` that sets ``fields`` and bumps the version.
+
+        With ``version``, the update only applies if the product is still at
+        that version. With ``only_if_changed``, it only applies if at least
+        one field differs from its stored value.
+        """
+        query: Dict[str, Any] = {"_id": product_id, "user_id": user_id}
+        if version is not None:
+            query.update(cls.version_filter(version))
+        if only_if_changed:
+            query["$or"] = [{field: {"$ne": value}} for field, value in fields.items()]
+        update = {"$set": {**fields, "updated_at": datetime.utcnow()}, "$inc": {"version": 1}}
+        return query, update
+
+    async def update_fields(
+        self,
+        product_id: str,
+        user_id: str,
+        fields: Dict[str, Any],
+        version: Optional[int] = None,
+        only_if_changed: bool = False,
+    ) -> Optional[Dict[str, Any]]:
+        """Apply an update atomically and return the new document, or None if nothing matched."""
+        query, update = self.update_operation(product_id, user_id, fields, version, only_if_changed)
+        return await self.collection.find_one_and_update(
+            query,
+            update,
+            projection=PRODUCT_FULL_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def apply_updates(
+        self,
+        operations: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    ) -> Tuple[int, List[Tuple[int, str]]]:
+        """Run ``(filter, update)`` pairs as one unordered bulk write.
+
+        Returns ``(matched, errors)``, where errors are ``(position, message)``.
+        """
+        requests = [UpdateOne(query, update) for query, update in operations]
+        try:
+            result = await self.collection.bulk_write(requests, ordered=False)
+            return result.matched_count, []
+        except BulkWriteError as e:
+            details = e.details
+            errors = [(error["index"], error["errmsg"]) for error in details.get("writeErrors", [])]
+            return details.get("nMatched", 0), errors
+
+    async def upsert_many_by_sku(
+        self,
+        user_id: str,
+        upserts: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    ) -> Tuple[int, int, List[Tuple[int, str]]]:
+        """Upsert ``(set_fields, insert_only_fields)`` pairs keyed on the user's SKU.
+
+        Runs a single unordered bulk write. Returns ``(inserted, updated,
+        errors)``, where errors are ``(position in upserts, message)``.
+        """
+        operations = [
+            UpdateOne(
+                {"user_id": user_id, "sku": fields["sku"]},
+                {"$set": fields, "$setOnInsert": insert_only, "$inc": {"version": 1}},
+                upsert=True,
+            )
+            for fields, insert_only in upserts
+        ]
+        try:
+            result = await self.collection.bulk_write(operations, ordered=False)
+            return result.upserted_count, result.matched_count, []
+        except BulkWriteError as e:
+            details = e.details
+            errors = [(error["index"], error["errmsg"]) for error in details.get("writeErrors", [])]
+            return details.get("nUpserted", 0), details.get("nMatched", 0), errors
+
+    async def delete_for_user(self, product_id: str, user_id: str) -> bool:
+        result = await self.collection.delete_one({"_id": product_id, "user_id": user_id})
+        return result.deleted_count > 0
+
+    @staticmethod
+    def selection_query(
+        user_id: str,
+        product_ids: Optional[List[str]] = None,
+        brand: Optional[str] = None,
+        season: Optional[str] = None,
+        created_before: Optional[datetime] = None,
+        archived: Optional[bool] = None,
+    ) -> Dict[str, Any]:
+        """Filter for a bulk operation; criteria combine with AND, ``archived=None`` matches both states."""
+        query: Dict[str, Any] = {"user_id": user_id}
+        if product_ids is not None:
+            query["_id"] = {"$in": product_ids}
+        if brand:
+            query["brand"] = brand
+        if season:
+            query["season"] = season
+        if created_before:
+            query["created_at"] = {"$lt": created_before}
+        if archived is not None:
+            query["archived_at"] = ARCHIVED if archived else None
+        return query
+
+    async def delete_many(self, query: Dict[str, Any]) -> int:
+        result = await self.collection.delete_many(query)
+        return result.deleted_count
+
+    async def set_archived(self, query: Dict[str, Any], archived: bool) -> int:
+        """Archive (or restore) every matching product in one update_many; returns how many changed."""
+        now = datetime.utcnow()
+        if archived:
+            query = {**query, "archived_at": None}
+            update = {"$set": {"archived_at": now, "updated_at": now}, "$inc": {"version": 1}}
+        else:
+            query = {**query, "archived_at": ARCHIVED}
+            update = {"$unset": {"archived_at": ""}, "$set": {"updated_at": now}, "$inc": {"version": 1}}
+        result = await self.collection.update_many(query, update)
+        return result.modified_count
+
+
+mongo = Database()
+users_repository = UserRepository(mongo)
+products_repository = ProductRepository(mongo)
+
+
+# Indexes
+INDEXES: Dict[str, List[IndexModel]] = {
+    UserRepository.collection_name: [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    ProductRepository.collection_name: [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created_at"),
+        IndexModel([("user_id", ASCENDING), ("sku", ASCENDING)], name="user_sku_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)], name="user_updated_at"),
+        IndexModel([("user_id", ASCENDING), ("name", ASCENDING), ("_id", ASCENDING)], name="user_name"),
+        IndexModel([("user_id", ASCENDING), ("price", ASCENDING), ("_id", ASCENDING)], name="user_price"),
+        IndexModel([("user_id", ASCENDING), ("search.terms", ASCENDING)], name="user_search_terms"),
+    ],
+}
+
+
+async def ensure_indexes(database: Database = mongo) -> None:
+    """Create every declared index and check the server reports it as declared."""
+    for collection_name, models in INDEXES.items():
+        collection = database.collection(collection_name)
+        try:
+            await collection.create_indexes(models)
+        except OperationFailure as e:
+            raise IndexBootstrapError(
+                f"Could not create indexes on '{collection_name}': {e}. "
+                "Remove duplicate documents or conflicting indexes and restart."
+            ) from e
+
+        existing = await collection.index_information()
+        for model in models:
+            spec = model.document
+            info = existing.get(spec["name"])
+            if info is None:
+                raise IndexBootstrapError(f"Index {collection_name}.{spec['name']} is missing")
+            if list(info["key"]) != list(spec["key"].items()):
+                raise IndexBootstrapError(
+                    f"Index {collection_name}.{spec['name']} has keys {info['key']}, expected {list(spec['key'].items())}"
+                )
+            if bool(info.get("unique")) != bool(spec.get("unique")):
+                raise IndexBootstrapError(f"Index {collection_name}.{spec['name']} has the wrong unique flag")
+
+
+# Query plan verification
+def query_shapes() -> List[Tuple[str, str, Dict[str, Any], Optional[List[Tuple[str, int]]]]]:
+    """Every query shape the API issues, as (name, collection, filter, sort)."""
+    user_id = "explain-user"
+    shapes = [
+        ("users.find_by_username", UserRepository.collection_name, {"username": user_id}, None),
+        (
+            "users.find_by_username_or_email",
+            UserRepository.collection_name,
+            {"$or": [{"username": user_id}, {"email": "explain@dmsports.fr"}]},
+            None,
+        ),
+        ("products.get_for_user", ProductRepository.collection_name, {"_id": "explain-id", "user_id": user_id}, None),
+        (
+            "products.find_many_for_user",
+            ProductRepository.collection_name,
+            {"_id": {"$in": ["explain-id", "explain-id-2"]}, "user_id": user_id},
+            None,
+        ),
+    ]
+    shapes.append((
+        "products.search",
+        ProductRepository.collection_name,
+        ProductRepository.search_query(user_id, ["chau", "nike"]),
+        [("updated_at", DESCENDING), ("_id", DESCENDING)],
+    ))
+    shapes.append((
+        "products.export_cursor",
+        ProductRepository.collection_name,
+        ProductRepository.export_query(user_id, "Nike", "chaussures", datetime(2025, 1, 1)),
+        [("updated_at", ASCENDING), ("_id", ASCENDING)],
+    ))
+    shapes.append((
+        "products.selection",
+        ProductRepository.collection_name,
+        ProductRepository.selection_query(user_id, brand="Nike", created_before=datetime(2025, 1, 1), archived=True),
+        None,
+    ))
+    for sort_field in PRODUCT_SORT_FIELDS:
+        sample_value = 0 if sort_field == "price" else "explain"
+        for descending in (True, False):
+            for after in (None, (sample_value, "explain-id")):
+                query, sort = ProductRepository.page_query(user_id, sort_field, descending, after)
+                name = f"products.list_page[{'-' if descending else ''}{sort_field}{', after' if after else ''}]"
+                shapes.append((name, ProductRepository.collection_name, query, sort))
+    return shapes
+
+
+def plan_stages(plan: Dict[str, Any]) -> List[str]:
+    """Flatten the stage names of an explain() winning plan."""
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(plan_stages(child))
+    return stages
+
+
+async def verify_query_plans(database: Database = mongo) -> List[Tuple[str, List[str]]]:
+    """Explain every query shape; return the ones whose winning plan is a COLLSCAN."""
+    failures = []
+    for name, collection_name, query, sort in query_shapes():
+        cursor = database.collection(collection_name).find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        stages = plan_stages(explanation["queryPlanner"]["winningPlan"])
+        status = "COLLSCAN" if "COLLSCAN" in stages else "ok"
+        print(f"{status:>8}  {name}: {' <- '.join(stages)}")
+        if "COLLSCAN" in stages:
+            failures.append((name, stages))
+    return failures
+
+
+async def reindex_search(database: Database = mongo, batch_size: int = 500) -> int:
+    """Rebuild the search terms of every product; returns the number updated."""
+    collection = database.collection(ProductRepository.collection_name)
+    updated = 0
+    batch = []
+    async for product in collection.find({}, {"search": 0, "images": 0, "generated_content": 0}):
+        batch.append(UpdateOne({"_id": product["_id"]}, {"$set": {"search": build_search_document(product)}}))
+        if len(batch) >= batch_size:
+            updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+    return updated
+
+
+async def _run_command(command: str) -> int:
+    try:
+        if command == "indexes":
+            await ensure_indexes()
+            print("Indexes created and verified")
+            return 0
+
+        if command == "reindex-search":
+            updated = await reindex_search()
+            print(f"Search terms rebuilt for {updated} product(s)")
+            return 0
+
+        failures = await verify_query_plans()
+        if failures:
+            print(f"ERROR: {len(failures)} query shape(s) use a collection scan", file=sys.stderr)
+            return 1
+        print("All query shapes use an index")
+        return 0
+    except IndexBootstrapError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    finally:
+        mongo.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DM Sports database maintenance")
+    parser.add_argument("command", choices=["indexes", "explain", "reindex-search"])
+    args = parser.parse_args()
+    sys.exit(asyncio.run(_run_command(args.command)))
@@ -0,0 +1,260 @@
+"""Live product changes for the DM Sports AI Generator API.
+
+:data:`product_events` fans product changes out to each user's open
+``GET /api/products/events`` streams (Server-Sent Events). Events are:
+
+* ``product``: ``{"product": <summary>, "archived": bool}`` for a created
+  or updated product;
+* ``deleted``: ``{"id": ...}``;
+* ``refresh``: the client should reload its list (bulk operations, imports,
+  or events it missed).
+
+Each event id is ``<stream id>:<sequence>``. The last ``EVENTS_HISTORY_SIZE``
+events of every user are kept, so a client reconnecting with
+``Last-Event-ID`` gets what it missed; if they are gone (or the id comes from
+another process or an earlier run) it gets ``refresh`` instead.
+
+By default the API publishes events itself after each write, which only
+reaches clients connected to the same process. With
+``EVENTS_CHANGE_STREAM=true`` (MongoDB replica set required) every process
+follows a change stream on ``products`` instead, so writes made by any
+worker, script or import are seen everywhere. A delete reaches its owner
+through the document's pre-image (MongoDB 6+, with
+``changeStreamPreAndPostImages`` enabled on the collection) or, failing
+that, through the owner of the last change seen for that product; deletes
+of products nobody changed since the process started are dropped rather
+than sent to other users.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Set
+
+import orjson
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+EVENTS_HISTORY_SIZE = int(os.getenv("EVENTS_HISTORY_SIZE", "500"))
+# Users whose history is kept; the least recently active are forgotten first
+EVENTS_HISTORY_USERS = int(os.getenv("EVENTS_HISTORY_USERS", "10000"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", "3000"))
+EVENTS_CHANGE_STREAM = os.getenv("EVENTS_CHANGE_STREAM", "false").lower() in ("1", "true", "yes")
+# Product owners remembered from the change stream, to route deletes without a pre-image
+EVENTS_OWNERS_SIZE = int(os.getenv("EVENTS_OWNERS_SIZE", "100000"))
+EVENTS_CHANGE_STREAM_RETRY_SECONDS = 5.0
+CHANGE_STREAM_HISTORY_LOST = 286
+# Returned by MongoDB < 6.0, which does not know fullDocumentBeforeChange
+UNKNOWN_FIELD = 40415
+
+
+@dataclass(frozen=True)
+class Event:
+    sequence: int
+    id: str
+    type: str
+    data: bytes
+
+    def encode(self) -> bytes:
+        return b"id: %s\nevent: %s\ndata: %s\n\n" % (self.id.encode(), self.type.encode(), self.data)
+
+
+class Subscription:
+    def __init__(self, user_id: str, backlog: List[Event]):
+        self.user_id = user_id
+        self.backlog = backlog
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+
+
+class ProductEvents:
+    """Per-user pub/sub with a bounded replay history."""
+
+    def __init__(self, history_size: int = EVENTS_HISTORY_SIZE, change_stream: bool = EVENTS_CHANGE_STREAM):
+        self.history_size = history_size
+        self.change_stream = change_stream
+        # Ids from another process or an earlier run are never replayed
+        self.stream_id = uuid.uuid4().hex[:8]
+        self._sequence = 0
+        self._history: "OrderedDict[str, Deque[Event]]" = OrderedDict()
+        # Highest sequence no longer in some history: older ids cannot be replayed
+        self._forgotten: Dict[str, int] = {}
+        self._forgotten_users = 0
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._owners: "OrderedDict[str, str]" = OrderedDict()
+        self._watch_task: Optional[asyncio.Task] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def _event(self, event_type: str, data: Dict[str, Any]) -> Event:
+        self._sequence += 1
+        return Event(self._sequence, f"{self.stream_id}:{self._sequence}", event_type, orjson.dumps(data))
+
+    def _remember(self, user_id: str, event: Event) -> None:
+        history = self._history.get(user_id)
+        if history is None:
+            history = self._history[user_id] = deque()
+            if len(self._history) > EVENTS_HISTORY_USERS:
+                _, oldest = self._history.popitem(last=False)
+                if oldest:
+                    self._forgotten_users = max(self._forgotten_users, oldest[-1].sequence)
+        self._history.move_to_end(user_id)
+        history.append(event)
+        if len(history) > self.history_size:
+            self._forgotten[user_id] = history.popleft().sequence
+
+    def publish(self, user_id: str, event_type: str, data: Dict[str, Any]) -> None:
+        event = self._event(event_type, data)
+        self._remember(user_id, event)
+        for subscription in self._subscribers.get(user_id, ()):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Too slow to keep up: drop its backlog and make it reload
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.queue.put_nowait(Event(event.sequence, event.id, "refresh", b'{"reason":"lagged"}'))
+
+    def notify(self, user_id: str, event_type: str, data: Dict[str, Any]) -> None:
+        """Publish a change made by this process, unless the change stream reports it."""
+        if not self.change_stream:
+            self.publish(user_id, event_type, data)
+
+    def _replay(self, user_id: str, last_event_id: Optional[str]) -> List[Event]:
+        if not last_event_id:
+            return []
+        stream_id, _, sequence = last_event_id.partition(":")
+        history = self._history.get(user_id, ())
+        reload = [Event(self._sequence, f"{self.stream_id}:{self._sequence}", "refresh", b'{"reason":"resume"}')]
+        if stream_id != self.stream_id or not sequence.isdigit():
+            return reload
+        sequence = int(sequence)
+        if sequence < self._forgotten.get(user_id, 0) or (user_id not in self._history and sequence < self._forgotten_users):
+            return reload
+        return [event for event in history if event.sequence > sequence]
+
+    def subscribe(self, user_id: str, last_event_id: Optional[str] = None) -> Subscription:
+        subscription = Subscription(user_id, self._replay(user_id, last_event_id))
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscribers.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.user_id]
+
+    @staticmethod
+    async def reconnect_stream() -> AsyncIterator[bytes]:
+        """A stream that ends at once; the client reconnects after its retry delay."""
+        yield b"retry: %d\n\n" % EVENTS_RETRY_MS
+
+    async def stream(self, subscription: Subscription) -> AsyncIterator[bytes]:
+        """SSE body: missed events, then live ones, with heartbeats to keep proxies from closing it."""
+        try:
+            yield b"retry: %d\n\n" % EVENTS_RETRY_MS
+            for event in subscription.backlog:
+                yield event.encode()
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield event.encode()
+        finally:
+            self.unsubscribe(subscription)
+
+    # Change stream
+    def _remember_owner(self, product_id: str, user_id: str) -> None:
+        self._owners[product_id] = user_id
+        self._owners.move_to_end(product_id)
+        if len(self._owners) > EVENTS_OWNERS_SIZE:
+            self._owners.popitem(last=False)
+
+    def _apply_change(self, change: Dict[str, Any], serialize: Callable[[dict], dict]) -> None:
+        operation = change["operationType"]
+        product_id = str(change["documentKey"]["_id"])
+        if operation == "delete":
+            before = change.get("fullDocumentBeforeChange") or {}
+            # Without a pre-image (MongoDB < 6 or not enabled) only an owner seen earlier is known
+            owner = before.get("user_id") or self._owners.get(product_id)
+            self._owners.pop(product_id, None)
+            if owner:
+                self.publish(owner, "deleted", {"id": product_id})
+            else:
+                logger.debug("Owner of deleted product %s unknown, event dropped", product_id)
+            return
+        document = change.get("fullDocument")
+        if document and document.get("user_id"):
+            self._remember_owner(product_id, document["user_id"])
+            self.publish(document["user_id"], "product", {
+                "product": serialize(document),
+                "archived": document.get("archived_at") is not None,
+            })
+
+    async def _watch(self, collection, serialize: Callable[[dict], dict]) -> None:
+        resume_token = None
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        options = {"full_document_before_change": "whenAvailable"}
+        while True:
+            try:
+                async with collection.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    resume_after=resume_token,
+                    # Each wait stays well under the client's operation timeout
+                    max_await_time_ms=1000,
+                    **options,
+                ) as changes:
+                    async for change in changes:
+                        resume_token = changes.resume_token
+                        self._apply_change(change, serialize)
+            except OperationFailure as e:
+                if options and (e.code == UNKNOWN_FIELD or "fullDocumentBeforeChange" in str(e)):
+                    logger.warning("MongoDB does not support change stream pre-images, watching without them")
+                    options = {}
+                    continue
+                if e.code != CHANGE_STREAM_HISTORY_LOST:
+                    # Not transient (e.g. not a replica set): retrying would only repeat it
+                    logger.error("Product change stream failed, changes made elsewhere are no longer streamed: %s", e)
+                    return
+                # Fell off the oplog: start over, clients reload what they missed
+                logger.warning("Product change stream history lost, restarting from now")
+                resume_token = None
+                for user_id in list(self._subscribers):
+                    self.publish(user_id, "refresh", {"reason": "resume"})
+            except PyMongoError as e:
+                logger.warning("Product change stream interrupted (%s), retrying", e)
+                await asyncio.sleep(EVENTS_CHANGE_STREAM_RETRY_SECONDS)
+
+    def start(self, collection, serialize: Callable[[dict], dict]) -> None:
+        if self.change_stream and self._watch_task is None:
+            self._watch_task = asyncio.get_running_loop().create_task(self._watch(collection, serialize))
+
+    def close_streams(self) -> None:
+        """End every open stream; clients reconnect (to another process when draining)."""
+        for subscriptions in self._subscribers.values():
+            for subscription in subscriptions:
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.queue.put_nowait(None)
+
+    def shutdown(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+        self.close_streams()
+
+
+product_events = ProductEvents()
@@ -0,0 +1,457 @@
+"""Content-addressed image store for the DM Sports AI Generator API.
+
+Uploaded images are kept on local disk in their original encoding, named by
+the SHA-256 of their bytes (``originals/ab/<hash>.jpg``). Products only hold
+the short ``/api/images/<hash>`` reference. Identical uploads are stored
+once, and the files never change, so they can be cached forever.
+
+Resized derivatives (``/api/images/<hash>/thumb.webp`` ...) are rendered by
+a background thread pool: the common ones right after upload, any other one
+on first request. They are kept in a size-bounded LRU disk cache and can
+always be regenerated from the original.
+
+When ``IMAGE_GRIDFS_BUCKET`` is set, originals are also copied to a GridFS
+bucket and a local miss is filled from it, so several API instances (or a
+fresh disk) can serve every image.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from gridfs.errors import FileExists, NoFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+from starlette.concurrency import run_in_threadpool
+
+from database import Database, mongo
+from metrics import timed
+from throttling import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_store"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(40_000_000)))
+IMAGE_READ_CHUNK_SIZE = 64 * 1024
+IMAGE_URL_PREFIX = "/api/images/"
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_DERIVATIVE_CACHE_BYTES = int(os.getenv("IMAGE_DERIVATIVE_CACHE_BYTES", str(2 * 1024 ** 3)))
+# Rendered right after upload; every other derivative is rendered on first request
+IMAGE_EAGER_DERIVATIVES = os.getenv("IMAGE_EAGER_DERIVATIVES", "thumb.webp,sm.webp,md.webp").split(",")
+# Empty: originals only live on local disk
+IMAGE_GRIDFS_BUCKET = os.getenv("IMAGE_GRIDFS_BUCKET", "")
+
+# PIL format -> (file extension, media type)
+IMAGE_FORMATS = {
+    "JPEG": ("jpg", "image/jpeg"),
+    "PNG": ("png", "image/png"),
+    "WEBP": ("webp", "image/webp"),
+    "GIF": ("gif", "image/gif"),
+}
+MEDIA_TYPES = {extension: media_type for extension, media_type in IMAGE_FORMATS.values()}
+
+HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# What Pillow raises for a file it cannot (or will not) decode
+UNREADABLE_IMAGE_ERRORS = (UnidentifiedImageError, SyntaxError, ValueError, Image.DecompressionBombError)
+
+# Derivative name -> longest side in pixels
+DERIVATIVE_SIZES = {"thumb": 160, "sm": 320, "md": 640, "lg": 1280}
+# Derivative extension -> (PIL format, media type, encoder options)
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+class ImageRejected(ValueError):
+    """The upload is not an acceptable image (format, size or pixel count)."""
+
+
+@dataclass
+class StoredImage:
+    hash: str
+    format: str
+    width: int
+    height: int
+    size: int
+    created: bool
+
+    @property
+    def url(self) -> str:
+        return f"{IMAGE_URL_PREFIX}{self.hash}"
+
+    def derivative_url(self, variant: str) -> str:
+        return derivative_url(self.hash, variant)
+
+
+def derivative_url(image_hash: str, variant: str) -> str:
+    return f"{IMAGE_URL_PREFIX}{image_hash}/{variant}"
+
+
+def parse_variant(variant: str) -> Optional[Tuple[str, str]]:
+    """Split "thumb.webp" into ("thumb", "webp") if both parts are known."""
+    size, _, extension = variant.partition(".")
+    if size in DERIVATIVE_SIZES and extension in DERIVATIVE_FORMATS:
+        return size, extension
+    return None
+
+
+def image_hash_from_url(url: str) -> Optional[str]:
+    """The hash referenced by an ``/api/images/<hash>`` URL, if it is one."""
+    if url.startswith(IMAGE_URL_PREFIX):
+        candidate = url[len(IMAGE_URL_PREFIX):].split("?", 1)[0].split("/", 1)[0]
+        if HASH_RE.match(candidate):
+            return candidate
+    return None
+
+
+class ImageStore:
+    def __init__(self, root: str = IMAGE_STORE_DIR, max_bytes: int = IMAGE_MAX_BYTES, max_pixels: int = IMAGE_MAX_PIXELS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        # The same image uploaded concurrently (double submits, retries) is verified once
+        self._commits = SingleFlight("image_commit")
+
+    def _directory(self, image_hash: str) -> str:
+        return os.path.join(self.root, "originals", image_hash[:2])
+
+    def find(self, image_hash: str) -> Optional[Tuple[str, str]]:
+        """Return (path, media type) of a stored original, or None."""
+        if not HASH_RE.match(image_hash):
+            return None
+        directory = self._directory(image_hash)
+        for extension, media_type in MEDIA_TYPES.items():
+            path = os.path.join(directory, f"{image_hash}.{extension}")
+            if os.path.exists(path):
+                return path, media_type
+        return None
+
+    def _temporary_file(self):
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+
+    def _inspect(self, path: str) -> Tuple[str, int, int]:
+        """Check format and pixel count from the header, then verify the file."""
+        try:
+            with timed("image_inspect"), Image.open(path) as image:
+                image_format, (width, height) = image.format, image.size
+                if image_format not in IMAGE_FORMATS:
+                    raise ImageRejected(f"Unsupported image format: {image_format}")
+                if width * height > self.max_pixels:
+                    raise ImageRejected(f"Image has {width * height} pixels, the limit is {self.max_pixels}")
+                image.verify()
+        except UnidentifiedImageError:
+            raise ImageRejected("Unrecognized image file")
+        except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+            raise ImageRejected(f"Corrupted image: {type(e).__name__}")
+        return image_format, width, height
+
+    def commit(self, tmp_path: str, image_hash: str, size: int) -> StoredImage:
+        """Validate a fully written temporary file and move it into place (or drop it if known)."""
+        try:
+            image_format, width, height = self._inspect(tmp_path)
+            extension = IMAGE_FORMATS[image_format][0]
+            directory = self._directory(image_hash)
+            final_path = os.path.join(directory, f"{image_hash}.{extension}")
+            created = not os.path.exists(final_path)
+            if created:
+                os.makedirs(directory, exist_ok=True)
+                os.replace(tmp_path, final_path)
+            return StoredImage(image_hash, image_format, width, height, size, created)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    async def save_upload(self, upload) -> StoredImage:
+        """Stream an UploadFile to disk while hashing it, enforcing the byte limit as it goes."""
+        digest = hashlib.sha256()
+        size = 0
+        tmp = self._temporary_file()
+        try:
+            while True:
+                chunk = await upload.read(IMAGE_READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise ImageRejected(f"Image is larger than {self.max_bytes} bytes")
+                digest.update(chunk)
+                tmp.write(chunk)
+            tmp.close()
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+        if size == 0:
+            os.unlink(tmp.name)
+            raise ImageRejected("Empty file")
+        image_hash = digest.hexdigest()
+        committing = False
+
+        def commit():
+            nonlocal committing
+            committing = True
+            return run_in_threadpool(self.commit, tmp.name, image_hash, size)
+
+        try:
+            stored, _ = await self._commits.do(image_hash, commit)
+        finally:
+            # commit() owns its file; ours is unused if another upload of the same bytes did the work
+            if not committing:
+                os.unlink(tmp.name)
+        return stored
+
+    def put_bytes(self, data: bytes) -> StoredImage:
+        """Store an in-memory image (used when migrating embedded images)."""
+        if len(data) > self.max_bytes:
+            raise ImageRejected(f"Image is larger than {self.max_bytes} bytes")
+        tmp = self._temporary_file()
+        with tmp:
+            tmp.write(data)
+        return self.commit(tmp.name, hashlib.sha256(data).hexdigest(), len(data))
+
+
+class GridFSMirror:
+    """Copies originals to a GridFS bucket and restores local misses from it.
+
+    The local store stays the read path; GridFS is only read once per image
+    and instance. Files use the image hash as their ``_id``.
+    """
+
+    def __init__(self, store: ImageStore, database: Database = mongo, bucket_name: str = IMAGE_GRIDFS_BUCKET):
+        self.store = store
+        self.database = database
+        self.bucket_name = bucket_name
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.bucket_name)
+
+    @property
+    def bucket(self):
+        return self.database.gridfs_bucket(self.bucket_name)
+
+    async def put(self, stored: StoredImage) -> bool:
+        """Upload a stored original unless the bucket already has it; True if uploaded."""
+        files = self.database.collection(f"{self.bucket_name}.files")
+        if await files.find_one({"_id": stored.hash}, {"_id": 1}) is not None:
+            return False
+        path, media_type = self.store.find(stored.hash)
+        try:
+            with open(path, "rb") as source:
+                await self.bucket.upload_from_stream_with_id(
+                    stored.hash,
+                    os.path.basename(path),
+                    source,
+                    metadata={"contentType": media_type, "width": stored.width, "height": stored.height},
+                )
+        except FileExists:
+            # Another instance uploaded the same image meanwhile
+            return False
+        return True
+
+    async def fetch(self, image_hash: str) -> Optional[Tuple[str, str]]:
+        """Copy an original missing from local disk out of GridFS; (path, media type) or None."""
+        if not self.enabled or not HASH_RE.match(image_hash):
+            return None
+        try:
+            stream = await self.bucket.open_download_stream(image_hash)
+        except NoFile:
+            return None
+        data = await stream.read()
+        await run_in_threadpool(self.store.put_bytes, data)
+        return self.store.find(image_hash)
+
+
+def render_derivative(source_path: str, target_path: str, size: str, extension: str) -> int:
+    """Resize an original into ``target_path``; returns the bytes written.
+
+    JPEG sources are decoded at reduced scale with draft(), then shrunk by an
+    integer factor with reduce() before the final high-quality resample.
+    Images are never upscaled.
+    """
+    box = DERIVATIVE_SIZES[size]
+    pil_format, _, options = DERIVATIVE_FORMATS[extension]
+    with Image.open(source_path) as image:
+        if image.format == "JPEG":
+            image.draft("RGB", (box, box))
+        image = ImageOps.exif_transpose(image)
+        factor = min(image.width // box, image.height // box)
+        if factor >= 2:
+            image = image.reduce(factor)
+        image.thumbnail((box, box), Image.LANCZOS)
+
+        if pil_format == "JPEG" and image.mode != "RGB":
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        tmp_path = f"{target_path}.{threading.get_ident()}.tmp"
+        image.save(tmp_path, pil_format, **options)
+    os.replace(tmp_path, target_path)
+    return os.path.getsize(target_path)
+
+
+class DerivativeCache:
+    """Background renderer and LRU disk cache for image derivatives.
+
+    Concurrent requests for the same derivative share one rendering job. The
+    cache tracks file sizes in memory (seeded from disk by modification time
+    on start) and deletes the least recently served files past ``max_bytes``.
+    """
+
+    def __init__(self, store: ImageStore, max_bytes: int = IMAGE_DERIVATIVE_CACHE_BYTES, workers: int = IMAGE_WORKERS):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, asyncio.Future] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def root(self) -> str:
+        return os.path.join(self.store.root, "derivatives")
+
+    @property
+    def pending_jobs(self) -> int:
+        return len(self._jobs)
+
+    def path_for(self, image_hash: str, size: str, extension: str) -> Optional[str]:
+        """Where a derivative is cached; None unless ``image_hash`` (taken from the URL) is a SHA-256 hash."""
+        if not HASH_RE.match(image_hash):
+            return None
+        return os.path.join(self.root, image_hash[:2], image_hash, f"{size}.{extension}")
+
+    def start(self) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-derivatives")
+            self._executor.submit(self._scan)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _scan(self) -> None:
+        found = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, path, stat.st_size))
+        with self._lock:
+            # Files seen on disk are older than anything rendered since start
+            for _, path, size in sorted(found, reverse=True):
+                if path not in self._entries:
+                    self._entries[path] = size
+                    self._entries.move_to_end(path, last=False)
+                    self.total_bytes += size
+        self._evict()
+
+    def _record(self, path: str, size: int) -> None:
+        with self._lock:
+            self.total_bytes += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+        self._evict()
+
+    def _touch(self, path: str) -> None:
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+
+    def _evict(self) -> None:
+        victims = []
+        with self._lock:
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                path, size = self._entries.popitem(last=False)
+                self.total_bytes -= size
+                victims.append(path)
+        for path in victims:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _render(self, source_path: str, target_path: str, size: str, extension: str) -> None:
+        with timed("image_derivative"):
+            self._record(target_path, render_derivative(source_path, target_path, size, extension))
+
+    def _submit(self, image_hash: str, size: str, extension: str) -> Optional[asyncio.Future]:
+        """Start (or join) the job rendering one derivative; None if the original is unknown."""
+        target_path = self.path_for(image_hash, size, extension)
+        if target_path is None:
+            return None
+        job = self._jobs.get(target_path)
+        if job is not None:
+            return job
+        found = self.store.find(image_hash)
+        if found is None:
+            return None
+
+        self.start()
+        job = asyncio.wrap_future(self._executor.submit(self._render, found[0], target_path, size, extension))
+        self._jobs[target_path] = job
+
+        def finished(done: asyncio.Future) -> None:
+            self._jobs.pop(target_path, None)
+            if not done.cancelled() and done.exception() is not None:
+                logger.warning("Could not render %s: %s", target_path, done.exception())
+
+        job.add_done_callback(finished)
+        return job
+
+    def schedule(self, image_hash: str, variants: Iterable[str] = IMAGE_EAGER_DERIVATIVES) -> None:
+        """Render derivatives in the background without waiting for them."""
+        for variant in variants:
+            parsed = parse_variant(variant.strip())
+            target_path = parsed and self.path_for(image_hash, *parsed)
+            if target_path and not os.path.exists(target_path):
+                self._submit(image_hash, *parsed)
+
+    async def get(self, image_hash: str, size: str, extension: str) -> Optional[str]:
+        """Path of a derivative, rendering it first if needed; None if the original is unknown."""
+        target_path = self.path_for(image_hash, size, extension)
+        if target_path is None:
+            return None
+        if os.path.exists(target_path):
+            self._touch(target_path)
+            return target_path
+        job = self._submit(image_hash, size, extension)
+        if job is None:
+            return None
+        await asyncio.shield(job)
+        return target_path
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "files": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "pending_jobs": self.pending_jobs,
+        }
+
+
+image_store = ImageStore()
+image_mirror = GridFSMirror(image_store)
+image_derivatives = DerivativeCache(image_store)
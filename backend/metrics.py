@@ -0,0 +1,272 @@
+"""Prometheus metrics for the DM Sports AI Generator API.
+
+* ``http_request_duration_seconds{method,route,status}`` and
+  ``http_requests_in_flight``, recorded by :class:`MetricsMiddleware`.
+  ``route`` is the route template (``/api/products/{product_id}``), never the
+  raw path, so label cardinality stays bounded.
+* ``mongo_command_duration_seconds{collection,command,outcome}``, recorded by
+  :class:`MongoCommandMetrics`, a pymongo command listener.
+* ``mongo_pool_checked_out``, ``mongo_pool_wait_seconds`` and
+  ``mongo_pool_checkout_failures_total{reason}``: connection pool saturation,
+  from :class:`MongoPoolMetrics`.
+* ``stage_duration_seconds{stage}`` for CPU-heavy stages (content generation,
+  bcrypt, Pillow), recorded with :func:`timed`.
+* ``event_loop_lag_seconds``: how late a periodic timer fires, measured by
+  :class:`EventLoopMonitor`. A blocked event loop shows up here first.
+* ``executor_queue_depth{executor}``: work waiting in the process and thread
+  pools, sampled with the event loop lag from callbacks registered with
+  :func:`watch_queue_depth`.
+* ``rate_limited_requests_total{route}`` and ``coalesced_calls_total{name}``,
+  counted by :mod:`throttling`.
+
+With several worker processes, set ``PROMETHEUS_MULTIPROC_DIR`` (``serve.py``
+does) so every worker writes its samples there and ``/metrics`` reports the
+sum over all of them.
+
+Stage and Mongo timings are also handed to :mod:`profiling`, which keeps
+them when the current request is being profiled.
+"""
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from pymongo import monitoring
+
+from profiling import record_stage
+
+# Configuration
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5"))
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+
+# Finer than the defaults: most Mongo commands and stages take milliseconds
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency, until the last body chunk is sent",
+    ["method", "route", "status"],
+)
+# livesum: summed over the worker processes that are still running
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being handled", multiprocess_mode="livesum")
+MONGO_LATENCY = Histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command round-trip time",
+    ["collection", "command", "outcome"],
+    buckets=FAST_BUCKETS,
+)
+MONGO_POOL_CHECKED_OUT = Gauge("mongo_pool_checked_out", "Connections in use", multiprocess_mode="livesum")
+MONGO_POOL_WAIT = Histogram(
+    "mongo_pool_wait_seconds",
+    "Time waiting for a pooled connection",
+    buckets=FAST_BUCKETS,
+)
+MONGO_POOL_FAILURES = Counter("mongo_pool_checkout_failures_total", "Failed connection check-outs", ["reason"])
+STAGE_LATENCY = Histogram(
+    "stage_duration_seconds",
+    "Time spent in CPU-heavy stages",
+    ["stage"],
+    buckets=FAST_BUCKETS,
+)
+STAGE_ERRORS = Counter("stage_errors_total", "Stages that raised", ["stage"])
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay between when a timer should fire and when it does",
+    buckets=FAST_BUCKETS,
+)
+EXECUTOR_QUEUE_DEPTH = Gauge("executor_queue_depth", "Work items waiting for a worker", ["executor"], multiprocess_mode="livesum")
+RATE_LIMITED = Counter("rate_limited_requests_total", "Requests rejected by the per-user rate limit", ["route"])
+COALESCED_CALLS = Counter("coalesced_calls_total", "Calls that shared the result of an identical one in flight", ["name"])
+
+# executor name -> callable returning its current queue depth
+_queue_depths: Dict[str, Callable[[], int]] = {}
+
+
+def watch_queue_depth(executor: str, depth: Callable[[], int]) -> None:
+    """Report ``depth()`` as ``executor_queue_depth{executor}``."""
+    _queue_depths[executor] = depth
+
+
+def sample_queue_depths() -> None:
+    for executor, depth in _queue_depths.items():
+        EXECUTOR_QUEUE_DEPTH.labels(executor).set(depth())
+
+
+@contextmanager
+def timed(stage: str):
+    """Record the duration of the enclosed block as ``stage``."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage).observe(elapsed)
+        record_stage(stage, elapsed)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command sent by a client it is registered on."""
+
+    def __init__(self):
+        # (connection, request id) -> collection, from started to succeeded/failed
+        self._collections: Dict[Tuple[object, int], str] = {}
+
+    @staticmethod
+    def _collection(event: monitoring.CommandStartedEvent) -> str:
+        command = event.command
+        target = command.get("collection") if event.command_name == "getMore" else command.get(event.command_name)
+        return target if isinstance(target, str) else "-"
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        self._collections[(event.connection_id, event.request_id)] = self._collection(event)
+
+    def _observe(self, event, outcome: str) -> None:
+        collection = self._collections.pop((event.connection_id, event.request_id), "-")
+        seconds = event.duration_micros / 1e6
+        MONGO_LATENCY.labels(collection, event.command_name, outcome).observe(seconds)
+        record_stage(f"mongo {collection}.{event.command_name}", seconds)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._observe(event, "ok")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._observe(event, "error")
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Connections checked out of the pools of a client it is registered on."""
+
+    def __init__(self):
+        self.checked_out = 0
+        self._lock = threading.Lock()
+        # Check-out started and finished events arrive on the same thread
+        self._waiting = threading.local()
+
+    def _checked_out_delta(self, delta: int) -> None:
+        with self._lock:
+            self.checked_out += delta
+        MONGO_POOL_CHECKED_OUT.inc(delta)
+
+    def connection_check_out_started(self, event) -> None:
+        self._waiting.since = time.perf_counter()
+
+    def _waited(self) -> None:
+        since = getattr(self._waiting, "since", None)
+        if since is not None:
+            MONGO_POOL_WAIT.observe(time.perf_counter() - since)
+            self._waiting.since = None
+
+    def connection_checked_out(self, event) -> None:
+        self._waited()
+        self._checked_out_delta(1)
+
+    def connection_check_out_failed(self, event) -> None:
+        self._waited()
+        MONGO_POOL_FAILURES.labels(str(event.reason)).inc()
+
+    def connection_checked_in(self, event) -> None:
+        self._checked_out_delta(-1)
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_created(self, event) -> None:
+        pass
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        pass
+
+
+class EventLoopMonitor:
+    """Wakes up every ``interval`` seconds, records how late it woke up and samples queue depths."""
+
+    def __init__(self, interval: float = EVENT_LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - expected)
+            EVENT_LOOP_LAG.observe(self.last_lag)
+            sample_queue_depths()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if PROMETHEUS_MULTIPROC_DIR:
+            # Drop this worker's live gauges from the totals
+            multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            # Set by the router once a route matched
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status_code),
+            ).observe(time.perf_counter() - start)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Current metrics in the Prometheus text format, with their content type."""
+    sample_queue_depths()
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+event_loop_monitor = EventLoopMonitor()
+mongo_command_metrics = MongoCommandMetrics()
+mongo_pool_metrics = MongoPoolMetrics()
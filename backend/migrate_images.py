@@ -0,0 +1,205 @@
+"""Move base64 images embedded in products into the image store.
+
+Older products carry ``data:image/...;base64,...`` strings in ``images``,
+which makes every read of them heavy. This command decodes them into the
+content-addressed image store (and optionally a GridFS bucket) and rewrites
+them as ``/api/images/<hash>`` references.
+
+The migration is safe to run against a live database:
+
+* products are scanned in ``_id`` order with a single cursor, in batches;
+* each batch is rewritten with one unordered bulk write, conditional on the
+  ``images`` array being unchanged, so concurrent edits are never clobbered;
+* the last processed ``_id`` and running totals are checkpointed in the
+  ``migrations`` collection after each batch, so an interrupted run resumes
+  where it stopped (a completed run starts a fresh pass);
+* ``--max-products-per-second`` throttles the scan.
+
+Images that cannot be decoded or are rejected by the store stay embedded
+and are reported. Re-running the command is harmless.
+
+Usage::
+
+    python migrate_images.py [--target files|gridfs] [--batch-size 100]
+                             [--max-products-per-second 200] [--restart]
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from database import ProductRepository, mongo
+from images import IMAGE_GRIDFS_BUCKET, GridFSMirror, ImageRejected, image_store
+
+MIGRATION_ID = "externalize-images"
+EMBEDDED_PREFIX = "data:"
+COUNTERS = ("products_scanned", "products_migrated", "images_extracted", "images_failed", "conflicts", "bytes_reclaimed")
+
+
+def decode_data_url(url: str) -> bytes:
+    """Bytes of a ``data:<type>;base64,<payload>`` URL."""
+    header, separator, payload = url.partition(",")
+    if not separator or not header.endswith(";base64"):
+        raise ValueError("not a base64 data URL")
+    try:
+        return base64.b64decode(payload)
+    except binascii.Error as e:
+        raise ValueError(f"invalid base64: {e}")
+
+
+class ImageMigration:
+    def __init__(self, batch_size: int, max_per_second: float, mirror: Optional[GridFSMirror] = None):
+        self.batch_size = batch_size
+        self.max_per_second = max_per_second
+        self.mirror = mirror
+        self.products = mongo.collection(ProductRepository.collection_name)
+        self.checkpoints = mongo.collection("migrations")
+
+    async def load_checkpoint(self, restart: bool) -> Dict[str, Any]:
+        if restart:
+            await self.checkpoints.delete_one({"_id": MIGRATION_ID})
+        checkpoint = await self.checkpoints.find_one({"_id": MIGRATION_ID}) or {}
+        if checkpoint.get("completed_at"):
+            # Only interrupted runs resume; a finished one starts a new pass
+            checkpoint = {}
+        return {"last_id": checkpoint.get("last_id"), **{name: checkpoint.get(name, 0) for name in COUNTERS}}
+
+    async def save_checkpoint(self, last_id, totals: Dict[str, int], completed: bool = False) -> None:
+        fields = {"last_id": last_id, "updated_at": datetime.utcnow(), **{name: totals[name] for name in COUNTERS}}
+        if completed:
+            fields["completed_at"] = fields["updated_at"]
+        await self.checkpoints.update_one({"_id": MIGRATION_ID}, {"$set": fields}, upsert=True)
+
+    async def externalize(self, url: str) -> str:
+        """Store one embedded image; returns its reference URL."""
+        stored = image_store.put_bytes(decode_data_url(url))
+        if self.mirror is not None:
+            await self.mirror.put(stored)
+        return stored.url
+
+    async def rewrite(self, product: Dict[str, Any], stats: Dict[str, int]) -> Optional[Tuple[UpdateOne, List[str], int]]:
+        """Bulk operation replacing a product's embedded images, with the new list and the bytes it saves."""
+        images: List[str] = product.get("images") or []
+        rewritten, saved = [], 0
+        for url in images:
+            if isinstance(url, str) and url.startswith(EMBEDDED_PREFIX):
+                try:
+                    reference = await self.externalize(url)
+                except (ValueError, ImageRejected) as e:
+                    # ImageRejected is a ValueError too; both leave the image embedded
+                    stats["images_failed"] += 1
+                    print(f"  product {product['_id']}: image kept embedded ({e})", file=sys.stderr)
+                else:
+                    stats["images_extracted"] += 1
+                    saved += len(url) - len(reference)
+                    url = reference
+            rewritten.append(url)
+        if rewritten == images:
+            return None
+        # Only applies if nobody edited the images since they were read
+        # Bump the version so cached copies (ETag) of the product are refreshed
+        update = {"$set": {"images": rewritten}, "$inc": {"version": 1}}
+        return UpdateOne({"_id": product["_id"], "images": images}, update), rewritten, saved
+
+    async def run_batch(self, batch: List[Dict[str, Any]], totals: Dict[str, int]) -> None:
+        stats = {name: 0 for name in COUNTERS}
+        stats["products_scanned"] = len(batch)
+        operations, rewritten, savings = [], {}, {}
+        for product in batch:
+            rewrite = await self.rewrite(product, stats)
+            if rewrite is not None:
+                operations.append(rewrite[0])
+                rewritten[product["_id"]] = rewrite[1]
+                savings[product["_id"]] = rewrite[2]
+
+        if operations:
+            result = await self.products.bulk_write(operations, ordered=False)
+            if result.matched_count < len(operations):
+                # Products edited (or deleted) mid-batch: an update was applied only where the
+                # images are now exactly the list it set. Images that could not be decoded stay
+                # embedded on purpose, so their presence says nothing about a conflict.
+                cursor = self.products.find({"_id": {"$in": list(savings)}}, {"images": 1})
+                applied = {
+                    product["_id"]
+                    for product in await cursor.to_list(length=len(savings))
+                    if product.get("images") == rewritten[product["_id"]]
+                }
+                for product_id in list(savings):
+                    if product_id not in applied:
+                        del savings[product_id]
+                        stats["conflicts"] += 1
+            stats["products_migrated"] = len(savings)
+            stats["bytes_reclaimed"] = sum(savings.values())
+
+        for name in COUNTERS:
+            totals[name] += stats[name]
+
+    async def run(self, restart: bool = False) -> Dict[str, Any]:
+        totals = await self.load_checkpoint(restart)
+        query: Dict[str, Any] = {"images": {"$regex": f"^{EMBEDDED_PREFIX}"}}
+        if totals["last_id"] is not None:
+            query["_id"] = {"$gt": totals["last_id"]}
+            print(f"Resuming after product {totals['last_id']}")
+
+        cursor = self.products.find(query, {"images": 1}).sort("_id", 1).batch_size(self.batch_size)
+        batch: List[Dict[str, Any]] = []
+        started = time.monotonic()
+        async for product in cursor:
+            batch.append(product)
+            if len(batch) >= self.batch_size:
+                await self.finish_batch(batch, totals, started)
+                batch = []
+                started = time.monotonic()
+        if batch:
+            await self.finish_batch(batch, totals, started)
+        await self.save_checkpoint(totals["last_id"], totals, completed=True)
+        return totals
+
+    async def finish_batch(self, batch: List[Dict[str, Any]], totals: Dict[str, Any], started: float) -> None:
+        await self.run_batch(batch, totals)
+        totals["last_id"] = batch[-1]["_id"]
+        await self.save_checkpoint(totals["last_id"], totals)
+        print(
+            f"  {totals['products_scanned']} scanned, {totals['products_migrated']} migrated, "
+            f"{totals['bytes_reclaimed'] / 1024 ** 2:.1f} MiB reclaimed"
+        )
+        if self.max_per_second > 0:
+            # Leave the database headroom for live traffic
+            remaining = len(batch) / self.max_per_second - (time.monotonic() - started)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
+
+async def _run(args) -> int:
+    mirror = None
+    if args.target == "gridfs":
+        mirror = GridFSMirror(image_store, mongo, args.bucket)
+    try:
+        totals = await ImageMigration(args.batch_size, args.max_products_per_second, mirror).run(args.restart)
+    finally:
+        mongo.close()
+
+    print(
+        f"Done: {totals['products_migrated']} product(s) migrated, "
+        f"{totals['images_extracted']} image(s) extracted, {totals['images_failed']} kept embedded, "
+        f"{totals['conflicts']} skipped because they changed during the migration (run again to retry them)"
+    )
+    print(f"Bytes reclaimed: {totals['bytes_reclaimed']} ({totals['bytes_reclaimed'] / 1024 ** 2:.1f} MiB)")
+    return 1 if totals["images_failed"] or totals["conflicts"] else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move embedded base64 product images into the image store")
+    parser.add_argument("--target", choices=["files", "gridfs"], default="files",
+                        help="also copy images to a GridFS bucket (the API serves them with IMAGE_GRIDFS_BUCKET)")
+    parser.add_argument("--bucket", default=IMAGE_GRIDFS_BUCKET or "images", help="GridFS bucket name")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--max-products-per-second", type=float, default=200, help="0 disables throttling")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and scan from the start")
+    sys.exit(asyncio.run(_run(parser.parse_args())))
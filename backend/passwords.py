@@ -0,0 +1,111 @@
+"""Password hashing for the DM Sports AI Generator API.
+
+bcrypt costs 100-300 ms of CPU per call, so hashes are computed in a
+dedicated process pool instead of on the event loop thread. Admission is
+bounded: at most ``PASSWORD_HASH_WORKERS`` hashes run at once and at most
+``PASSWORD_HASH_MAX_PENDING`` more wait for a slot. Beyond that, callers get
+:class:`PasswordHasherBusy` immediately, so a login burst cannot pile up
+work that starves product traffic.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+from metrics import timed
+
+# Configuration
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+# Hashes made with any other cost are flagged for rehash on the next login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Raised when too many hashing requests are already queued."""
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Return ``(valid, new_hash)``; ``new_hash`` is set when the cost changed."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def load_backend() -> int:
+    """Worker warm-up: import and select the bcrypt backend without hashing anything."""
+    pwd_context.handler("bcrypt").get_backend()
+    return os.getpid()
+
+
+class PasswordHasher:
+    """Runs bcrypt in a process pool behind an admission limit."""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(workers)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def queue_depth(self) -> int:
+        """Requests admitted but still waiting for a worker."""
+        return max(0, self.in_flight - self.workers)
+
+    def start(self) -> None:
+        if self._executor is None:
+            # spawn: never fork the event loop, Mongo client threads and all
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def warm_up(self) -> None:
+        """Spawn every worker now, so the first logins do not pay for it."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, load_backend) for _ in range(self.workers)))
+
+    async def _run(self, stage: str, func, *args):
+        if self.in_flight >= self.workers + self.max_pending:
+            raise PasswordHasherBusy("Too many password operations in progress")
+        self.start()
+        self.in_flight += 1
+        try:
+            with timed("bcrypt_queue_wait"):
+                await self._slots.acquire()
+            try:
+                with timed(stage):
+                    return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+            finally:
+                self._slots.release()
+        finally:
+            self.in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run("bcrypt_hash", hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run("bcrypt_verify", verify_password, plain_password, hashed_password)
+
+
+password_hasher = PasswordHasher()
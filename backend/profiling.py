@@ -0,0 +1,226 @@
+"""Opt-in per-request profiling for the DM Sports AI Generator API.
+
+:class:`ProfilingMiddleware` profiles a request with cProfile when it
+carries ``X-Profile: <ADMIN_TOKEN>``, or at random with probability
+``PROFILE_SAMPLE_RATE``. Each profile is saved in ``PROFILE_DIR`` as
+
+* ``<id>.prof``: raw cProfile stats, for ``python -m pstats`` or snakeviz;
+* ``<id>.json``: a summary with the request, its duration, the time spent
+  per stage (Mongo commands by collection, content generation, bcrypt,
+  Pillow, serialization) and the most expensive functions.
+
+Stage times are collected through :func:`record_stage`, which the metrics
+hooks call for every timed stage and Mongo command; a context variable ties
+them to the profiled request, even from Motor's worker threads. cProfile
+itself sees the whole event loop thread, so under load the function list
+also contains whatever other requests ran meanwhile. Only one request is
+profiled at a time, and profiling slows it down: compare stages with each
+other, not with unprofiled latencies.
+"""
+import cProfile
+import json
+import os
+import pstats
+import random
+import re
+import secrets
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+# Configuration
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_TOP_FUNCTIONS = 40
+
+PROFILE_ID_RE = re.compile(r"^\d{8}T\d{6}-[0-9a-f]{8}$")
+
+# (file suffix, function name) pairs whose cumulative time is response serialization
+SERIALIZATION_FUNCTIONS = {
+    ("fastapi/routing.py", "serialize_response"),
+    ("starlette/responses.py", "render"),
+    ("fastapi/responses.py", "render"),
+    ("server.py", "product_payload"),
+    ("server.py", "summary_payload"),
+    ("server.py", "render_export_batch"),
+}
+
+
+class RequestProfile:
+    """Stage timings accumulated for one profiled request."""
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        # Motor runs commands (and their listeners) on worker threads
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"seconds": 0.0, "calls": 0})
+            entry["seconds"] += seconds
+            entry["calls"] += 1
+
+
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Add a stage duration to the request being profiled, if any."""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add(stage, seconds)
+
+
+def function_name(key) -> str:
+    filename, line, name = key
+    if filename == "~":
+        return name  # built-in
+    return f"{os.path.relpath(filename) if filename.startswith(os.getcwd()) else filename}:{line}({name})"
+
+
+def summarize_stats(stats: pstats.Stats) -> Dict[str, Any]:
+    serialization = 0.0
+    functions = []
+    for key, (_, calls, own, cumulative, _) in stats.stats.items():
+        filename, _, name = key
+        if any(filename.endswith(suffix) and name == function for suffix, function in SERIALIZATION_FUNCTIONS):
+            serialization += cumulative
+        functions.append((cumulative, own, calls, key))
+    functions.sort(key=lambda item: item[0], reverse=True)
+    return {
+        "serialization_seconds": round(serialization, 6),
+        "top_functions": [
+            {"function": function_name(key), "calls": calls, "own_seconds": round(own, 6), "cumulative_seconds": round(cumulative, 6)}
+            for cumulative, own, calls, key in functions[:PROFILE_TOP_FUNCTIONS]
+        ],
+    }
+
+
+class ProfileStore:
+    """Profiles on local disk, oldest pruned beyond ``max_files``."""
+
+    def __init__(self, root: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        self.root = root
+        self.max_files = max_files
+
+    @staticmethod
+    def new_id() -> str:
+        return f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+    def path(self, profile_id: str, extension: str) -> Optional[str]:
+        if not PROFILE_ID_RE.match(profile_id):
+            return None
+        path = os.path.join(self.root, f"{profile_id}.{extension}")
+        return path if os.path.exists(path) else None
+
+    def save(self, profile_id: str, summary: Dict[str, Any], profiler: cProfile.Profile) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        stats = pstats.Stats(profiler)
+        summary.update(summarize_stats(stats))
+        stats.dump_stats(os.path.join(self.root, f"{profile_id}.prof"))
+        with open(os.path.join(self.root, f"{profile_id}.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        self._prune()
+
+    def _prune(self) -> None:
+        # Ids start with a timestamp, so name order is age order
+        ids = sorted(name[:-5] for name in os.listdir(self.root) if name.endswith(".json"))
+        for profile_id in ids[:max(0, len(ids) - self.max_files)]:
+            for extension in ("json", "prof"):
+                try:
+                    os.unlink(os.path.join(self.root, f"{profile_id}.{extension}"))
+                except FileNotFoundError:
+                    pass
+
+    def load(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        path = self.path(profile_id, "json")
+        if path is None:
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Newest first, without the function lists."""
+        if not os.path.isdir(self.root):
+            return []
+        ids = sorted((name[:-5] for name in os.listdir(self.root) if name.endswith(".json")), reverse=True)
+        summaries = []
+        for profile_id in ids[:limit]:
+            summary = self.load(profile_id)
+            if summary is not None:
+                summary.pop("top_functions", None)
+                summaries.append(summary)
+        return summaries
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, store: Optional[ProfileStore] = None, admin_token: str = "", sample_rate: float = PROFILE_SAMPLE_RATE):
+        self.app = app
+        self.store = store or profile_store
+        self.admin_token = admin_token
+        self.sample_rate = sample_rate
+        # cProfile cannot nest: one profiled request at a time
+        self._busy = False
+
+    def wanted(self, scope) -> bool:
+        if self._busy:
+            return False
+        requested = Headers(scope=scope).get("x-profile")
+        if requested is not None and self.admin_token:
+            return secrets.compare_digest(requested, self.admin_token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.wanted(scope):
+            await self.app(scope, receive, send)
+            return
+
+        self._busy = True
+        profile_id = ProfileStore.new_id()
+        status_code = 500
+
+        async def send_with_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        profile = RequestProfile()
+        context_token = _current_profile.set(profile)
+        profiler = cProfile.Profile()
+        started_at = datetime.utcnow()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - start
+            _current_profile.reset(context_token)
+            self._busy = False
+            route = scope.get("route")
+            summary = {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": getattr(route, "path", None),
+                "status": status_code,
+                "started_at": started_at.isoformat(),
+                "duration_seconds": round(duration, 6),
+                "stages": {
+                    stage: {"seconds": round(entry["seconds"], 6), "calls": entry["calls"]}
+                    for stage, entry in sorted(profile.stages.items(), key=lambda item: -item[1]["seconds"])
+                },
+            }
+            await run_in_threadpool(self.store.save, profile_id, summary, profiler)
+
+
+profile_store = ProfileStore()
@@ -0,0 +1,86 @@
+"""Product search terms for the DM Sports AI Generator API.
+
+Products carry a ``search`` sub-document with accent-folded terms that is
+kept in sync on every write and served by a multikey index on
+``(user_id, search.terms)``:
+
+- ``terms``: every prefix (2+ characters) of every word, so "chau" matches
+  "Chaussures" through an index lookup instead of a regex scan.
+- ``title_terms``: the same prefixes for name, brand and SKU only, used to
+  rank matches in those fields above matches in the description.
+- ``keywords``: whole words, used to rank exact words above partial ones.
+
+The generated HTML description is not indexed: apart from the product's own
+text it is boilerplate shared by every product (care guide, shipping).
+"""
+import html
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Set
+
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_LENGTH = 20
+
+# Fields whose changes require the search terms to be rebuilt
+SEARCHABLE_FIELDS = ("name", "brand", "sku", "category", "features", "description", "short_description")
+TITLE_FIELDS = ("name", "brand", "sku")
+
+STOP_WORDS = {
+    "au", "aux", "avec", "ce", "ces", "dans", "de", "des", "du", "en", "et",
+    "la", "le", "les", "par", "pour", "sur", "un", "une",
+}
+
+_LIGATURES = str.maketrans({"œ": "oe", "Œ": "oe", "æ": "ae", "Æ": "ae", "ß": "ss"})
+_TAG_RE = re.compile(r"<[^>]+>")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents: "Été Légère" -> "ete legere"."""
+    decomposed = unicodedata.normalize("NFKD", text.translate(_LIGATURES))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def words(text: str) -> List[str]:
+    text = html.unescape(_TAG_RE.sub(" ", text))
+    return [w for w in _WORD_RE.findall(fold(text)) if w not in STOP_WORDS]
+
+
+def prefixes(tokens: Iterable[str]) -> Set[str]:
+    result = set()
+    for token in tokens:
+        for length in range(MIN_PREFIX_LENGTH, min(len(token), MAX_PREFIX_LENGTH) + 1):
+            result.add(token[:length])
+    return result
+
+
+def _field_words(product: Dict[str, Any], fields: Iterable[str]) -> List[str]:
+    tokens = []
+    for field in fields:
+        value = product.get(field)
+        if isinstance(value, list):
+            value = " ".join(str(v) for v in value)
+        if value:
+            tokens.extend(words(str(value)))
+    return tokens
+
+
+def build_search_document(product: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Compute the ``search`` sub-document stored alongside a product."""
+    all_words = _field_words(product, SEARCHABLE_FIELDS)
+    title_words = _field_words(product, TITLE_FIELDS)
+    return {
+        "terms": sorted(prefixes(all_words)),
+        "title_terms": sorted(prefixes(title_words)),
+        "keywords": sorted(set(all_words)),
+    }
+
+
+def query_terms(query: str) -> List[str]:
+    """Fold and split a user query into the terms matched against ``search.terms``."""
+    terms = []
+    for word in words(query):
+        term = word[:MAX_PREFIX_LENGTH]
+        if len(term) >= MIN_PREFIX_LENGTH and term not in terms:
+            terms.append(term)
+    return terms
@@ -0,0 +1,126 @@
+"""Production entry point for the DM Sports AI Generator API.
+
+Runs ``server:app`` under uvicorn with several worker processes sharing one
+listening socket, so a single instance uses every core. Each worker opens
+its own MongoDB client and process pools in the app lifespan (nothing is
+inherited across the fork) and warms them up before accepting connections.
+uvloop and httptools are used when installed (``uvicorn[standard]``).
+
+On SIGTERM or SIGINT a worker stops accepting connections, ends its event
+streams (clients reconnect to another instance), waits up to
+``--graceful-timeout`` seconds for in-flight requests, then shuts the app
+down.
+
+With more than one worker, Prometheus samples are aggregated across workers
+through ``PROMETHEUS_MULTIPROC_DIR`` (a temporary directory if unset).
+Product events only reach clients of the worker that made the change unless
+``EVENTS_CHANGE_STREAM`` is enabled.
+
+Usage::
+
+    python serve.py [--workers 8] [--port 8001] [--backlog 2048]
+                    [--keep-alive 75] [--graceful-timeout 30]
+"""
+import argparse
+import glob
+import importlib.util
+import logging
+import os
+import sys
+import tempfile
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+# Configuration
+SERVE_HOST = os.getenv("HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("PORT", "8001"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+# Pending connections the kernel queues while every worker is busy
+SERVE_BACKLOG = int(os.getenv("SERVE_BACKLOG", "2048"))
+# Longer than the load balancer's idle timeout, so it never reuses a connection we just closed
+SERVE_KEEP_ALIVE = int(os.getenv("SERVE_KEEP_ALIVE", "75"))
+SERVE_GRACEFUL_TIMEOUT = int(os.getenv("SERVE_GRACEFUL_TIMEOUT", "30"))
+# Concurrent connections per worker before new ones get 503 (0: unlimited)
+SERVE_LIMIT_CONCURRENCY = int(os.getenv("SERVE_LIMIT_CONCURRENCY", "0"))
+
+APP = "server:app"
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that tells the app when it starts draining."""
+
+    async def shutdown(self, sockets=None) -> None:
+        app_module = sys.modules.get(APP.partition(":")[0])
+        if app_module is not None:
+            app_module.begin_drain()
+        await super().shutdown(sockets)
+
+
+def prepare_metrics_dir(workers: int) -> None:
+    """Point every worker at one empty PROMETHEUS_MULTIPROC_DIR (read at import time)."""
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if workers <= 1 and not directory:
+        return
+    if not directory:
+        directory = tempfile.mkdtemp(prefix="dm-sports-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+    os.makedirs(directory, exist_ok=True)
+    # Samples left by a previous run would be summed with ours
+    for path in glob.glob(os.path.join(directory, "*.db")):
+        os.unlink(path)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the DM Sports AI Generator API")
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY, help="worker processes (default: CPU count)")
+    parser.add_argument("--backlog", type=int, default=SERVE_BACKLOG)
+    parser.add_argument("--keep-alive", type=int, default=SERVE_KEEP_ALIVE, help="idle keep-alive timeout in seconds")
+    parser.add_argument("--graceful-timeout", type=int, default=SERVE_GRACEFUL_TIMEOUT,
+                        help="seconds to let in-flight requests finish on shutdown")
+    parser.add_argument("--limit-concurrency", type=int, default=SERVE_LIMIT_CONCURRENCY)
+    parser.add_argument("--forwarded-allow-ips", default=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+                        help="proxies trusted for X-Forwarded-For/Proto")
+    parser.add_argument("--no-access-log", action="store_true")
+    args = parser.parse_args(argv)
+
+    prepare_metrics_dir(args.workers)
+    config = uvicorn.Config(
+        APP,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="uvloop" if installed("uvloop") else "asyncio",
+        http="httptools" if installed("httptools") else "h11",
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        limit_concurrency=args.limit_concurrency or None,
+        proxy_headers=True,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        access_log=not args.no_access_log,
+        server_header=False,
+    )
+    if args.workers > 1 and os.getenv("EVENTS_CHANGE_STREAM", "false").lower() not in ("1", "true", "yes"):
+        logger.warning("Product events only reach clients of the worker that made the change; set EVENTS_CHANGE_STREAM=true")
+
+    server = DrainingServer(config)
+    if config.workers > 1:
+        # What uvicorn.run does, with our server class
+        sock = config.bind_socket()
+        Multiprocess(config, target=server.run, sockets=[sock]).run()
+        return 0
+    server.run()
+    return 0 if server.started else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,142 @@
-from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Form, Query, Request, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pymongo import MongoClient
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
-from passlib.context import CryptContext
+from fastapi.responses import StreamingResponse, FileResponse, ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, Literal, Union
+from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
+from pymongo.errors import DuplicateKeyError, PyMongoError
 import os
 import uuid
+import calendar
 import json
 import base64
-from io import BytesIO
-from PIL import Image
+import csv
+import itertools
+import html
+import hashlib
+import zlib
+import secrets
+import asyncio
+import logging
+import sys
+import time
+import orjson
+from io import StringIO, TextIOWrapper
+from contextlib import asynccontextmanager
+
+from cache import TTLCache
+from compression import CompressionMiddleware, accepted_encodings
+from metrics import MetricsMiddleware, event_loop_monitor, mongo_pool_metrics, render_metrics, watch_queue_depth
+from profiling import ProfilingMiddleware, profile_store
+from events import product_events
+from throttling import Rate, RateLimited, RateLimiter, rate_limiter
+from images import (
+    image_store, image_mirror, image_derivatives, ImageRejected, image_hash_from_url, derivative_url, parse_variant,
+    DERIVATIVE_FORMATS, HASH_RE, UNREADABLE_IMAGE_ERRORS,
+)
+from content import generate_product_content, content_hash, canonical_hash, content_cache, content_pool, CONTENT_INPUTS
+from passwords import password_hasher, PasswordHasherBusy
+from search import build_search_document, query_terms, SEARCHABLE_FIELDS
+from database import (
+    mongo, users_repository, products_repository, ensure_indexes,
+    MONGO_ENSURE_INDEXES, MONGO_MAX_POOL_SIZE, PRODUCT_SUMMARY_PROJECTION,
+)
 
 # Configuration
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://127.0.0.1:27017")
 SECRET_KEY = os.getenv("SECRET_KEY", "dm-sports-ai-generator-secret-key-2025")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# Authenticated users are reloaded from MongoDB at most once per TTL
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "30"))
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "10000"))
+# Rows validated, generated and written together during a catalog import
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+CONTENT_BATCH_MAX_ITEMS = int(os.getenv("CONTENT_BATCH_MAX_ITEMS", "5000"))
+# Products read from MongoDB, rendered and compressed together during an export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+BULK_PATCH_MAX_ITEMS = int(os.getenv("BULK_PATCH_MAX_ITEMS", "1000"))
+# Attempts to re-apply an update that raced with another editor
+PRODUCT_UPDATE_RETRIES = 3
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Static reference data (brands) changes only with a deploy
+REFERENCE_DATA_MAX_AGE = int(os.getenv("REFERENCE_DATA_MAX_AGE", "86400"))
+REFERENCE_DATA_CACHE_CONTROL = f"public, max-age={REFERENCE_DATA_MAX_AGE}"
+# Per-user data: the browser may keep it but must revalidate (cheap 304s)
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+# When set, GET /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Operators' secret: profiles requests sent with "X-Profile: <ADMIN_TOKEN>" and
+# unlocks /api/admin (sent as "X-Admin-Token"). Admin features are off when unset.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+THUMBNAIL_VARIANT = "thumb.webp"
+PREVIEW_VARIANT = "md.webp"
+# Readiness probes: Mongo must answer within the timeout; results are reused briefly
+READINESS_MONGO_TIMEOUT_MS = int(os.getenv("READINESS_MONGO_TIMEOUT_MS", "500"))
+READINESS_CACHE_SECONDS = float(os.getenv("READINESS_CACHE_SECONDS", "2"))
+# Reported as "saturated" from this share of a pool or queue in use (does not fail readiness)
+READINESS_SATURATION_RATIO = float(os.getenv("READINESS_SATURATION_RATIO", "0.9"))
+# Spawn worker pools and open a Mongo connection before serving
+APP_WARM_UP = os.getenv("APP_WARM_UP", "true").lower() in ("1", "true", "yes")
+
+# Per-user rate limits as "<requests>/<seconds>" (bursts of up to <requests>); empty or 0 disables one
+RATE_LIMIT_GENERATE_CONTENT = os.getenv("RATE_LIMIT_GENERATE_CONTENT", "120/60")
+# Counted in chunks of CONTENT_CHUNK_SIZE products
+RATE_LIMIT_GENERATE_CONTENT_BATCH = os.getenv("RATE_LIMIT_GENERATE_CONTENT_BATCH", "20/60")
+RATE_LIMIT_UPLOAD_IMAGE = os.getenv("RATE_LIMIT_UPLOAD_IMAGE", "60/60")
+RATE_LIMIT_IMPORT = os.getenv("RATE_LIMIT_IMPORT", "10/60")
+
+logger = logging.getLogger(__name__)
+
+# Lifecycle: everything below is created per worker process, after any fork
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.draining = False
+    # MongoDB: one async client per process
+    mongo.connect()
+    # Refuse to serve with missing or conflicting indexes
+    if MONGO_ENSURE_INDEXES:
+        await ensure_indexes(mongo)
+    # Password hashing and batch content generation run in their own process pools
+    password_hasher.start()
+    content_pool.start()
+    # Image derivatives are rendered by a background thread pool
+    image_derivatives.start()
+    # Live product events; fed by a change stream with EVENTS_CHANGE_STREAM
+    product_events.start(products_repository.collection, summary_payload)
+    event_loop_monitor.start()
+    if APP_WARM_UP:
+        await warm_up()
+    try:
+        yield
+    finally:
+        event_loop_monitor.shutdown()
+        product_events.shutdown()
+        image_derivatives.shutdown()
+        content_pool.shutdown()
+        password_hasher.shutdown()
+        await rate_limiter.close()
+        mongo.close()
+
+async def warm_up():
+    """Pay one-off costs before the first request instead of during it."""
+    started = time.perf_counter()
+    # Opens the first pooled connection and fails fast if MongoDB is unreachable
+    await mongo.client.admin.command("ping")
+    await asyncio.gather(password_hasher.warm_up(), content_pool.warm_up())
+    logger.info("Warm-up finished in %.2fs", time.perf_counter() - started)
+
+def begin_drain():
+    """Called by serve.py once this worker stops accepting connections."""
+    app.state.draining = True
+    # Event streams never finish on their own; clients reconnect to another worker
+    product_events.close_streams()
 
 # Initialize FastAPI
-app = FastAPI(title="DM Sports AI Generator API", version="2.0.0")
+app = FastAPI(title="DM Sports AI Generator API", version="2.0.0", lifespan=lifespan)
 
 # CORS configuration
 app.add_middleware(
@@ -30,21 +145,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Needed by the client to send If-Match on updates
+    expose_headers=["ETag"],
 )
 
-# MongoDB connection
-client = MongoClient(MONGO_URL)
-db = client.dm_sports_generator
+# gzip/brotli for text responses above COMPRESSION_MIN_SIZE
+app.add_middleware(CompressionMiddleware)
+
+# cProfile of requests sent with X-Profile, or of a PROFILE_SAMPLE_RATE sample
+app.add_middleware(ProfilingMiddleware, admin_token=ADMIN_TOKEN)
 
-# Collections
-users_collection = db.users
-products_collection = db.products
+# Outermost, so latencies include compression and every other middleware
+app.add_middleware(MetricsMiddleware)
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Executor backlogs, sampled along with the event loop lag
+watch_queue_depth("password_hasher", lambda: password_hasher.queue_depth)
+watch_queue_depth("content_pool", lambda: content_pool.pending_chunks)
+watch_queue_depth("image_derivatives", lambda: image_derivatives.pending_jobs)
+
+# Per-user limits on the expensive endpoints (shared across workers with RATE_LIMIT_REDIS_URL)
+rate_limiter.limit("generate-content", Rate.parse(RATE_LIMIT_GENERATE_CONTENT))
+rate_limiter.limit("generate-content-batch", Rate.parse(RATE_LIMIT_GENERATE_CONTENT_BATCH))
+rate_limiter.limit("upload-image", Rate.parse(RATE_LIMIT_UPLOAD_IMAGE))
+rate_limiter.limit("import", Rate.parse(RATE_LIMIT_IMPORT))
 
 # Security
 security = HTTPBearer()
+# EventSource cannot send headers: event streams also accept ?token=
+optional_security = HTTPBearer(auto_error=False)
+
+# username -> (User, password_changed_at); dropped as soon as the account changes
+principal_cache = TTLCache(maxsize=AUTH_CACHE_MAX_SIZE, ttl=AUTH_CACHE_TTL_SECONDS, name="principal")
+users_repository.on_change(principal_cache.invalidate)
 
 # Pydantic models
 class User(BaseModel):
@@ -88,9 +220,36 @@ class Product(ProductBase):
     id: str
     user_id: str
     generated_content: Dict[str, Any] = {}
+    # Incremented by every write; sent as the ETag and checked against If-Match
+    version: int = 0
+    archived_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class ProductSummary(BaseModel):
+    id: str
+    name: str
+    brand: str
+    category: str
+    gender: str
+    price: float
+    old_price: Optional[float] = None
+    sku: str
+    season: Optional[str] = None
+    title: Optional[str] = None
+    thumbnail: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+class ProductPage(BaseModel):
+    # Product first: summaries lack user_id, so they never match it
+    items: List[Union[Product, ProductSummary]]
+    next_cursor: Optional[str] = None
+
+class ProductSearchPage(BaseModel):
+    items: List[ProductSummary]
+    next_offset: Optional[int] = None
+
 class ProductCreate(ProductBase):
     pass
 
@@ -111,6 +270,18 @@ class ProductUpdate(BaseModel):
     colors: Optional[List[str]] = None
     images: Optional[List[str]] = None
 
+class ProductSelection(BaseModel):
+    """Products targeted by a bulk operation: every given criterion must match."""
+    ids: Optional[List[str]] = Field(None, max_length=BULK_PATCH_MAX_ITEMS)
+    brand: Optional[str] = None
+    season: Optional[str] = None
+    created_before: Optional[datetime] = None
+    archived: Optional[bool] = Field(None, description="only archived (true) or active (false) products")
+
+class ProductPatch(ProductUpdate):
+    id: str
+    version: Optional[int] = Field(None, description="only apply if the product is still at this version")
+
 # Brands list (DM Sports compatible)
 BRANDS = [
     "Nike", "Adidas", "Puma", "Lacoste", "Hugo Boss", "Calvin Klein",
@@ -121,20 +292,33 @@ BRANDS = [
 ]
 
 # Helper functions
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+password_busy_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Authentication service is busy, please retry",
+    headers={"Retry-After": "1"},
+)
+
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise password_busy_exception
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str):
+    """Return (valid, new_hash); new_hash is set when the bcrypt cost changed."""
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise password_busy_exception
 
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def authenticate(token: str) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -142,7 +326,6 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     )
     
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
@@ -150,136 +333,455 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     except JWTError:
         raise credentials_exception
     
-    user = users_collection.find_one({"username": username})
-    if user is None:
-        raise credentials_exception
+    principal = principal_cache.get(username)
+    if principal is None:
+        user = await users_repository.find_by_username(username)
+        if user is None:
+            raise credentials_exception
+        principal = (User(**user), user.get("password_changed_at"))
+        principal_cache.set(username, principal)
     
-    return User(**user)
-
-def generate_product_content(product_data: dict) -> dict:
-    """Generate AI-powered product content like the original generator"""
-    name = product_data.get("name", "")
-    brand = product_data.get("brand", "")
-    category = product_data.get("category", "")
-    gender = product_data.get("gender", "")
-    material = product_data.get("material", "")
-    short_desc = product_data.get("short_description", "")
-    features = product_data.get("features", [])
-    
-    # Generate title
-    title = f"{name} - {brand}" if name and brand else "Produit DM Sports"
-    
-    # Generate description based on DM Sports style
-    description_parts = []
-    
-    # Introduction inspired by DM Sports
-    intros = {
-        'Nike': 'Performance et innovation au service du sport',
-        'Adidas': 'L\'excellence sportive depuis 1949',
-        'Lacoste': 'L\'élégance sportive à la française',
-        'Hugo Boss': 'Le luxe et la sophistication',
-        'The North Face': 'L\'aventure sans limites',
-        'Puma': 'Forever Faster - La vitesse au service du style'
-    }
+    current_user, password_changed_at = principal
+    if not current_user.is_active:
+        raise credentials_exception
     
-    intro = intros.get(brand, 'Qualité et style garantis')
-    description_parts.append(f"<p><strong>{intro}</strong></p>")
+    # Tokens issued before a password change are no longer valid
+    issued_at = payload.get("iat")
+    if password_changed_at is not None and (
+        issued_at is None or calendar.timegm(password_changed_at.utctimetuple()) > issued_at
+    ):
+        raise credentials_exception
     
-    # Main description
-    if short_desc:
-        description_parts.append(f"<p>{short_desc}</p>")
-    else:
-        # Handle apostrophe in f-string properly
-        gender_text = "l'homme moderne" if gender == 'homme' else 'la femme active' if gender == 'femme' else 'tous'
-        templates = [
-            f"Ce {category} {brand} incarne le parfait équilibre entre style et performance. Conçu pour {gender_text}, il offre un confort optimal au quotidien.",
-            f"Découvrez l'excellence avec ce {category} {brand}. Sa conception soignée et ses finitions de qualité en font un choix idéal pour toutes vos activités.",
-            f"{brand} présente {name}, un {category} qui allie technicité et esthétisme. Un must-have pour votre garde-robe."
-        ]
-        description_parts.append(f"<p>{templates[0]}</p>")
-    
-    # Features
-    if features:
-        description_parts.append('<h4>✨ Points forts du produit</h4>')
-        description_parts.append('<ul>')
-        for feature in features:
-            description_parts.append(f'<li>• {feature}</li>')
-        description_parts.append('</ul>')
-    
-    # Technical info
-    description_parts.append('<h4>📋 Informations techniques</h4>')
-    description_parts.append('<table style="width: 100%; margin: 15px 0;">')
-    description_parts.append(f'<tr><td><strong>Marque :</strong></td><td>{brand}</td></tr>')
-    description_parts.append(f'<tr><td><strong>Genre :</strong></td><td>{gender.capitalize()}</td></tr>')
-    
-    if material:
-        description_parts.append(f'<tr><td><strong>Composition :</strong></td><td>{material}</td></tr>')
-    
-    # Sizes and colors
-    sizes = product_data.get("sizes", [])
-    colors = product_data.get("colors", [])
-    
-    if sizes:
-        description_parts.append(f'<tr><td><strong>Tailles disponibles :</strong></td><td>{", ".join(sizes)}</td></tr>')
-    
-    if colors:
-        description_parts.append(f'<tr><td><strong>Coloris disponibles :</strong></td><td>{", ".join(colors)}</td></tr>')
-    
-    description_parts.append('</table>')
-    
-    # Care guide
-    description_parts.append('<h4>🧺 Conseils d\'entretien</h4>')
-    description_parts.append('<ul>')
-    
-    if 'chaussures' in category.lower():
-        description_parts.extend([
-            '<li>🧽 Nettoyer avec un chiffon humide</li>',
-            '<li>💧 Imperméabiliser régulièrement</li>',
-            '<li>☀️ Éviter l\'exposition prolongée au soleil</li>',
-            '<li>👟 Utiliser des embauchoirs pour maintenir la forme</li>'
-        ])
+    return current_user
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await authenticate(credentials.credentials)
+
+async def get_stream_user(
+    token: Optional[str] = Query(None, description="access token, for clients that cannot set headers"),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+):
+    if credentials is not None:
+        return await authenticate(credentials.credentials)
+    if token:
+        return await authenticate(token)
+    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+
+async def enforce_rate_limit(user: User, route: str, cost: float = 1) -> None:
+    try:
+        await rate_limiter.check(user.username, route, cost)
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please retry later",
+            headers={"Retry-After": RateLimiter.retry_after(e)},
+        )
+
+def rate_limited_user(route: str):
+    """get_current_user, charging one request to the user's limit for ``route``."""
+    async def dependency(current_user: User = Depends(get_current_user)) -> User:
+        await enforce_rate_limit(current_user, route)
+        return current_user
+    return dependency
+
+def product_event(document: dict) -> dict:
+    return {"product": summary_payload(document), "archived": document.get("archived_at") is not None}
+
+# Documents from our own collections were validated when they were written,
+# so responses are built straight from them and serialized with orjson instead
+# of going through the Pydantic models (and FastAPI's response_model) again.
+def field_defaults(model) -> dict:
+    # Required fields have no default (PydanticUndefined, which orjson cannot encode): null if a document lacks one
+    return {name: None if field.is_required() else field.get_default() for name, field in model.model_fields.items()}
+
+PRODUCT_FIELD_DEFAULTS = field_defaults(Product)
+SUMMARY_FIELD_DEFAULTS = field_defaults(ProductSummary)
+
+def product_payload(document: dict) -> dict:
+    payload = {name: document.get(name, default) for name, default in PRODUCT_FIELD_DEFAULTS.items()}
+    payload["id"] = str(document["_id"])
+    return payload
+
+def summary_payload(document: dict) -> dict:
+    payload = {name: document.get(name, default) for name, default in SUMMARY_FIELD_DEFAULTS.items()}
+    payload["id"] = str(document["_id"])
+    payload["title"] = document.get("generated_content", {}).get("title")
+    # Embedded data: URLs are never sent in listings, only stored image thumbnails
+    images = document.get("images") or []
+    image_hash = image_hash_from_url(images[0]) if images else None
+    payload["thumbnail"] = derivative_url(image_hash, THUMBNAIL_VARIANT) if image_hash else None
+    return payload
+
+def product_from_document(document: dict) -> Product:
+    return Product(**product_payload(document))
+
+def summary_from_document(document: dict) -> ProductSummary:
+    return ProductSummary(**summary_payload(document))
+
+def product_etag(document: dict) -> str:
+    return f'"v{document.get("version", 0)}"'
+
+def opaque_tag(etag: str) -> str:
+    etag = etag.strip()
+    return etag[2:] if etag.startswith("W/") else etag
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(opaque_tag(tag) == opaque_tag(etag) for tag in if_none_match.split(","))
+
+def cached_json(request: Request, content: Any, etag: Optional[str] = None, cache_control: str = PRIVATE_CACHE_CONTROL) -> Response:
+    """JSON response with an ETag (hash of the body unless given), or 304 if the client has it."""
+    body = orjson.dumps(content)
+    etag = etag or f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+def product_response(document: dict, request: Optional[Request] = None) -> Response:
+    """A product with its version as ETag; 304 when ``request`` already has that version."""
+    etag = product_etag(document)
+    if request is not None and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": etag, "Cache-Control": PRIVATE_CACHE_CONTROL},
+        )
+    return ORJSONResponse(product_payload(document), headers={"ETag": etag, "Cache-Control": PRIVATE_CACHE_CONTROL})
+
+def if_match_version(if_match: Optional[str]) -> Optional[int]:
+    """Version required by an If-Match header; None when any version is accepted."""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    try:
+        return int(tag.strip('"').lstrip("v"))
+    except ValueError:
+        # Not one of our tags, so it can never match
+        return -1
+
+def precondition_failed(document: dict) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail="Product was modified by someone else",
+        headers={"ETag": product_etag(document)},
+    )
+
+# Fields that feed neither generated content nor search terms: changing only
+# these is a single conditional write, without reading the product first
+DIRECT_UPDATE_FIELDS = frozenset(ProductBase.model_fields) - frozenset(CONTENT_INPUTS) - frozenset(SEARCHABLE_FIELDS)
+
+def product_fingerprint(document: dict) -> str:
+    """Canonical hash of the user-editable fields of a product."""
+    return canonical_hash(document, ProductBase.model_fields)
+
+def encode_cursor(sort_field: str, document: dict) -> str:
+    value = document.get(sort_field)
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    raw = json.dumps({"s": sort_field, "v": value, "id": str(document["_id"])})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort_field: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        value = data["v"]
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["$date"])
+        if data["s"] != sort_field:
+            raise ValueError("cursor was issued for another sort order")
+        return value, data["id"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+
+# Catalog import helpers
+IMPORT_LIST_FIELDS = ("features", "sizes", "colors", "images")
+IMPORT_LIST_SEPARATOR = "|"
+
+def detect_import_format(filename: Optional[str]) -> Optional[str]:
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    return None
+
+def csv_row_to_product(row: dict) -> dict:
+    """Map a CSV row to ProductCreate fields; list columns use '|' separators."""
+    product = {}
+    for key, value in row.items():
+        if key is None or value is None or value.strip() == "":
+            continue
+        key = key.strip()
+        value = value.strip()
+        if key in IMPORT_LIST_FIELDS:
+            product[key] = [item.strip() for item in value.split(IMPORT_LIST_SEPARATOR) if item.strip()]
+        else:
+            product[key] = value
+    return product
+
+def read_import_rows(upload_file, file_format: str):
+    """Yield (line number, product dict or parse error) from an uploaded file, one row at a time."""
+    text = TextIOWrapper(upload_file, encoding="utf-8-sig", newline="")
+    if file_format == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, csv_row_to_product(row)
     else:
-        description_parts.extend([
-            '<li>🌡️ Lavage en machine à 30°C</li>',
-            '<li>🚫 Ne pas utiliser de javel</li>',
-            '<li>♨️ Repassage à température moyenne</li>',
-            '<li>🌀 Séchage en tambour autorisé à basse température</li>'
-        ])
-    
-    description_parts.append('</ul>')
-    
-    # Services DM Sports
-    description_parts.append('<h4>🚚 Livraison & Services DM Sports</h4>')
-    description_parts.append('<ul>')
-    description_parts.extend([
-        '<li>✅ Livraison gratuite dès 80€ d\'achat</li>',
-        '<li>📦 Expédition sous 24h (jours ouvrés)</li>',
-        '<li>🔄 Retours sous 14 jours</li>',
-        '<li>💯 Garantie authenticité 100%</li>',
-        '<li>💳 Paiement sécurisé (CB, PayPal, Apple Pay)</li>',
-        '<li>🏪 Retrait gratuit en boutique Lyon - 11 rue de la République</li>'
-    ])
-    description_parts.append('</ul>')
-    
-    description = ''.join(description_parts)
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as e:
+                yield line_number, e
+
+def validate_import_rows(rows: list):
+    """Split parsed rows into ([(line number, ProductCreate)], [error events])."""
+    valid, errors = [], []
+    for line_number, row in rows:
+        if isinstance(row, Exception):
+            errors.append({"row": line_number, "errors": [f"Invalid JSON: {row}"]})
+            continue
+        if not isinstance(row, dict):
+            errors.append({"row": line_number, "errors": ["Each line must be a JSON object"]})
+            continue
+        try:
+            valid.append((line_number, ProductCreate(**row)))
+        except ValidationError as e:
+            messages = [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()]
+            errors.append({"row": line_number, "errors": messages})
+    return valid, errors
+
+# Stored fields an imported row is merged over, and the hash telling whether its content is current
+IMPORT_MERGE_PROJECTION = {**{field: 1 for field in ProductBase.model_fields}, "generated_content.content_hash": 1}
+
+def merge_import_row(product: ProductCreate, stored: Optional[dict]) -> dict:
+    """Product fields after importing a row: its columns over the stored product, or over the defaults for a new SKU."""
+    product_data = product.model_dump()
+    if stored is None:
+        return product_data
+    kept = {field: stored[field] for field in ProductBase.model_fields if field in stored}
+    return {**product_data, **kept, **product.model_dump(exclude_unset=True)}
+
+def import_row_unchanged(product_data: dict, stored: Optional[dict]) -> bool:
+    """Whether importing a row would leave the stored product, content included, as it is."""
+    return (
+        stored is not None
+        and product_fingerprint(product_data) == product_fingerprint(stored)
+        and stored.get("generated_content", {}).get("content_hash") == content_hash(product_data)
+    )
+
+def build_import_upsert(product: ProductCreate, product_data: dict, generated_content: dict, now: datetime):
+    """Pair of (fields set on every import, fields only set when the SKU is new).
     
-    return {
-        "title": title,
-        "description": description,
-        "generated_at": datetime.utcnow().isoformat()
+    Columns missing from the file keep their stored value on existing products;
+    ``product_data`` is the merged product (see merge_import_row), from which
+    the generated content and search terms are built.
+    """
+    provided = product.model_dump(exclude_unset=True)
+    product_id = str(uuid.uuid4())
+    fields = {
+        **provided,
+        "generated_content": generated_content,
+        "search": build_search_document(product_data),
+        "updated_at": now,
+    }
+    insert_only = {
+        **{k: v for k, v in product_data.items() if k not in provided},
+        "_id": product_id,
+        "id": product_id,
+        "created_at": now,
     }
+    return fields, insert_only
+
+def ndjson_line(event: dict) -> str:
+    return json.dumps(event, ensure_ascii=False, default=str) + "\n"
+
+# Catalog export helpers
+# Same columns as the import format, so an export can be re-imported as is
+EXPORT_CSV_COLUMNS = ["id", *ProductBase.model_fields, "title", "html_description", "created_at", "updated_at"]
+# StreamingResponse appends "; charset=utf-8" to text/* types itself
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "html": "text/html",
+}
+EXPORT_HTML_HEAD = """<!DOCTYPE html>
+<html lang="fr">
+<head>
+  <meta charset="UTF-8">
+  <title>Catalogue DM Sports</title>
+  <style>
+    body { font-family: Arial, sans-serif; max-width: 800px; margin: 0 auto; padding: 20px; }
+    article { border-bottom: 2px solid #eee; padding-bottom: 30px; margin-bottom: 30px; }
+    .sku { color: #999; }
+    .price { font-size: 24px; margin: 20px 0; }
+    .current-price { font-weight: bold; color: #e60012; }
+    .old-price { text-decoration: line-through; color: #999; }
+    h4 { color: #666; margin-top: 25px; }
+    table { width: 100%; border-collapse: collapse; }
+    table td { padding: 8px; border-bottom: 1px solid #eee; }
+  </style>
+</head>
+<body>
+"""
+EXPORT_HTML_FOOT = "</body>\n</html>\n"
+
+def export_csv_rows(products: List[Product], header: bool = False) -> str:
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_CSV_COLUMNS, extrasaction="ignore")
+    if header:
+        writer.writeheader()
+    for product in products:
+        row = product.model_dump(mode="json")
+        for field in IMPORT_LIST_FIELDS:
+            row[field] = IMPORT_LIST_SEPARATOR.join(row[field])
+        row["title"] = product.generated_content.get("title")
+        row["html_description"] = product.generated_content.get("description")
+        writer.writerow(row)
+    return buffer.getvalue()
+
+def export_html_article(product: Product) -> str:
+    title = html.escape(product.generated_content.get("title") or product.name)
+    old_price = ""
+    if product.old_price and product.old_price > product.price:
+        old_price = f'<span class="old-price">{product.old_price}€</span> '
+    return (
+        f'<article>\n  <h1>{title}</h1>\n  <p class="sku">{html.escape(product.sku)}</p>\n'
+        f'  <div class="price">{old_price}<span class="current-price">{product.price}€</span></div>\n'
+        f'  {product.generated_content.get("description", "")}\n</article>\n'
+    )
+
+def render_export_batch(file_format: str, documents: list, first: bool) -> str:
+    if file_format == "ndjson":
+        return "".join(orjson.dumps(product_payload(document)).decode() + "\n" for document in documents)
+    products = [product_from_document(document) for document in documents]
+    if file_format == "csv":
+        return export_csv_rows(products, header=first)
+    return (EXPORT_HTML_HEAD if first else "") + "".join(export_html_article(product) for product in products)
+
+def export_preamble(file_format: str) -> str:
+    """Output for an export that matched no product at all."""
+    if file_format == "csv":
+        return export_csv_rows([], header=True)
+    return EXPORT_HTML_HEAD if file_format == "html" else ""
+
+def export_trailer(file_format: str) -> str:
+    return EXPORT_HTML_FOOT if file_format == "html" else ""
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Naive UTC datetime, the way timestamps are stored."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
 
 # Routes
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy", "service": "DM Sports AI Generator API"}
+    return {
+        "status": "healthy",
+        "service": "DM Sports AI Generator API",
+        "caches": {
+            "principal": principal_cache.stats(),
+            "content": content_cache.stats(),
+            "image_derivatives": image_derivatives.stats(),
+        },
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(None)):
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    body, content_type = render_metrics()
+    # Set as a header: media_type would append a second charset
+    return Response(content=body, headers={"Content-Type": content_type})
+
+# Admin routes (X-Admin-Token: <ADMIN_TOKEN>)
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token required")
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles(limit: int = Query(50, ge=1, le=500)):
+    return {"profiles": await run_in_threadpool(profile_store.list, limit)}
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    profile = await run_in_threadpool(profile_store.load, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@app.get("/api/admin/profiles/{profile_id}/download", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str):
+    path = profile_store.path(profile_id, "prof")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    # Open with python -m pstats or snakeviz
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+@app.get("/api/health/live")
+async def liveness():
+    """The process is up and its event loop answers; never touches dependencies."""
+    return {"status": "alive"}
+
+readiness_cache = TTLCache(maxsize=1, ttl=READINESS_CACHE_SECONDS, name="readiness")
+# Concurrent probes share one check instead of each pinging MongoDB
+readiness_lock = asyncio.Lock()
+
+def utilization(used: int, capacity: int) -> dict:
+    ratio = used / capacity if capacity else 0.0
+    return {"used": used, "capacity": capacity, "saturated": ratio >= READINESS_SATURATION_RATIO}
+
+async def check_readiness() -> dict:
+    started = time.perf_counter()
+    try:
+        await mongo.ping(READINESS_MONGO_TIMEOUT_MS / 1000)
+        mongo_check = {"status": "ok", "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+    except PyMongoError as e:
+        mongo_check = {"status": "fail", "error": f"{type(e).__name__}: {e}"}
+    return {
+        "status": "ready" if mongo_check["status"] == "ok" else "not_ready",
+        "checked_at": datetime.utcnow().isoformat(),
+        "checks": {"mongo": mongo_check},
+        "saturation": {
+            "mongo_pool": utilization(mongo_pool_metrics.checked_out, MONGO_MAX_POOL_SIZE),
+            "password_hasher": utilization(password_hasher.in_flight, password_hasher.workers + password_hasher.max_pending),
+            "password_hasher_queue_depth": password_hasher.queue_depth,
+            "content_pool_pending_chunks": content_pool.pending_chunks,
+            "image_derivative_pending_jobs": image_derivatives.pending_jobs,
+            "event_loop_lag_seconds": round(event_loop_monitor.last_lag, 6),
+        },
+    }
+
+@app.get("/api/health/ready")
+async def readiness(request: Request):
+    """503 until MongoDB answers quickly, and again once the worker starts draining."""
+    if request.app.state.draining:
+        return ORJSONResponse({"status": "draining"}, status_code=503, headers={"Cache-Control": "no-store"})
+    report = readiness_cache.get("report")
+    if report is None:
+        async with readiness_lock:
+            report = readiness_cache.get("report")
+            if report is None:
+                report = await check_readiness()
+                readiness_cache.set("report", report)
+    status_code = 200 if report["status"] == "ready" else 503
+    return ORJSONResponse(report, status_code=status_code, headers={"Cache-Control": "no-store"})
 
 # Authentication routes
 @app.post("/api/register", response_model=Token)
 async def register(user: UserCreate):
     # Check if user exists
-    if users_collection.find_one({"$or": [{"username": user.username}, {"email": user.email}]}):
+    if await users_repository.find_by_username_or_email(user.username, user.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username or email already exists"
@@ -289,12 +791,19 @@ async def register(user: UserCreate):
     user_data = {
         "username": user.username,
         "email": user.email,
-        "password": hash_password(user.password),
+        "password": await hash_password(user.password),
         "is_active": True,
         "created_at": datetime.utcnow()
     }
     
-    users_collection.insert_one(user_data)
+    try:
+        await users_repository.create(user_data)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username or email already exists"
+        )
     
     # Create token
     access_token = create_access_token(data={"sub": user.username})
@@ -310,15 +819,20 @@ async def register(user: UserCreate):
 
 @app.post("/api/login", response_model=Token)
 async def login(user: UserLogin):
-    db_user = users_collection.find_one({"username": user.username})
+    db_user = await users_repository.find_by_username(user.username)
     
-    if not db_user or not verify_password(user.password, db_user["password"]):
+    valid, new_hash = await verify_password(user.password, db_user["password"]) if db_user else (False, None)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Upgrade hashes made with a different bcrypt cost
+    if new_hash:
+        await users_repository.replace_password_hash(user.username, db_user["password"], new_hash)
+    
     access_token = create_access_token(data={"sub": user.username})
     
     user_response = User(**{k: v for k, v in db_user.items() if k != "password"})
@@ -326,15 +840,60 @@ async def login(user: UserLogin):
     return Token(access_token=access_token, token_type="bearer", user=user_response)
 
 # Product routes
-@app.get("/api/products", response_model=List[Product])
-async def get_products(current_user: User = Depends(get_current_user)):
-    products = list(products_collection.find({"user_id": current_user.username}))
-    result = []
-    for p in products:
-        product_data = {k: v for k, v in p.items() if k != "_id"}
-        product_data["id"] = str(p["_id"])
-        result.append(Product(**product_data))
-    return result
+@app.get("/api/products", response_model=ProductPage)
+async def get_products(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = Query(None, description="next_cursor returned by the previous page"),
+    sort: Literal["created_at", "-created_at", "updated_at", "-updated_at", "name", "-name", "price", "-price"] = "-created_at",
+    view: Literal["summary", "full"] = "summary",
+    archived: bool = Query(False, description="list archived products instead of active ones"),
+    current_user: User = Depends(get_current_user)
+):
+    sort_field = sort.lstrip("-")
+    descending = sort.startswith("-")
+    position = decode_cursor(after, sort_field) if after else None
+    
+    # Fetch one extra document to know whether another page exists
+    documents = await products_repository.list_page(
+        current_user.username,
+        sort_field=sort_field,
+        descending=descending,
+        limit=limit + 1,
+        after=position,
+        projection=PRODUCT_SUMMARY_PROJECTION if view == "summary" else None,
+        archived=archived,
+    )
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    
+    to_item = summary_payload if view == "summary" else product_payload
+    next_cursor = encode_cursor(sort_field, documents[-1]) if has_more else None
+    return cached_json(request, {"items": [to_item(d) for d in documents], "next_cursor": next_cursor})
+
+@app.get("/api/products/search", response_model=ProductSearchPage)
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+    current_user: User = Depends(get_current_user)
+):
+    terms = query_terms(q)
+    if not terms:
+        return ORJSONResponse({"items": [], "next_offset": None})
+    
+    documents = await products_repository.search(
+        current_user.username,
+        terms,
+        offset=offset,
+        limit=limit + 1,
+        projection=PRODUCT_SUMMARY_PROJECTION,
+    )
+    has_more = len(documents) > limit
+    return ORJSONResponse({
+        "items": [summary_payload(d) for d in documents[:limit]],
+        "next_offset": offset + limit if has_more else None,
+    })
 
 @app.post("/api/products", response_model=Product)
 async def create_product(product: ProductCreate, current_user: User = Depends(get_current_user)):
@@ -348,98 +907,495 @@ async def create_product(product: ProductCreate, current_user: User = Depends(ge
         "id": product_id,
         "user_id": current_user.username,
         "generated_content": generated_content,
+        "version": 1,
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     }
     
-    products_collection.insert_one({**product_data, "_id": product_id})
+    try:
+        await products_repository.insert({
+            **product_data,
+            "_id": product_id,
+            "search": build_search_document(product_data),
+        })
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail=f"A product with SKU '{product.sku}' already exists")
     
+    product_events.notify(current_user.username, "product", product_event({**product_data, "_id": product_id}))
     return Product(**product_data)
 
+@app.post("/api/products/import")
+async def import_products(
+    file: UploadFile = File(...),
+    file_format: Optional[Literal["csv", "jsonl"]] = Form(None, alias="format"),
+    current_user: User = Depends(rate_limited_user("import"))
+):
+    """Upsert products keyed on SKU from a CSV or JSONL file.
+    
+    Streams NDJSON events: one "error" per rejected row, one "progress" per
+    batch and a final "done" with totals. Only one batch is in memory at a time.
+    """
+    file_format = file_format or detect_import_format(file.filename)
+    if file_format is None:
+        raise HTTPException(status_code=400, detail="Unsupported file type: use .csv, .jsonl or set format")
+    
+    async def import_events():
+        rows = read_import_rows(file.file, file_format)
+        totals = {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0, "failed": 0}
+        while True:
+            try:
+                batch = await run_in_threadpool(lambda: list(itertools.islice(rows, IMPORT_BATCH_SIZE)))
+            except (UnicodeDecodeError, csv.Error) as e:
+                yield ndjson_line({"event": "error", "row": None, "errors": [f"Unreadable file: {e}"]})
+                break
+            if not batch:
+                break
+            
+            valid, errors = await run_in_threadpool(validate_import_rows, batch)
+            stored = {
+                document["sku"]: document
+                for document in await products_repository.find_by_skus(
+                    current_user.username, [product.sku for _, product in valid], projection=IMPORT_MERGE_PROJECTION
+                )
+            } if valid else {}
+            changed, merged = [], []
+            for line_number, product in valid:
+                current = stored.get(product.sku)
+                product_data = merge_import_row(product, current)
+                # Same fields and current content: no write, no version bump
+                if import_row_unchanged(product_data, current):
+                    totals["unchanged"] += 1
+                    continue
+                changed.append((line_number, product))
+                merged.append(product_data)
+            results = await content_pool.generate(merged)
+            
+            now = datetime.utcnow()
+            upserts, line_numbers = [], []
+            for (line_number, product), product_data, result in zip(changed, merged, results):
+                if "error" in result:
+                    errors.append({"row": line_number, "errors": [f"Content generation failed: {result['error']}"]})
+                    continue
+                upserts.append(build_import_upsert(product, product_data, result["content"], now))
+                line_numbers.append(line_number)
+            
+            if upserts:
+                inserted, updated, write_errors = await products_repository.upsert_many_by_sku(
+                    current_user.username, upserts
+                )
+                errors.extend({"row": line_numbers[index], "errors": [message]} for index, message in write_errors)
+                totals["inserted"] += inserted
+                totals["updated"] += updated
+            
+            totals["rows"] += len(batch)
+            totals["failed"] += len(errors)
+            for error in sorted(errors, key=lambda error: error["row"]):
+                yield ndjson_line({"event": "error", **error})
+            yield ndjson_line({"event": "progress", **totals})
+        
+        if totals["inserted"] or totals["updated"]:
+            product_events.notify(current_user.username, "refresh", {"reason": "import"})
+        yield ndjson_line({"event": "done", **totals})
+    
+    return StreamingResponse(import_events(), media_type="application/x-ndjson")
+
+@app.patch("/api/products/bulk")
+async def bulk_update_products(patches: List[ProductPatch], current_user: User = Depends(get_current_user)):
+    """Apply many partial updates with one read and one bulk write.
+    
+    Each patch gets a status: "updated", "unchanged", "not_found",
+    "conflict" (its version is stale) or "error".
+    """
+    if len(patches) > BULK_PATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {BULK_PATCH_MAX_ITEMS} products per request",
+        )
+    
+    product_ids = list({patch.id for patch in patches})
+    documents = {d["_id"]: d for d in await products_repository.find_many_for_user(product_ids, current_user.username)}
+    results: List[Dict[str, Any]] = [{"id": patch.id} for patch in patches]
+    pending = []  # (position, document, update fields, merged product)
+    seen = set()
+    for position, patch in enumerate(patches):
+        document = documents.get(patch.id)
+        if document is None:
+            results[position]["status"] = "not_found"
+            continue
+        if patch.id in seen:
+            results[position].update(status="error", error="Product appears more than once in the request")
+            continue
+        seen.add(patch.id)
+        version = document.get("version", 0)
+        if patch.version is not None and patch.version != version:
+            results[position].update(status="conflict", version=version)
+            continue
+        update_data = {k: v for k, v in patch.model_dump(exclude={"id", "version"}).items() if v is not None}
+        merged_data = {**document, **update_data}
+        if product_fingerprint(merged_data) == product_fingerprint(document):
+            results[position].update(status="unchanged", version=version)
+            continue
+        pending.append((position, document, update_data, merged_data))
+    
+    # Content for every patch that changed generator inputs, in one pool call
+    regenerate = [
+        item for item in pending
+        if content_hash(item[3]) != item[1].get("generated_content", {}).get("content_hash")
+    ]
+    generated = await content_pool.generate([merged_data for _, _, _, merged_data in regenerate])
+    for (position, _, update_data, _), result in zip(regenerate, generated):
+        if "error" in result:
+            results[position].update(status="error", error=f"Content generation failed: {result['error']}")
+        else:
+            update_data["generated_content"] = result["content"]
+    
+    operations, positions, versions = [], [], []
+    for position, document, update_data, merged_data in pending:
+        if "status" in results[position]:
+            continue
+        if any(field in update_data for field in SEARCHABLE_FIELDS):
+            update_data["search"] = build_search_document(merged_data)
+        version = document.get("version", 0)
+        operations.append(products_repository.update_operation(
+            document["_id"], current_user.username, update_data, version=version
+        ))
+        positions.append(position)
+        versions.append(version + 1)
+    
+    if operations:
+        matched, errors = await products_repository.apply_updates(operations)
+        failed = dict(errors)
+        for index, position in enumerate(positions):
+            if index in failed:
+                results[position].update(status="error", error=failed[index])
+            else:
+                results[position].update(status="updated", version=versions[index])
+        if matched + len(errors) < len(operations):
+            # Some products changed between the read and the write: their version tells which
+            written = [results[position]["id"] for position in positions if results[position]["status"] == "updated"]
+            current = {
+                d["_id"]: d.get("version", 0)
+                for d in await products_repository.find_many_for_user(written, current_user.username)
+            }
+            for position in positions:
+                result = results[position]
+                if result["status"] == "updated" and current.get(result["id"]) != result["version"]:
+                    result.update(status="conflict", version=current.get(result["id"]))
+    
+    counts = {status_name: 0 for status_name in ("updated", "unchanged", "not_found", "conflict", "error")}
+    for result in results:
+        counts[result["status"]] += 1
+    if counts["updated"]:
+        product_events.notify(current_user.username, "refresh", {"reason": "bulk"})
+    return {**counts, "results": results}
+
+def selection_query(selection: ProductSelection, username: str) -> dict:
+    criteria = selection.model_dump(exclude={"archived"}, exclude_none=True)
+    if not criteria:
+        # Never let an empty body select the whole library
+        raise HTTPException(status_code=400, detail="Select products by ids, brand, season or created_before")
+    return products_repository.selection_query(
+        username,
+        product_ids=selection.ids,
+        brand=selection.brand,
+        season=selection.season,
+        created_before=as_utc(selection.created_before),
+        archived=selection.archived,
+    )
+
+@app.post("/api/products/bulk/delete")
+async def bulk_delete_products(selection: ProductSelection, current_user: User = Depends(get_current_user)):
+    """Permanently delete the selected products with one delete_many."""
+    deleted = await products_repository.delete_many(selection_query(selection, current_user.username))
+    if deleted:
+        product_events.notify(current_user.username, "refresh", {"reason": "bulk"})
+    return {"deleted": deleted}
+
+@app.post("/api/products/bulk/archive")
+async def bulk_archive_products(selection: ProductSelection, current_user: User = Depends(get_current_user)):
+    """Hide the selected products from listings, search and exports; reversible with restore."""
+    archived = await products_repository.set_archived(selection_query(selection, current_user.username), True)
+    if archived:
+        product_events.notify(current_user.username, "refresh", {"reason": "bulk"})
+    return {"archived": archived}
+
+@app.post("/api/products/bulk/restore")
+async def bulk_restore_products(selection: ProductSelection, current_user: User = Depends(get_current_user)):
+    restored = await products_repository.set_archived(selection_query(selection, current_user.username), False)
+    if restored:
+        product_events.notify(current_user.username, "refresh", {"reason": "bulk"})
+    return {"restored": restored}
+
+@app.get("/api/products/events")
+async def product_event_stream(
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_stream_user)
+):
+    """Server-Sent Events: "product" and "deleted" deltas, "refresh" when the list must be reloaded.
+    
+    EventSource resends the last id it saw as Last-Event-ID when it reconnects,
+    and the events missed in between are replayed.
+    """
+    if request.app.state.draining:
+        # An empty stream, not an error: EventSource gives up on errors but reconnects after a close
+        body = product_events.reconnect_stream()
+    else:
+        body = product_events.stream(product_events.subscribe(current_user.username, last_event_id))
+    return StreamingResponse(
+        body,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/products/export")
+async def export_products(
+    request: Request,
+    file_format: Literal["ndjson", "csv", "html"] = Query("ndjson", alias="format"),
+    brand: Optional[str] = None,
+    category: Optional[str] = None,
+    updated_since: Optional[datetime] = Query(None, description="only products changed at or after this instant"),
+    updated_before: Optional[datetime] = Query(None, description="only products changed before this instant"),
+    current_user: User = Depends(get_current_user)
+):
+    """Stream the whole library as NDJSON, CSV or a single HTML page.
+    
+    Products are read from a cursor EXPORT_BATCH_SIZE at a time and each batch
+    is rendered (and gzip-compressed when the client accepts it) before the
+    next one is fetched, so memory does not grow with the catalog.
+    """
+    cursor = products_repository.export_cursor(
+        current_user.username,
+        brand=brand,
+        category=category,
+        updated_since=as_utc(updated_since),
+        updated_before=as_utc(updated_before),
+        batch_size=EXPORT_BATCH_SIZE,
+    )
+    compress = "gzip" in accepted_encodings(request.headers.get("accept-encoding", ""))
+    # wbits=31: gzip container
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    
+    def encode(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return compressor.compress(data) if compressor else data
+    
+    def render(documents: list, first: bool) -> bytes:
+        return encode(render_export_batch(file_format, documents, first) if documents else export_preamble(file_format))
+    
+    async def export_chunks():
+        batch, first = [], True
+        try:
+            async for document in cursor:
+                batch.append(document)
+                if len(batch) >= EXPORT_BATCH_SIZE:
+                    yield await run_in_threadpool(render, batch, first)
+                    batch, first = [], False
+            if batch or first:
+                yield await run_in_threadpool(render, batch, first)
+            tail = encode(export_trailer(file_format))
+            yield tail + compressor.flush() if compressor else tail
+        finally:
+            await cursor.close()
+    
+    extension = "jsonl" if file_format == "ndjson" else file_format
+    headers = {
+        "Content-Disposition": f'attachment; filename="dm-sports-catalogue-{datetime.utcnow():%Y%m%d}.{extension}"',
+        "Vary": "Accept-Encoding",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(export_chunks(), media_type=EXPORT_MEDIA_TYPES[file_format], headers=headers)
+
 @app.get("/api/products/{product_id}", response_model=Product)
-async def get_product(product_id: str, current_user: User = Depends(get_current_user)):
-    product = products_collection.find_one({"_id": product_id, "user_id": current_user.username})
+async def get_product(product_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    product = await products_repository.get_for_user(product_id, current_user.username)
     
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    product_data = {k: v for k, v in product.items() if k != "_id"}
-    product_data["id"] = product_id
-    return Product(**product_data)
+    return product_response(product, request)
 
 @app.put("/api/products/{product_id}", response_model=Product)
 async def update_product(
     product_id: str,
     product_update: ProductUpdate,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user)
 ):
-    # Check if product exists and belongs to user
-    existing_product = products_collection.find_one({"_id": product_id, "user_id": current_user.username})
-    if not existing_product:
-        raise HTTPException(status_code=404, detail="Product not found")
+    """Partial update, applied atomically with find_one_and_update.
     
-    # Update only provided fields
+    With If-Match, the update only applies if the product is still at that
+    version (412 otherwise). Without it, a concurrent edit is merged again.
+    """
+    expected_version = if_match_version(if_match)
     update_data = {k: v for k, v in product_update.model_dump().items() if v is not None}
-    update_data["updated_at"] = datetime.utcnow()
     
-    # Regenerate content if key fields changed
-    if any(field in update_data for field in ["name", "brand", "category", "features", "short_description"]):
-        merged_data = {**existing_product, **update_data}
-        update_data["generated_content"] = generate_product_content(merged_data)
+    if update_data and update_data.keys() <= DIRECT_UPDATE_FIELDS:
+        # One round-trip; it matches nothing when every field already has its value
+        updated_product = await products_repository.update_fields(
+            product_id, current_user.username, update_data, version=expected_version, only_if_changed=True
+        )
+        if updated_product:
+            product_events.notify(current_user.username, "product", product_event(updated_product))
+            return product_response(updated_product)
+        
+        current_product = await products_repository.get_for_user(product_id, current_user.username)
+        if not current_product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        if expected_version is not None and current_product.get("version", 0) != expected_version:
+            raise precondition_failed(current_product)
+        return product_response(current_product)
     
-    products_collection.update_one(
-        {"_id": product_id},
-        {"$set": update_data}
-    )
+    for _ in range(PRODUCT_UPDATE_RETRIES):
+        existing_product = await products_repository.get_for_user(product_id, current_user.username)
+        if not existing_product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        version = existing_product.get("version", 0)
+        if expected_version is not None and version != expected_version:
+            raise precondition_failed(existing_product)
+        
+        merged_data = {**existing_product, **update_data}
+        
+        # Nothing actually changes: skip regeneration and the write
+        if product_fingerprint(merged_data) == product_fingerprint(existing_product):
+            return product_response(existing_product)
+        
+        fields = dict(update_data)
+        # Regenerate content only if the generator inputs changed
+        if content_hash(merged_data) != existing_product.get("generated_content", {}).get("content_hash"):
+            fields["generated_content"] = generate_product_content(merged_data)
+        if any(field in fields for field in SEARCHABLE_FIELDS):
+            fields["search"] = build_search_document(merged_data)
+        
+        try:
+            updated_product = await products_repository.update_fields(
+                product_id, current_user.username, fields, version=version
+            )
+        except DuplicateKeyError:
+            raise HTTPException(status_code=409, detail=f"A product with SKU '{update_data['sku']}' already exists")
+        if updated_product:
+            product_events.notify(current_user.username, "product", product_event(updated_product))
+            return product_response(updated_product)
+        # Someone else wrote in between: with If-Match that is a failed precondition
+        if expected_version is not None:
+            current_product = await products_repository.get_for_user(product_id, current_user.username)
+            if not current_product:
+                raise HTTPException(status_code=404, detail="Product not found")
+            raise precondition_failed(current_product)
     
-    # Get updated product
-    updated_product = products_collection.find_one({"_id": product_id})
-    product_data = {k: v for k, v in updated_product.items() if k != "_id"}
-    product_data["id"] = product_id
-    return Product(**product_data)
+    raise HTTPException(status_code=409, detail="Product is being modified concurrently, please retry")
 
 @app.delete("/api/products/{product_id}")
 async def delete_product(product_id: str, current_user: User = Depends(get_current_user)):
-    result = products_collection.delete_one({"_id": product_id, "user_id": current_user.username})
-    
-    if result.deleted_count == 0:
+    if not await products_repository.delete_for_user(product_id, current_user.username):
         raise HTTPException(status_code=404, detail="Product not found")
     
+    product_events.notify(current_user.username, "deleted", {"id": product_id})
     return {"message": "Product deleted successfully"}
 
 # Generate product content
 @app.post("/api/generate-content")
-async def generate_content(product_data: dict, current_user: User = Depends(get_current_user)):
+async def generate_content(product_data: dict, current_user: User = Depends(rate_limited_user("generate-content"))):
     generated_content = generate_product_content(product_data)
     return generated_content
 
+@app.post("/api/generate-content/batch")
+async def generate_content_batch(products: List[Dict[str, Any]], current_user: User = Depends(get_current_user)):
+    """Generate content for many products, streamed as NDJSON as chunks finish.
+    
+    Lines arrive out of order: each one carries the "index" of its product in
+    the request, with either "content" or "error".
+    """
+    if len(products) > CONTENT_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {CONTENT_BATCH_MAX_ITEMS} products per batch"
+        )
+    await enforce_rate_limit(current_user, "generate-content-batch", max(1, (len(products) + content_pool.chunk_size - 1) // content_pool.chunk_size))
+    
+    async def results():
+        async for index, result in content_pool.iter_generate(products):
+            yield ndjson_line({"index": index, **result})
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 # Get brands
 @app.get("/api/brands")
-async def get_brands():
-    return BRANDS
+async def get_brands(request: Request):
+    return cached_json(request, BRANDS, cache_control=REFERENCE_DATA_CACHE_CONTROL)
 
 # Image upload
 @app.post("/api/upload-image")
-async def upload_image(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
+async def upload_image(file: UploadFile = File(...), current_user: User = Depends(rate_limited_user("upload-image"))):
+    # Validate image
+    if not (file.content_type or "").startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    
     try:
-        # Validate image
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Read and process image
-        contents = await file.read()
-        image = Image.open(BytesIO(contents))
-        
-        # Convert to base64
-        buffer = BytesIO()
-        image.save(buffer, format="PNG")
-        image_base64 = base64.b64encode(buffer.getvalue()).decode()
-        
-        return {"image_url": f"data:image/png;base64,{image_base64}"}
-        
-    except Exception as e:
+        stored = await image_store.save_upload(file)
+    except ImageRejected as e:
         raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
+    
+    if image_mirror.enabled:
+        await image_mirror.put(stored)
+    image_derivatives.schedule(stored.hash)
+    
+    return {
+        "image_url": stored.url,
+        "preview_url": stored.derivative_url(PREVIEW_VARIANT),
+        "thumbnail_url": stored.derivative_url(THUMBNAIL_VARIANT),
+        "hash": stored.hash,
+        "format": stored.format,
+        "width": stored.width,
+        "height": stored.height,
+        "size": stored.size,
+    }
+
+# Images are public: <img> tags cannot send the bearer token and the
+# SHA-256 name is not guessable. Content never changes for a given hash.
+@app.get("/api/images/{image_hash}")
+async def get_image(image_hash: str, request: Request):
+    found = image_store.find(image_hash) or await image_mirror.fetch(image_hash)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": f'"{image_hash}"'}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    path, media_type = found
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+@app.get("/api/images/{image_hash}/{variant}")
+async def get_image_derivative(image_hash: str, variant: str, request: Request):
+    """Resized copy of an image, e.g. thumb.webp, sm.jpg, md.webp or lg.jpg."""
+    if not HASH_RE.match(image_hash):
+        raise HTTPException(status_code=404, detail="Image not found")
+    parsed = parse_variant(variant)
+    if parsed is None:
+        raise HTTPException(status_code=404, detail="Unknown image variant")
+    
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": f'"{image_hash}-{variant}"'}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    if image_mirror.enabled and image_store.find(image_hash) is None:
+        await image_mirror.fetch(image_hash)
+    try:
+        path = await image_derivatives.get(image_hash, *parsed)
+    except UNREADABLE_IMAGE_ERRORS:
+        # A stored original that cannot be decoded is as good as missing
+        raise HTTPException(status_code=404, detail="Image not found")
+    except OSError as e:
+        raise HTTPException(status_code=503, detail=f"Error rendering image: {str(e)}")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    media_type = DERIVATIVE_FORMATS[parsed[1]][1]
+    return FileResponse(path, media_type=media_type, headers=headers)
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    # Same as "python serve.py": workers, uvloop and graceful shutdown
+    from serve import main
+    sys.exit(main())
\ No newline at end of file
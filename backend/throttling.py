@@ -0,0 +1,200 @@
+"""Request coalescing and per-user rate limiting for the DM Sports AI Generator API.
+
+* :class:`SingleFlight` runs one computation per key at a time: concurrent
+  callers with the same key wait for the running one and share its result
+  (or its exception).
+* :class:`RateLimiter` keeps a token bucket per user and route. A request
+  takes ``cost`` tokens. When the bucket is empty the caller gets
+  :class:`RateLimited` with the delay until enough tokens are back, which
+  the API turns into ``429`` with ``Retry-After``.
+
+Buckets live in process memory, so each worker enforces its own limits.
+With ``RATE_LIMIT_REDIS_URL`` (and the optional ``redis`` package) they are
+shared by every worker and instance through one atomic Lua script. If Redis
+is unreachable, requests are let through rather than failed.
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from metrics import COALESCED_CALLS, RATE_LIMITED
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # optional: in-process buckets only
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+RATE_LIMIT_REDIS_PREFIX = "ratelimit:"
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class Rate:
+    """``requests`` per ``seconds``, with bursts of up to ``requests``."""
+
+    requests: int
+    seconds: float
+
+    @property
+    def per_second(self) -> float:
+        return self.requests / self.seconds
+
+    @classmethod
+    def parse(cls, value: str) -> Optional["Rate"]:
+        """``"60/60"`` is 60 requests per minute; empty or ``"0"`` disables the limit."""
+        requests, _, seconds = value.partition("/")
+        if not requests or int(requests) <= 0:
+            return None
+        return cls(int(requests), float(seconds or 1))
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    @staticmethod
+    def _consume(task: asyncio.Future) -> None:
+        # Nobody may be left to await a failure if every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """``(result, shared)``; ``shared`` is True when another caller did the work."""
+        task = self._calls.get(key)
+        if task is not None:
+            COALESCED_CALLS.labels(self.name).inc()
+            # shield: a caller disconnecting must not cancel the work for the others
+            return await asyncio.shield(task), True
+        task = asyncio.ensure_future(func())
+        self._calls[key] = task
+        task.add_done_callback(lambda _: self._calls.pop(key, None))
+        task.add_done_callback(self._consume)
+        return await asyncio.shield(task), False
+
+
+class MemoryBuckets:
+    """Token buckets in this process, least recently used dropped beyond ``max_buckets``."""
+
+    def __init__(self, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, rate: Rate, cost: float) -> float:
+        """Seconds to wait before ``cost`` tokens are available; 0 if they were taken."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (rate.requests, now))
+            tokens = min(rate.requests, tokens + (now - updated) * rate.per_second)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate.per_second
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return wait
+
+    async def close(self) -> None:
+        pass
+
+
+# KEYS[1]: bucket; ARGV: tokens per second, burst, cost. Returns the wait in seconds.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared through Redis."""
+
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL is set but the redis package is not installed")
+        self.client = redis.from_url(url)
+        self._script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, key: str, rate: Rate, cost: float) -> float:
+        try:
+            wait = await self._script(keys=[RATE_LIMIT_REDIS_PREFIX + key], args=[rate.per_second, rate.requests, cost])
+        except redis.RedisError as e:
+            # Better unlimited for a while than down
+            logger.warning("Rate limiter unavailable (%s), request allowed", e)
+            return 0.0
+        return float(wait)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class RateLimiter:
+    def __init__(self, enabled: bool = RATE_LIMIT_ENABLED, redis_url: str = RATE_LIMIT_REDIS_URL):
+        self.enabled = enabled
+        self.buckets = RedisBuckets(redis_url) if redis_url else MemoryBuckets()
+        self.rates: Dict[str, Rate] = {}
+
+    def limit(self, route: str, rate: Optional[Rate]) -> None:
+        """Limit ``route`` per user; ``None`` leaves it unlimited."""
+        if rate is None:
+            self.rates.pop(route, None)
+        else:
+            self.rates[route] = rate
+
+    async def check(self, user_id: str, route: str, cost: float = 1) -> None:
+        """Take ``cost`` tokens from the user's bucket for ``route`` or raise :class:`RateLimited`."""
+        rate = self.rates.get(route)
+        if not self.enabled or rate is None:
+            return
+        # A request bigger than the bucket empties it instead of never passing
+        wait = await self.buckets.take(f"{route}:{user_id}", rate, min(cost, rate.requests))
+        if wait > 0:
+            RATE_LIMITED.labels(route).inc()
+            raise RateLimited(wait)
+
+    async def close(self) -> None:
+        await self.buckets.close()
+
+    @staticmethod
+    def retry_after(error: RateLimited) -> str:
+        return str(max(1, math.ceil(error.retry_after)))
+
+
+rate_limiter = RateLimiter()
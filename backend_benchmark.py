@@ -0,0 +1,715 @@
+#!/usr/bin/env python3
+"""
+Backend performance benchmarks for DM Sports AI Generator
+Measures API latency under parallel load against a running server or the
+app in-process, and microbenchmarks backend hot paths
+
+Everything except "concurrency" runs offline: the in-process load test talks
+to the ASGI app directly and uses mongomock (pip install mongomock-motor
+httpx) unless --mongo-url points at a local mongod. "search" always needs
+the mongod, since mongomock cannot run its aggregation; "suite" only includes
+it with --mongo-url. Save runs with --output and compare them with "compare"
+to spot regressions.
+
+Usage:
+    python backend_benchmark.py concurrency --base-url http://localhost:8001/api
+    python backend_benchmark.py content
+    python backend_benchmark.py serialization --products 10000
+    python backend_benchmark.py hashing
+    python backend_benchmark.py images
+    python backend_benchmark.py search --mongo-url mongodb://127.0.0.1:27017
+    python backend_benchmark.py load --workers 32 --requests 50
+    python backend_benchmark.py --output before.json suite
+    python backend_benchmark.py compare before.json after.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(name, samples, elapsed, errors=0):
+    """Build a latency summary (milliseconds) for one scenario"""
+    return {
+        "name": name,
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(statistics.mean(samples) * 1000, 2) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2) if samples else 0.0,
+    }
+
+
+def print_summary(summary):
+    print(
+        f"📊 {summary['name']:<28} {summary['requests']:>6} req "
+        f"{summary['throughput_rps']:>8} req/s  "
+        f"p50 {summary['p50_ms']:>8} ms  p95 {summary['p95_ms']:>8} ms  "
+        f"p99 {summary['p99_ms']:>8} ms  errors {summary['errors']}"
+    )
+
+
+class ConcurrencyBenchmark:
+    """Parallel load against a live server.
+
+    Product listings run alongside health checks. Health checks never touch
+    the database, so their tail latency shows how long the event loop is
+    blocked by the other requests. Run it once against the previous revision
+    and once against the current one to compare.
+    """
+
+    def __init__(self, base_url, concurrency, requests_per_worker, products):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.requests_per_worker = requests_per_worker
+        self.products = products
+        self.session = requests.Session()
+        self.token = None
+
+    def headers(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def setup(self):
+        username = f"bench_{uuid.uuid4().hex[:8]}"
+        response = self.session.post(f"{self.base_url}/register", json={
+            "username": username,
+            "email": f"{username}@dmsports.fr",
+            "password": "benchpass123",
+        }, timeout=30)
+        response.raise_for_status()
+        self.token = response.json()["access_token"]
+
+        for i in range(self.products):
+            self.session.post(f"{self.base_url}/products", json={
+                "name": f"Air Max Bench {i}",
+                "brand": "Nike",
+                "category": "chaussures",
+                "gender": "homme",
+                "price": 129.99,
+                "sku": f"BENCH-{i:05d}",
+                "features": ["Amorti Air visible", "Semelle caoutchouc"],
+                "sizes": ["40", "41", "42"],
+                "colors": ["Noir", "Blanc"],
+            }, headers=self.headers(), timeout=30).raise_for_status()
+
+    def timed_calls(self, method, path, authenticated):
+        session = requests.Session()
+        headers = self.headers() if authenticated else {}
+        samples, errors = [], 0
+        for _ in range(self.requests_per_worker):
+            start = time.perf_counter()
+            try:
+                response = session.request(method, f"{self.base_url}{path}", headers=headers, timeout=60)
+                if response.status_code >= 400:
+                    errors += 1
+            except requests.exceptions.RequestException:
+                errors += 1
+            samples.append(time.perf_counter() - start)
+        return samples, errors
+
+    def run(self):
+        self.setup()
+        scenarios = {"GET /products": [], "GET /health (under load)": []}
+        failures = {name: 0 for name in scenarios}
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency * 2) as pool:
+            futures = []
+            for _ in range(self.concurrency):
+                futures.append(("GET /products", pool.submit(self.timed_calls, "GET", "/products", True)))
+                futures.append(("GET /health (under load)", pool.submit(self.timed_calls, "GET", "/health", False)))
+            for name, future in futures:
+                samples, errors = future.result()
+                scenarios[name].extend(samples)
+                failures[name] += errors
+        elapsed = time.perf_counter() - start
+
+        return [summarize(name, samples, elapsed, failures[name]) for name, samples in scenarios.items()]
+
+
+def import_backend():
+    """Make backend modules importable when running from the repository root"""
+    backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+
+
+def sample_products(count):
+    """Varied product payloads exercising every template branch"""
+    brands = ["Nike", "Adidas", "Lacoste", "Puma", "Fila", "Hugo Boss", "Kappa"]
+    categories = ["chaussures-running", "t-shirts", "vestes", "chaussures-lifestyle", "shorts"]
+    genders = ["homme", "femme", "enfant"]
+    return [
+        {
+            "name": f"Produit Bench {i}",
+            "brand": brands[i % len(brands)],
+            "category": categories[i % len(categories)],
+            "gender": genders[i % len(genders)],
+            "price": 49.99 + i % 100,
+            "sku": f"BENCH-{i:06d}",
+            "short_description": "" if i % 2 else f"Description courte {i}",
+            "material": "Coton" if i % 3 else "",
+            "features": ["Respirant", "Séchage rapide", f"Série {i % 10}"],
+            "sizes": ["S", "M", "L", "XL"],
+            "colors": ["Noir", "Blanc"] if i % 4 else [],
+        }
+        for i in range(count)
+    ]
+
+
+def rate(name, count, elapsed, unit="products"):
+    per_second = count / elapsed if elapsed else 0.0
+    print(f"📊 {name:<36} {per_second:>12,.0f} {unit}/s  ({elapsed * 1000:.1f} ms for {count:,})")
+    return {"name": name, "count": count, "seconds": round(elapsed, 6), "per_second": round(per_second, 1)}
+
+
+def bench_content(products, batch_size):
+    """Products-per-second for single and batched content generation, uncached"""
+    import_backend()
+    from content import content_cache, generate_product_content, generate_product_contents
+
+    generate_product_contents(products[:batch_size])  # warm template variants
+
+    # Each loop renders every product: none may be served from the previous loop's cache entries
+    content_cache.clear()
+    start = time.perf_counter()
+    for product in products:
+        generate_product_content(product)
+    results = [rate("generate_product_content (single)", len(products), time.perf_counter() - start)]
+
+    content_cache.clear()
+    start = time.perf_counter()
+    for offset in range(0, len(products), batch_size):
+        generate_product_contents(products[offset:offset + batch_size])
+    results.append(rate(f"generate_product_contents (batch={batch_size})", len(products), time.perf_counter() - start))
+    return results
+
+
+def stored_documents(products):
+    """Product payloads shaped like documents read back from MongoDB"""
+    from content import generate_product_contents
+
+    now = datetime.utcnow()
+    documents = []
+    for product, content in zip(products, generate_product_contents(products)):
+        product_id = str(uuid.uuid4())
+        documents.append({
+            **product,
+            "_id": product_id,
+            "id": product_id,
+            "user_id": "bench",
+            "old_price": None,
+            "images": [f"/api/images/{uuid.uuid4().hex * 2}"],
+            "generated_content": content,
+            "created_at": now,
+            "updated_at": now,
+        })
+    return documents
+
+
+def bench_serialization(products, page_size):
+    """GET /api/products response rendering: Pydantic models + response_model vs stored-document fast path"""
+    import_backend()
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+    import server
+
+    documents = stored_documents(products)
+    pages = [documents[offset:offset + page_size] for offset in range(0, len(documents), page_size)]
+    page_field = create_response_field("Response_get_products", server.ProductPage)
+
+    async def model_path(to_model):
+        # What the route did before: build models, then FastAPI validates and encodes them again
+        for page in pages:
+            content = server.ProductPage(items=[to_model(d) for d in page], next_cursor=None)
+            JSONResponse(await serialize_response(field=page_field, response_content=content))
+
+    def fast_path(to_payload):
+        for page in pages:
+            ORJSONResponse({"items": [to_payload(d) for d in page], "next_cursor": None})
+
+    results = []
+    for view, to_model, to_payload in (
+        ("full", server.product_from_document, server.product_payload),
+        ("summary", server.summary_from_document, server.summary_payload),
+    ):
+        start = time.perf_counter()
+        asyncio.run(model_path(to_model))
+        before = rate(f"{view}: models + response_model", len(documents), time.perf_counter() - start)
+        start = time.perf_counter()
+        fast_path(to_payload)
+        after = rate(f"{view}: stored documents + orjson", len(documents), time.perf_counter() - start)
+        speedup = before["seconds"] / after["seconds"] if after["seconds"] else 0.0
+        print(f"⚡ {view}: {speedup:.1f}x faster")
+        results.extend([before, after, {"name": f"{view}: speedup", "factor": round(speedup, 2)}])
+    return results
+
+
+def bench_hashing(count, concurrency):
+    """bcrypt hashes and verifications per second, inline and through the process pool"""
+    import_backend()
+    from passwords import BCRYPT_ROUNDS, PasswordHasher, hash_password, verify_password
+
+    print(f"📍 bcrypt cost {BCRYPT_ROUNDS}")
+    start = time.perf_counter()
+    hashes = [hash_password(f"benchpass{i}") for i in range(count)]
+    results = [rate("hash_password (inline)", count, time.perf_counter() - start, "hashes")]
+
+    start = time.perf_counter()
+    for i, hashed in enumerate(hashes):
+        verify_password(f"benchpass{i}", hashed)
+    results.append(rate("verify_password (inline)", count, time.perf_counter() - start, "checks"))
+
+    async def pooled():
+        hasher = PasswordHasher()
+        hasher.start()
+        try:
+            await hasher.hash("warmup")  # spawn the workers outside the measurement
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(i):
+                async with semaphore:
+                    await hasher.hash(f"benchpass{i}")
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(count)))
+            return time.perf_counter() - start
+        finally:
+            hasher.shutdown()
+
+    elapsed = asyncio.run(pooled())
+    results.append(rate(f"PasswordHasher.hash (concurrency={concurrency})", count, elapsed, "hashes"))
+    return results
+
+
+def sample_jpeg(index, size):
+    """A distinct JPEG per index, so each one is stored as a new image"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (size, size), ((index * 37) % 256, (index * 91) % 256, 128))
+    draw = ImageDraw.Draw(image)
+    for step in range(0, size, 64):
+        draw.line((0, step, size, size - step), fill=(255, (index + step) % 256, 0), width=9)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def bench_images(count, size):
+    """Upload processing: hashing, verification and storage, then the eager derivatives"""
+    import_backend()
+    from images import IMAGE_EAGER_DERIVATIVES, ImageStore, parse_variant, render_derivative
+
+    payloads = [sample_jpeg(i, size) for i in range(count)]
+    variants = [parse_variant(variant) for variant in IMAGE_EAGER_DERIVATIVES if parse_variant(variant)]
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-images-") as root:
+        store = ImageStore(root)
+        start = time.perf_counter()
+        stored = [store.put_bytes(data) for data in payloads]
+        results.append(rate(f"ImageStore.put_bytes ({size}px JPEG)", count, time.perf_counter() - start, "images"))
+
+        start = time.perf_counter()
+        for image in stored:
+            source, _ = store.find(image.hash)
+            for size, extension in variants:
+                render_derivative(source, os.path.join(root, "derivatives", image.hash, f"{size}.{extension}"), size, extension)
+        names = ",".join(f"{size}.{extension}" for size, extension in variants)
+        results.append(rate(f"render_derivative ({names})", count, time.perf_counter() - start, "images"))
+    return results
+
+
+def bench_search(products, count):
+    """GET /api/products/search queries against one user's catalogue, in the configured database"""
+    from database import PRODUCT_SUMMARY_PROJECTION, Database, ProductRepository
+    from search import build_search_document, query_terms
+
+    documents = stored_documents(products)
+    start_time = datetime.utcnow()
+    for index, document in enumerate(documents):
+        document["search"] = build_search_document(document)
+        document["updated_at"] = start_time - timedelta(seconds=index)
+    # Broad queries match most of the catalogue, narrow ones a handful of products
+    queries = ["nike", "chau", "produit bench", "t-shirts homme", "respirant noir", "bench-00012"]
+
+    async def run():
+        repository = ProductRepository(Database())
+        for offset in range(0, len(documents), 1000):
+            await repository.collection.insert_many(documents[offset:offset + 1000])
+        samples = {query: [] for query in queries}
+        start = time.perf_counter()
+        for i in range(count):
+            query = queries[i % len(queries)]
+            began = time.perf_counter()
+            await repository.search("bench", query_terms(query), limit=21, projection=PRODUCT_SUMMARY_PROJECTION)
+            samples[query].append(time.perf_counter() - began)
+        elapsed = time.perf_counter() - start
+        repository.database.close()
+        return samples, elapsed
+
+    samples, elapsed = asyncio.run(run())
+    results = [summarize(f"search: {query}", latencies, sum(latencies)) for query, latencies in samples.items()]
+    results.append(summarize("search: all", [latency for latencies in samples.values() for latency in latencies], elapsed))
+    for summary in results:
+        print_summary(summary)
+    return results
+
+
+def configure_backend(mongo_url):
+    """Point the backend at a throwaway database: mongomock, or a fresh database on a local mongod"""
+    os.environ["MONGO_DB_NAME"] = f"dm_sports_bench_{uuid.uuid4().hex[:8]}"
+    if mongo_url:
+        os.environ["MONGO_URL"] = mongo_url
+    import_backend()
+    if not mongo_url:
+        try:
+            import mongomock_motor
+        except ImportError:
+            sys.exit("❌ In-process benchmarks need mongomock-motor (or --mongo-url of a local mongod)")
+        import database
+        client = mongomock_motor.AsyncMongoMockClient()
+        database.AsyncIOMotorClient = lambda *args, **kwargs: client
+
+
+class LoadBenchmark:
+    """Concurrent register/login/create/list/update mix against the app in-process.
+
+    Each virtual user registers, creates a product, then picks operations at
+    random with the given weights. Requests go through the full ASGI stack
+    (middleware, validation, serialization) without a network hop, so the
+    numbers isolate the application from the server and the network.
+    """
+
+    def __init__(self, workers, requests_per_worker, mix, seed):
+        self.workers = workers
+        self.requests_per_worker = requests_per_worker
+        self.mix = mix
+        self.seed = seed
+        self.samples = {name: [] for name in ("register", "login", "create", "list", "update")}
+        self.errors = {name: 0 for name in self.samples}
+
+    async def call(self, client, name, method, path, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, path, **kwargs)
+        self.samples[name].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[name] += 1
+            return None
+        return response.json()
+
+    async def register(self, client, rng):
+        username = f"bench_{rng.getrandbits(48):012x}"
+        token = await self.call(client, "register", "POST", "/api/register", json={
+            "username": username, "email": f"{username}@dmsports.fr", "password": "benchpass123",
+        })
+        return username, token["access_token"] if token else None
+
+    async def user(self, client, index):
+        rng = random.Random(self.seed + index)
+        username, token = await self.register(client, rng)
+        if token is None:
+            return
+        headers = {"Authorization": f"Bearer {token}"}
+        product_ids = []
+        operations, weights = zip(*self.mix.items())
+
+        for i in range(self.requests_per_worker):
+            operation = "create" if not product_ids else rng.choices(operations, weights)[0]
+            if operation == "register":
+                await self.register(client, rng)
+            elif operation == "login":
+                await self.call(client, "login", "POST", "/api/login", json={"username": username, "password": "benchpass123"})
+            elif operation == "create":
+                product = sample_products(1)[0]
+                product["sku"] = f"LOAD-{index}-{i}"
+                created = await self.call(client, "create", "POST", "/api/products", json=product, headers=headers)
+                if created:
+                    product_ids.append(created["id"])
+            elif operation == "list":
+                await self.call(client, "list", "GET", "/api/products", params={"limit": 50}, headers=headers)
+            else:
+                await self.call(client, "update", "PUT", f"/api/products/{rng.choice(product_ids)}",
+                                json={"price": round(rng.uniform(20, 200), 2)}, headers=headers)
+
+    async def run(self):
+        import httpx
+        import server
+
+        async with server.app.router.lifespan_context(server.app):
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                start = time.perf_counter()
+                await asyncio.gather(*(self.user(client, index) for index in range(self.workers)))
+                elapsed = time.perf_counter() - start
+
+        results = [
+            summarize(name, samples, elapsed, self.errors[name])
+            for name, samples in self.samples.items() if samples
+        ]
+        everything = [sample for samples in self.samples.values() for sample in samples]
+        results.append(summarize("all", everything, elapsed, sum(self.errors.values())))
+        return results
+
+
+def parse_mix(value):
+    """"list=50,create=20" -> {"list": 50.0, "create": 20.0}"""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ("register", "login", "create", "list", "update"):
+            raise argparse.ArgumentTypeError(f"unknown operation: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def environment(args):
+    """What the numbers depend on, stored with the results"""
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        revision = ""
+    return {
+        "revision": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "bcrypt_rounds": int(os.getenv("BCRYPT_ROUNDS", "12")),
+        "mongo": getattr(args, "mongo_url", None) or ("mongomock" if args.command in ("load", "suite") else None),
+    }
+
+
+def compare_results(baseline, current, tolerance):
+    """Print the change of each shared result; returns the names that regressed beyond tolerance"""
+    previous = {result["name"]: result for result in baseline["results"] if "name" in result}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get(result.get("name"))
+        if before is None:
+            continue
+        # Throughput: higher is better. Latency: lower is better.
+        for key, higher_is_better in (("per_second", True), ("throughput_rps", True), ("p95_ms", False), ("p99_ms", False)):
+            if not before.get(key) or key not in result:
+                continue
+            change = (result[key] - before[key]) / before[key]
+            worse = -change if higher_is_better else change
+            marker = "❌" if worse > tolerance else "✅"
+            print(f"{marker} {result['name']:<44} {key:<15} {before[key]:>12} -> {result[key]:>12} ({change:+.1%})")
+            if worse > tolerance:
+                regressions.append(f"{result['name']} {key}")
+    return regressions
+
+
+def run_concurrency(args):
+    print("🚀 Starting DM Sports API concurrency benchmark")
+    print(f"📍 Target: {args.base_url} - {args.concurrency} workers x {args.requests} requests")
+    print("=" * 60)
+
+    benchmark = ConcurrencyBenchmark(args.base_url, args.concurrency, args.requests, args.products)
+    try:
+        results = benchmark.run()
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Benchmark aborted: {e}")
+        return None
+
+    for summary in results:
+        print_summary(summary)
+    return results
+
+
+def run_content(args):
+    print("🚀 Starting content generation microbenchmark")
+    print("=" * 60)
+    return bench_content(sample_products(args.products), args.batch_size)
+
+
+def run_serialization(args):
+    print("🚀 Starting product listing serialization microbenchmark")
+    print(f"📍 {args.products} products in pages of {args.page_size}")
+    print("=" * 60)
+    return bench_serialization(sample_products(args.products), args.page_size)
+
+
+def run_hashing(args):
+    print("🚀 Starting password hashing microbenchmark")
+    print("=" * 60)
+    return bench_hashing(args.count, args.concurrency)
+
+
+def run_images(args):
+    print("🚀 Starting image upload processing microbenchmark")
+    print(f"📍 {args.count} images of {args.size}x{args.size} px")
+    print("=" * 60)
+    return bench_images(args.count, args.size)
+
+
+def run_search(args):
+    configure_backend(args.mongo_url)
+    print("🚀 Starting product search benchmark")
+    print(f"📍 {args.queries} queries over {args.products} products")
+    print("=" * 60)
+    return bench_search(sample_products(args.products), args.queries)
+
+
+def run_load(args):
+    configure_backend(args.mongo_url)
+    print("🚀 Starting in-process load benchmark")
+    print(f"📍 {args.workers} users x {args.requests} requests, mix {args.mix}")
+    print("=" * 60)
+    results = asyncio.run(LoadBenchmark(args.workers, args.requests, args.mix, args.seed).run())
+    for summary in results:
+        print_summary(summary)
+    return results
+
+
+def run_suite(args):
+    """Every offline benchmark at a scale that finishes in about a minute"""
+    configure_backend(args.mongo_url)
+    products = sample_products(args.products)
+    results = []
+    print("🚀 content")
+    results.extend(bench_content(products, 500))
+    print("🚀 serialization")
+    results.extend(bench_serialization(products, 200))
+    print("🚀 hashing")
+    results.extend(bench_hashing(args.hashes, 8))
+    print("🚀 images")
+    results.extend(bench_images(args.images, 2048))
+    if args.mongo_url:
+        print("🚀 search")
+        results.extend(bench_search(products, 120))
+    print("🚀 load")
+    load = asyncio.run(LoadBenchmark(args.workers, args.requests, args.mix, args.seed).run())
+    for summary in load:
+        print_summary(summary)
+    return results + [{**summary, "name": f"load: {summary['name']}"} for summary in load]
+
+
+def run_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    print(f"🔍 {baseline.get('environment', {}).get('revision') or args.baseline} -> "
+          f"{current.get('environment', {}).get('revision') or args.current}")
+    regressions = compare_results(baseline, current, args.tolerance)
+    if regressions:
+        print(f"⚠️  {len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        return None
+    print("🎉 No regressions")
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DM Sports API benchmarks")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    concurrency = commands.add_parser("concurrency", help="parallel load against a running server")
+    concurrency.add_argument("--base-url", default="http://localhost:8001/api")
+    concurrency.add_argument("--concurrency", type=int, default=32)
+    concurrency.add_argument("--requests", type=int, default=50, help="requests per worker")
+    concurrency.add_argument("--products", type=int, default=200, help="products seeded for the benchmark user")
+    concurrency.set_defaults(run=run_concurrency)
+
+    content = commands.add_parser("content", help="generate_product_content throughput")
+    content.add_argument("--products", type=int, default=20000)
+    content.add_argument("--batch-size", type=int, default=500)
+    content.set_defaults(run=run_content)
+
+    serialization = commands.add_parser("serialization", help="GET /api/products response rendering")
+    serialization.add_argument("--products", type=int, default=10000)
+    serialization.add_argument("--page-size", type=int, default=200)
+    serialization.set_defaults(run=run_serialization)
+
+    hashing = commands.add_parser("hashing", help="bcrypt throughput, inline and through the process pool")
+    hashing.add_argument("--count", type=int, default=32)
+    hashing.add_argument("--concurrency", type=int, default=8)
+    hashing.set_defaults(run=run_hashing)
+
+    images = commands.add_parser("images", help="image upload processing and derivative rendering")
+    images.add_argument("--count", type=int, default=20)
+    images.add_argument("--size", type=int, default=2048, help="edge of the generated JPEGs in pixels")
+    images.set_defaults(run=run_images)
+
+    search = commands.add_parser("search", help="product search queries in-process")
+    search.add_argument("--products", type=int, default=20000)
+    search.add_argument("--queries", type=int, default=300)
+    search.add_argument("--mongo-url", required=True, help="MongoDB server to create the throwaway database on")
+    search.set_defaults(run=run_search)
+
+    default_mix = "register=2,login=8,create=20,list=50,update=20"
+    load = commands.add_parser("load", help="register/login/create/list/update mix against the app in-process")
+    load.add_argument("--workers", type=int, default=32, help="concurrent virtual users")
+    load.add_argument("--requests", type=int, default=50, help="requests per user after registering")
+    load.add_argument("--mix", type=parse_mix, default=parse_mix(default_mix), help=f"operation weights (default {default_mix})")
+    load.add_argument("--seed", type=int, default=1, help="makes the operation sequence reproducible")
+    load.add_argument("--mongo-url", help="use this MongoDB server instead of mongomock")
+    load.set_defaults(run=run_load)
+
+    suite = commands.add_parser("suite", help="every offline benchmark, for comparing revisions")
+    suite.add_argument("--products", type=int, default=5000)
+    suite.add_argument("--hashes", type=int, default=16)
+    suite.add_argument("--images", type=int, default=10)
+    suite.add_argument("--workers", type=int, default=16)
+    suite.add_argument("--requests", type=int, default=25)
+    suite.add_argument("--mix", type=parse_mix, default=parse_mix(default_mix))
+    suite.add_argument("--seed", type=int, default=1)
+    suite.add_argument("--mongo-url", help="use this MongoDB server instead of mongomock")
+    suite.set_defaults(run=run_suite)
+
+    compare = commands.add_parser("compare", help="compare two --output files; exits 1 on regressions")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown")
+    compare.set_defaults(run=run_compare)
+
+    args = parser.parse_args()
+    results = args.run(args)
+    if results is None:
+        return 1
+
+    if args.output and args.command != "compare":
+        with open(args.output, "w") as f:
+            json.dump({
+                "timestamp": datetime.now().isoformat(),
+                "command": args.command,
+                "environment": environment(args),
+                "results": results,
+            }, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
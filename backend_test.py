@@ -6,10 +6,38 @@ Tests all API endpoints with comprehensive coverage
 
 import requests
 import sys
+import os
+import asyncio
+import importlib
+import time
 import json
+import struct
+import zlib
+import csv
+import io
 from datetime import datetime
+from urllib.parse import urlencode
 import uuid
 
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+def import_backend(module):
+    """Import a backend module for the in-process tests (same environment as the server: MONGO_URL, ...)"""
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    return importlib.import_module(module)
+
+def sample_png(width=64, height=48, seed=None):
+    """A valid RGB PNG; a new seed gives an image the server has never stored"""
+    seed = seed if seed is not None else uuid.uuid4().bytes
+    row = b"\x00" + bytes((seed[x % len(seed)] + x) % 256 for x in range(width * 3))
+    
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(row * height)) + chunk(b"IEND", b"")
+
 class DMSportsAPITester:
     def __init__(self, base_url="http://localhost:8001/api"):
         self.base_url = base_url
@@ -18,6 +46,7 @@ class DMSportsAPITester:
         self.tests_run = 0
         self.tests_passed = 0
         self.created_product_id = None
+        self.uploaded_image = None
 
     def log_test(self, name, success, details=""):
         """Log test results"""
@@ -47,6 +76,8 @@ class DMSportsAPITester:
                 response = requests.post(url, json=data, headers=test_headers, timeout=10)
             elif method == 'PUT':
                 response = requests.put(url, json=data, headers=test_headers, timeout=10)
+            elif method == 'PATCH':
+                response = requests.patch(url, json=data, headers=test_headers, timeout=10)
             elif method == 'DELETE':
                 response = requests.delete(url, headers=test_headers, timeout=10)
 
@@ -66,6 +97,39 @@ class DMSportsAPITester:
         except requests.exceptions.RequestException as e:
             return self.log_test(name, False, f"Connection Error: {str(e)}"), None
 
+    def auth_headers(self, token=None):
+        return {"Authorization": f"Bearer {token or self.token}"}
+
+    def register_user(self, suffix):
+        """Register an extra user and return its access token"""
+        username = f"{self.test_user_id}_{suffix}"
+        try:
+            response = requests.post(
+                f"{self.base_url}/register",
+                json={"username": username, "email": f"{username}@test.com", "password": "TestPassword123!"},
+                timeout=10
+            )
+        except requests.exceptions.RequestException:
+            return None
+        return response.json().get("access_token") if response.status_code == 200 else None
+
+    def create_test_product(self, name, token=None, **fields):
+        """Create a product without counting it as a test; returns it or None"""
+        product_data = {
+            "name": name,
+            "brand": "Nike",
+            "category": "vestes",
+            "gender": "homme",
+            "price": 99.99,
+            "sku": f"TEST-{uuid.uuid4().hex[:8].upper()}",
+            **fields
+        }
+        try:
+            response = requests.post(f"{self.base_url}/products", json=product_data, headers=self.auth_headers(token), timeout=10)
+        except requests.exceptions.RequestException:
+            return None
+        return response.json() if response.status_code == 200 else None
+
     def test_health_check(self):
         """Test health endpoint"""
         success, response = self.run_test(
@@ -85,6 +149,21 @@ class DMSportsAPITester:
                 pass
         return False
 
+    def test_readiness(self):
+        """Test liveness and readiness probes"""
+        live, _ = self.run_test("Liveness Probe", "GET", "/health/live", 200)
+        success, response = self.run_test("Readiness Probe", "GET", "/health/ready", 200)
+        
+        if live and success and response:
+            try:
+                data = response.json()
+                if data.get('checks', {}).get('mongo', {}).get('status') == 'ok':
+                    print(f"   Mongo ping: {data['checks']['mongo'].get('latency_ms')} ms")
+                    return True
+            except:
+                pass
+        return False
+
     def test_get_brands(self):
         """Test brands endpoint"""
         success, response = self.run_test(
@@ -208,9 +287,9 @@ class DMSportsAPITester:
         
         if success and response:
             try:
-                products = response.json()
-                if isinstance(products, list):
-                    print(f"   Found {len(products)} products")
+                page = response.json()
+                if isinstance(page.get('items'), list) and 'next_cursor' in page:
+                    print(f"   Found {len(page['items'])} products on first page")
                     return True
             except:
                 pass
@@ -238,6 +317,61 @@ class DMSportsAPITester:
                 pass
         return False
 
+    def test_http_caching(self):
+        """Test conditional GETs (304) and gzip/brotli negotiation with weak ETags"""
+        if not self.created_product_id:
+            return self.log_test("Conditional GET", False, "No product ID available")
+        
+        url = f"{self.base_url}/products/{self.created_product_id}"
+        try:
+            identity = requests.get(url, headers={**self.auth_headers(), "Accept-Encoding": "identity"}, timeout=10)
+            gzipped = requests.get(url, headers={**self.auth_headers(), "Accept-Encoding": "gzip"}, timeout=10)
+            negotiated = requests.get(url, headers={**self.auth_headers(), "Accept-Encoding": "br;q=1.0, gzip;q=0.5"}, timeout=10)
+            not_modified = requests.get(
+                url,
+                headers={**self.auth_headers(), "Accept-Encoding": "gzip", "If-None-Match": gzipped.headers.get("etag", "")},
+                timeout=10
+            )
+            brands = requests.get(f"{self.base_url}/brands", timeout=10)
+            brands_not_modified = requests.get(
+                f"{self.base_url}/brands", headers={"If-None-Match": brands.headers.get("etag", "")}, timeout=10
+            )
+        except requests.exceptions.RequestException as e:
+            return self.log_test("Conditional GET", False, f"Connection Error: {str(e)}")
+        
+        strong_etag = identity.headers.get("etag", "")
+        success = self.log_test(
+            "Identity Response",
+            identity.status_code == 200 and "content-encoding" not in identity.headers and strong_etag.startswith('"'),
+            f"Status: {identity.status_code} - ETag {strong_etag}"
+        )
+        # requests decodes gzip transparently: the JSON must survive the round trip
+        success = self.log_test(
+            "Gzip Response",
+            gzipped.status_code == 200
+            and gzipped.headers.get("content-encoding") == "gzip"
+            and gzipped.headers.get("etag") == f"W/{strong_etag}"
+            and gzipped.json().get("id") == self.created_product_id,
+            f"Status: {gzipped.status_code} - {gzipped.headers.get('content-encoding')}, ETag {gzipped.headers.get('etag')}"
+        ) and success
+        # br when the server has the brotli package, gzip otherwise
+        success = self.log_test(
+            "Encoding Negotiation",
+            negotiated.status_code == 200 and negotiated.headers.get("content-encoding") in ("br", "gzip"),
+            f"Status: {negotiated.status_code} - {negotiated.headers.get('content-encoding')}"
+        ) and success
+        success = self.log_test(
+            "Conditional GET Not Modified",
+            not_modified.status_code == 304 and not not_modified.content,
+            f"Status: {not_modified.status_code}"
+        ) and success
+        success = self.log_test(
+            "Brands Not Modified",
+            brands_not_modified.status_code == 304 and "max-age" in brands.headers.get("cache-control", ""),
+            f"Status: {brands_not_modified.status_code} - {brands.headers.get('cache-control')}"
+        ) and success
+        return success
+
     def test_update_product(self):
         """Test updating a product"""
         if not self.created_product_id:
@@ -267,6 +401,92 @@ class DMSportsAPITester:
                 pass
         return False
 
+    def test_noop_update(self):
+        """Test that unchanged updates write nothing and a name change regenerates the title"""
+        product = self.create_test_product("Short Noop Test", features=["Léger"])
+        if not product:
+            return self.log_test("No-op Update", False, "Could not create test product")
+        
+        content = product["generated_content"]
+        for name, data in (
+            ("No-op Update", {"name": product["name"], "features": product["features"]}),
+            ("No-op Direct Update", {"price": product["price"]}),
+        ):
+            success, response = self.run_test(name, "PUT", f"/products/{product['id']}", 200, data=data)
+            if success:
+                updated = response.json()
+                if (
+                    updated["version"] != product["version"]
+                    or updated["generated_content"].get("generated_at") != content.get("generated_at")
+                ):
+                    return self.log_test(f"{name} Unchanged", False, f"Product was rewritten: version {updated['version']}")
+        
+        success, response = self.run_test(
+            "Rename Regenerates Content",
+            "PUT",
+            f"/products/{product['id']}",
+            200,
+            data={"name": "Short Renamed Test"}
+        )
+        if success:
+            updated = response.json()
+            if (
+                "Short Renamed Test" not in updated["generated_content"].get("title", "")
+                or updated["generated_content"].get("content_hash") == content.get("content_hash")
+                or updated["version"] != product["version"] + 1
+            ):
+                return self.log_test("Rename Regenerated Content", False, f"Unexpected content: {updated['generated_content'].get('title')}")
+        return success
+
+    def read_event(self, stream, event_type, product_id):
+        """Read SSE events until one of ``event_type`` about ``product_id``; None if the stream ends"""
+        event = {}
+        for line in stream.iter_lines(decode_unicode=True):
+            if line:
+                field, _, value = line.partition(": ")
+                event[field] = value
+                continue
+            if event.get("event") == event_type:
+                data = json.loads(event["data"])
+                if data.get("product", data).get("id") == product_id:
+                    return event
+            event = {}
+        return None
+
+    def test_product_events(self):
+        """Test the product event stream: live deltas, then replay after reconnecting with Last-Event-ID
+        
+        Needs a single worker or EVENTS_CHANGE_STREAM, like any client of the stream.
+        """
+        url = f"{self.base_url}/products/events"
+        try:
+            # EventSource cannot send headers: the token goes in the query string
+            with requests.get(url, params={"token": self.token}, stream=True, timeout=(5, 20)) as stream:
+                success = self.log_test(
+                    "Product Event Stream",
+                    stream.status_code == 200 and stream.headers.get("content-type", "").startswith("text/event-stream"),
+                    f"Status: {stream.status_code} - {stream.headers.get('content-type')}"
+                )
+                if not success:
+                    return False
+                product = self.create_test_product("Event Stream Test")
+                if not product:
+                    return self.log_test("Product Event Delta", False, "Could not create test product")
+                created = self.read_event(stream, "product", product["id"])
+            success = self.log_test("Product Event Delta", created is not None, f"id {created and created.get('id')}")
+            if not success:
+                return False
+            
+            requests.delete(f"{self.base_url}/products/{product['id']}", headers=self.auth_headers(), timeout=10)
+            # Deleted while disconnected: replayed from the id last seen
+            with requests.get(
+                url, headers={**self.auth_headers(), "Last-Event-ID": created["id"]}, stream=True, timeout=(5, 20)
+            ) as stream:
+                deleted = self.read_event(stream, "deleted", product["id"])
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return self.log_test("Product Event Stream", False, f"Error: {str(e)}")
+        return self.log_test("Product Event Replay", deleted is not None, f"id {deleted and deleted.get('id')}")
+
     def test_generate_content(self):
         """Test content generation endpoint"""
         content_data = {
@@ -318,6 +538,365 @@ class DMSportsAPITester:
                 pass
         return False
 
+    def test_stale_update(self):
+        """Test that an update with an outdated If-Match is rejected"""
+        if not self.created_product_id:
+            return self.log_test("Stale Update Rejected", False, "No product ID available")
+        
+        success, _ = self.run_test(
+            "Stale Update Rejected",
+            "PUT",
+            f"/products/{self.created_product_id}",
+            412,
+            data={"price": 1.0},
+            headers={"If-Match": '"v0"'}
+        )
+        return success
+
+    def test_bulk_patch(self):
+        """Test bulk partial update"""
+        if not self.created_product_id:
+            return self.log_test("Bulk Patch", False, "No product ID available")
+        
+        success, response = self.run_test(
+            "Bulk Patch",
+            "PATCH",
+            "/products/bulk",
+            200,
+            data=[{"id": self.created_product_id, "price": 99.99, "season": "SS25"}]
+        )
+        if success and response:
+            result = response.json()
+            if result.get("updated") != 1:
+                return self.log_test("Bulk Patch Result", False, f"Unexpected result: {result}")
+        return success
+
+    def test_bulk_archive(self):
+        """Test archiving and restoring a selection of products"""
+        if not self.created_product_id:
+            return self.log_test("Bulk Archive", False, "No product ID available")
+        
+        selection = {"ids": [self.created_product_id]}
+        success, response = self.run_test("Bulk Archive", "POST", "/products/bulk/archive", 200, data=selection)
+        if success and response.json().get("archived") != 1:
+            return self.log_test("Bulk Archive Count", False, f"Unexpected result: {response.json()}")
+        
+        success, response = self.run_test("Bulk Restore", "POST", "/products/bulk/restore", 200, data=selection)
+        if success and response.json().get("restored") != 1:
+            return self.log_test("Bulk Restore Count", False, f"Unexpected result: {response.json()}")
+        return success
+
+    def test_bulk_import(self):
+        """Test streaming CSV catalog import"""
+        sku = f"IMPORT-{uuid.uuid4().hex[:8].upper()}"
+        csv_data = (
+            "name,brand,category,gender,price,sku,features\n"
+            f"Polo Import Test,Lacoste,polos,homme,89.90,{sku},Coton piqué|Logo brodé\n"
+            f"Ligne invalide,Lacoste,polos,homme,pas-un-prix,{sku}-BAD,\n"
+        )
+        try:
+            response = requests.post(
+                f"{self.base_url}/products/import",
+                files={"file": ("catalogue.csv", csv_data.encode("utf-8"), "text/csv")},
+                headers={"Authorization": f"Bearer {self.token}"},
+                timeout=30
+            )
+        except requests.exceptions.RequestException as e:
+            return self.log_test("Bulk Import", False, f"Connection Error: {str(e)}")
+        
+        try:
+            events = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+            done = events[-1]
+            success = (
+                response.status_code == 200
+                and done.get("event") == "done"
+                and done.get("inserted") == 1
+                and done.get("failed") == 1
+            )
+            details = f"Status: {response.status_code} - {done}"
+        except (ValueError, IndexError) as e:
+            success, details = False, f"Status: {response.status_code} - Invalid NDJSON: {e}"
+        return self.log_test("Bulk Import", success, details)
+
+    def test_partial_reimport(self):
+        """Test that columns missing from a re-import keep their value in generated content and search"""
+        word = f"zq{uuid.uuid4().hex[:8]}"
+        product = self.create_test_product("Polo Reimport Test", material="Coton", features=["Coton", word])
+        if not product:
+            return self.log_test("Partial Re-import", False, "Could not create test product")
+        
+        # No material or features columns: both stay as stored
+        csv_data = (
+            "name,brand,category,gender,price,sku\n"
+            f"Polo Reimport Renamed,Nike,polos,homme,79.90,{product['sku']}\n"
+        )
+        try:
+            response = requests.post(
+                f"{self.base_url}/products/import",
+                files={"file": ("catalogue.csv", csv_data.encode("utf-8"), "text/csv")},
+                headers=self.auth_headers(),
+                timeout=30
+            )
+            stored = requests.get(f"{self.base_url}/products/{product['id']}", headers=self.auth_headers(), timeout=10).json()
+            found = requests.get(
+                f"{self.base_url}/products/search",
+                params={"q": word},
+                headers=self.auth_headers(),
+                timeout=10
+            ).json()
+            # The same file again changes nothing
+            repeated = requests.post(
+                f"{self.base_url}/products/import",
+                files={"file": ("catalogue.csv", csv_data.encode("utf-8"), "text/csv")},
+                headers=self.auth_headers(),
+                timeout=30
+            )
+            after_repeat = requests.get(f"{self.base_url}/products/{product['id']}", headers=self.auth_headers(), timeout=10).json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return self.log_test("Partial Re-import", False, f"Error: {e}")
+        
+        content = stored.get("generated_content", {})
+        checks = {
+            "updated": response.status_code == 200 and json.loads(response.text.splitlines()[-1]).get("updated") == 1,
+            "columns kept": stored.get("material") == "Coton" and stored.get("features") == ["Coton", word],
+            "name applied": "Polo Reimport Renamed" in content.get("title", ""),
+            "content merged": "Coton" in content.get("description", ""),
+            "search merged": [item["id"] for item in found.get("items", [])] == [product["id"]],
+            "repeat unchanged": repeated.status_code == 200 and json.loads(repeated.text.splitlines()[-1]).get("unchanged") == 1,
+            "version kept": after_repeat.get("version") == stored.get("version"),
+        }
+        failed = [name for name, ok in checks.items() if not ok]
+        return self.log_test("Partial Re-import", not failed, f"Failed checks: {failed}" if failed else "")
+
+    def test_export(self):
+        """Test streaming CSV catalog export"""
+        try:
+            response = requests.get(
+                f"{self.base_url}/products/export",
+                params={"format": "csv"},
+                headers={"Authorization": f"Bearer {self.token}"},
+                timeout=30
+            )
+        except requests.exceptions.RequestException as e:
+            return self.log_test("Catalog Export", False, f"Connection Error: {str(e)}")
+        
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        success = (
+            response.status_code == 200
+            and len(rows) > 0
+            and all(row.get("sku") and row.get("html_description") for row in rows)
+        )
+        return self.log_test("Catalog Export", success, f"Status: {response.status_code} - {len(rows)} row(s)")
+
+    def test_search(self):
+        """Test accent-folded prefix search, title ranking and per-user isolation"""
+        word = f"zq{uuid.uuid4().hex[:8]}"
+        in_title = self.create_test_product(f"Veste Légère {word}")
+        in_description = self.create_test_product("Veste Coupe-vent", description=f"Modèle {word} doublé")
+        other_token = self.register_user("search")
+        other_product = self.create_test_product(f"Veste {word}", token=other_token) if other_token else None
+        if not (in_title and in_description and other_product):
+            return self.log_test("Product Search", False, "Could not create test products")
+        
+        # "LÉGÈ" folds to "lege", a prefix of "Légère"; the second term is a prefix too
+        success, response = self.run_test(
+            "Search Accented Prefix",
+            "GET",
+            f"/products/search?{urlencode({'q': f'LÉGÈ {word[:6]}'})}",
+            200
+        )
+        if success:
+            ids = [item["id"] for item in response.json()["items"]]
+            if ids != [in_title["id"]]:
+                return self.log_test("Search Accented Prefix Results", False, f"Unexpected ids: {ids}")
+        
+        # A match in the name ranks above one in the description; other users' products never match
+        success, response = self.run_test("Search Ranking", "GET", f"/products/search?{urlencode({'q': word})}", 200)
+        if success:
+            ids = [item["id"] for item in response.json()["items"]]
+            if ids != [in_title["id"], in_description["id"]]:
+                return self.log_test("Search Ranking Order", False, f"Unexpected ids: {ids}")
+        
+        success, response = self.run_test(
+            "Search Other User",
+            "GET",
+            f"/products/search?{urlencode({'q': word})}",
+            200,
+            headers=self.auth_headers(other_token)
+        )
+        if success:
+            ids = [item["id"] for item in response.json()["items"]]
+            if ids != [other_product["id"]]:
+                return self.log_test("Search Other User Results", False, f"Unexpected ids: {ids}")
+        return success
+
+    def upload_image(self, data, filename="image.png", content_type="image/png"):
+        return requests.post(
+            f"{self.base_url}/upload-image",
+            files={"file": (filename, data, content_type)},
+            headers=self.auth_headers(),
+            timeout=30
+        )
+
+    def test_image_upload(self):
+        """Test content-addressed image upload, dedup, immutable originals and rejected uploads"""
+        png = sample_png()
+        try:
+            first = self.upload_image(png)
+            second = self.upload_image(png, filename="copy.png")
+        except requests.exceptions.RequestException as e:
+            return self.log_test("Image Upload", False, f"Connection Error: {str(e)}")
+        if first.status_code != 200 or second.status_code != 200:
+            return self.log_test("Image Upload", False, f"Status: {first.status_code}, {second.status_code} - {first.text[:100]}")
+        
+        image = first.json()
+        self.uploaded_image = image
+        success = (
+            image["image_url"] == f"/api/images/{image['hash']}"
+            and (image["format"], image["width"], image["height"]) == ("PNG", 64, 48)
+        )
+        self.log_test("Image Upload", success, f"Status: {first.status_code} - {image['hash'][:12]}…")
+        # Same bytes, same reference: the second upload is not stored again
+        self.log_test("Image Upload Dedup", second.json()["image_url"] == image["image_url"], f"{second.json()['hash'][:12]}…")
+        
+        root = self.base_url[:-len("/api")]
+        response = requests.get(f"{root}{image['image_url']}", timeout=10)
+        self.log_test(
+            "Get Image",
+            response.status_code == 200
+            and response.content == png
+            and response.headers.get("content-type") == "image/png"
+            and "immutable" in response.headers.get("cache-control", ""),
+            f"Status: {response.status_code} - {response.headers.get('cache-control')}"
+        )
+        response = requests.get(f"{root}{image['image_url']}", headers={"If-None-Match": response.headers.get("etag", "")}, timeout=10)
+        self.log_test("Get Image Not Modified", response.status_code == 304, f"Status: {response.status_code}")
+        
+        self.run_test("Get Unknown Image", "GET", f"/images/{'0' * 64}", 404)
+        self.run_test("Get Image Invalid Hash", "GET", "/images/not-a-hash", 404)
+        
+        for name, data, content_type in (
+            ("Upload Non-image Rejected", b"plain text", "text/plain"),
+            ("Upload Corrupt Image Rejected", b"\x89PNG\r\n\x1a\nnot really", "image/png"),
+            ("Upload Empty Image Rejected", b"", "image/png"),
+        ):
+            response = self.upload_image(data, content_type=content_type)
+            self.log_test(name, response.status_code == 400, f"Status: {response.status_code}")
+        return success
+
+    def test_image_derivatives(self):
+        """Test eager and lazily rendered derivatives, their cache headers and 404s"""
+        image = self.uploaded_image
+        if not image:
+            return self.log_test("Image Derivatives", False, "No uploaded image available")
+        
+        root = self.base_url[:-len("/api")]
+        success = image["thumbnail_url"] == f"{image['image_url']}/thumb.webp"
+        # thumb.webp is rendered right after the upload, lg.jpg only when first requested
+        for variant, media_type in (("thumb.webp", "image/webp"), ("lg.jpg", "image/jpeg")):
+            try:
+                response = requests.get(f"{root}{image['image_url']}/{variant}", timeout=30)
+            except requests.exceptions.RequestException as e:
+                return self.log_test(f"Image Derivative {variant}", False, f"Connection Error: {str(e)}")
+            ok = (
+                response.status_code == 200
+                and response.headers.get("content-type") == media_type
+                and "immutable" in response.headers.get("cache-control", "")
+                and len(response.content) > 0
+            )
+            success = self.log_test(f"Image Derivative {variant}", ok, f"Status: {response.status_code} - {len(response.content)} bytes") and success
+        
+        self.run_test("Image Derivative Unknown Variant", "GET", f"/images/{image['hash']}/huge.gif", 404)
+        self.run_test("Image Derivative Unknown Image", "GET", f"/images/{'0' * 64}/thumb.webp", 404)
+        # Never used as a path: only SHA-256 hashes reach the disk
+        self.run_test("Image Derivative Invalid Hash", "GET", "/images/..secrets/thumb.webp", 404)
+        return success
+
+    def test_rate_limits(self):
+        """Test per-user rate limits (default RATE_LIMIT_* settings): 429 with Retry-After, batches charged per chunk"""
+        token = self.register_user("limits")
+        if not token:
+            return self.log_test("Rate Limit", False, "Could not register test user")
+        content_data = {"name": "Limit Test", "brand": "Nike", "category": "chaussures", "gender": "homme"}
+        
+        try:
+            response = None
+            for attempt in range(1, 301):
+                response = requests.post(f"{self.base_url}/generate-content", json=content_data, headers=self.auth_headers(token), timeout=10)
+                if response.status_code != 200:
+                    break
+            retry_after = response.headers.get("retry-after", "")
+            success = self.log_test(
+                "Generate Content Rate Limit",
+                response.status_code == 429 and retry_after.isdigit() and int(retry_after) >= 1,
+                f"Status: {response.status_code} after {attempt} requests - Retry-After: {retry_after}"
+            )
+            
+            # The largest batch allowed costs more chunks than the bucket holds: it passes and empties it
+            batch = requests.post(
+                f"{self.base_url}/generate-content/batch",
+                json=[{**content_data, "sku": f"LIMIT-{i}"} for i in range(5000)],
+                headers=self.auth_headers(token),
+                timeout=60
+            )
+            lines = [line for line in batch.text.splitlines() if line.strip()]
+            small = requests.post(
+                f"{self.base_url}/generate-content/batch",
+                json=[content_data],
+                headers=self.auth_headers(token),
+                timeout=10
+            )
+        except requests.exceptions.RequestException as e:
+            return self.log_test("Rate Limit", False, f"Connection Error: {str(e)}")
+        
+        success = self.log_test(
+            "Large Batch Drains Bucket",
+            batch.status_code == 200 and len(lines) == 5000
+            and small.status_code == 429 and small.headers.get("retry-after", "").isdigit(),
+            f"Status: {batch.status_code} ({len(lines)} results), then {small.status_code} - Retry-After: {small.headers.get('retry-after')}"
+        ) and success
+        # Buckets are per user
+        other, _ = self.run_test("Rate Limit Per User", "POST", "/generate-content", 200, data=content_data)
+        return success and other
+
+    def test_single_flight(self):
+        """Test that concurrent SingleFlight calls with one key run once and share the result or the exception"""
+        try:
+            throttling = import_backend("throttling")
+        except ImportError as e:
+            return self.log_test("Single Flight", False, f"Backend not importable: {e}")
+        
+        async def scenario():
+            flight = throttling.SingleFlight("backend_test")
+            calls = []
+            
+            async def work(value):
+                calls.append(value)
+                await asyncio.sleep(0.05)
+                if isinstance(value, Exception):
+                    raise value
+                return value
+            
+            results = await asyncio.gather(*[flight.do("key", lambda: work("shared")) for _ in range(5)])
+            checks = {
+                "result shared": calls == ["shared"] and [result for result, _ in results] == ["shared"] * 5
+                and [shared for _, shared in results].count(True) == 4,
+            }
+            calls.clear()
+            failures = await asyncio.gather(
+                *[flight.do("key", lambda: work(ValueError("boom"))) for _ in range(3)], return_exceptions=True
+            )
+            checks["exception shared"] = len(calls) == 1 and all(isinstance(failure, ValueError) for failure in failures)
+            # A finished call is forgotten: the next one runs again
+            calls.clear()
+            await flight.do("key", lambda: work("again"))
+            checks["runs again"] = calls == ["again"]
+            return checks
+        
+        checks = asyncio.run(scenario())
+        failed = [name for name, ok in checks.items() if not ok]
+        return self.log_test("Single Flight", not failed, f"Failed checks: {failed}" if failed else "")
+
     def test_unauthorized_access(self):
         """Test unauthorized access"""
         # Temporarily remove token
@@ -335,6 +914,50 @@ class DMSportsAPITester:
         self.token = original_token
         return success
 
+    def test_principal_cache_invalidation(self):
+        """Test that deactivation and password changes revoke cached tokens without waiting for the TTL"""
+        try:
+            server = import_backend("server")
+        except ImportError as e:
+            return self.log_test("Principal Cache Invalidation", False, f"Backend not importable: {e}")
+        
+        async def rejected(token):
+            try:
+                await server.authenticate(token)
+            except server.HTTPException as e:
+                return e.status_code == 401
+            return False
+        
+        async def scenario():
+            results = {}
+            for change in ("deactivation", "password change"):
+                username = f"{self.test_user_id}_cache_{change.split()[0]}"
+                await server.users_repository.create({
+                    "username": username,
+                    "email": f"{username}@test.com",
+                    "password": "unused",
+                    "is_active": True,
+                    "created_at": datetime.utcnow()
+                })
+                token = server.create_access_token(data={"sub": username})
+                # Caches the principal for AUTH_CACHE_TTL_SECONDS
+                await server.authenticate(token)
+                if change == "deactivation":
+                    await server.users_repository.set_active(username, False)
+                else:
+                    # Token issue times have a one-second resolution
+                    await asyncio.sleep(1.1)
+                    await server.users_repository.set_password(username, "changed")
+                results[change] = await rejected(token)
+            return results
+        
+        try:
+            results = asyncio.run(scenario())
+        finally:
+            # The Motor client belongs to the loop asyncio.run just closed
+            server.mongo.close()
+        return self.log_test("Principal Cache Invalidation", all(results.values()), f"Old token rejected: {results}")
+
     def run_all_tests(self):
         """Run all API tests"""
         print("🚀 Starting DM Sports API Tests")
@@ -343,6 +966,7 @@ class DMSportsAPITester:
         # Basic connectivity tests
         print("\n📡 Basic Connectivity Tests")
         self.test_health_check()
+        self.test_readiness()
         self.test_get_brands()
         
         # Authentication tests
@@ -356,9 +980,27 @@ class DMSportsAPITester:
         self.test_create_product()
         self.test_get_products()
         self.test_get_single_product()
+        self.test_http_caching()
         self.test_update_product()
+        self.test_stale_update()
+        self.test_bulk_patch()
+        self.test_bulk_archive()
+        self.test_search()
+        self.test_noop_update()
+        self.test_product_events()
         self.test_generate_content()
+        self.test_image_upload()
+        self.test_image_derivatives()
+        self.test_bulk_import()
+        self.test_partial_reimport()
+        self.test_export()
         self.test_delete_product()
+        self.test_rate_limits()
+        
+        # In-process tests: import the backend modules directly
+        print("\n🧪 In-process Tests")
+        self.test_principal_cache_invalidation()
+        self.test_single_flight()
         
         # Results
         print("\n" + "=" * 50)
@@ -5,6 +5,10 @@ import './App.css';
 // Configure axios defaults
 axios.defaults.baseURL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001/api';
 
+// Uploaded images are served by the backend as /api/images/<hash>
+const BACKEND_ORIGIN = axios.defaults.baseURL.replace(/\/api\/?$/, '');
+const resolveImageUrl = (url) => (url && url.startsWith('/api/') ? `${BACKEND_ORIGIN}${url}` : url);
+
 // Toast notification component
 const Toast = ({ message, type, onClose }) => (
   <div className={`toast ${type}`} onClick={onClose}>
@@ -221,7 +225,8 @@ const ProductGenerator = ({ user, onProductCreated }) => {
         headers: { 'Content-Type': 'multipart/form-data' }
       });
       
-      setUploadedImage(response.data.image_url);
+      // Preview the resized copy; the product keeps the original URL
+      setUploadedImage(response.data.preview_url || response.data.image_url);
       setFormData(prev => ({ ...prev, images: [response.data.image_url] }));
     } catch (error) {
       alert('Erreur lors du téléchargement de l\'image');
@@ -296,7 +301,7 @@ const ProductGenerator = ({ user, onProductCreated }) => {
             />
             <label htmlFor="image-upload" style={{ cursor: 'pointer', width: '100%' }}>
               {uploadedImage ? (
-                <img src={uploadedImage} alt="Preview" className="upload-preview" />
+                <img src={resolveImageUrl(uploadedImage)} alt="Preview" className="upload-preview" />
               ) : (
                 <div>
                   <div className="upload-icon">📸</div>
@@ -625,39 +630,133 @@ const ProductGenerator = ({ user, onProductCreated }) => {
 // Products Library Component
 const ProductsLibrary = ({ user }) => {
   const [products, setProducts] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [searchTerm, setSearchTerm] = useState('');
+  const [searchResults, setSearchResults] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [showArchived, setShowArchived] = useState(false);
+  const [selectedIds, setSelectedIds] = useState([]);
 
   useEffect(() => {
+    setSelectedIds([]);
+    setSearchTerm('');
     fetchProducts();
-  }, []);
+  }, [showArchived]);
+
+  // Live changes from every session of this account, instead of refetching the list
+  useEffect(() => {
+    const token = localStorage.getItem('token');
+    if (!token) return undefined;
+    // EventSource cannot send headers; it resends Last-Event-ID itself on reconnect
+    const source = new EventSource(`${axios.defaults.baseURL}/products/events?token=${encodeURIComponent(token)}`);
+
+    source.addEventListener('product', (event) => {
+      const { product, archived } = JSON.parse(event.data);
+      setProducts(prev => {
+        if (archived !== showArchived) return prev.filter(p => p.id !== product.id);
+        return prev.some(p => p.id === product.id)
+          ? prev.map(p => (p.id === product.id ? product : p))
+          : [product, ...prev];
+      });
+      setSearchResults(prev => prev && prev.map(p => (p.id === product.id ? product : p)));
+    });
+    source.addEventListener('deleted', (event) => {
+      const { id } = JSON.parse(event.data);
+      setProducts(prev => prev.filter(p => p.id !== id));
+      setSearchResults(prev => prev && prev.filter(p => p.id !== id));
+      setSelectedIds(prev => prev.filter(selectedId => selectedId !== id));
+    });
+    // Bulk changes, or events missed while disconnected
+    source.addEventListener('refresh', () => fetchProducts());
+
+    return () => source.close();
+  }, [showArchived]);
+
+  useEffect(() => {
+    if (!searchTerm.trim()) {
+      setSearchResults(null);
+      return;
+    }
+    // Debounce keystrokes before querying the server-side index
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axios.get('/products/search', { params: { q: searchTerm, limit: 50 } });
+        setSearchResults(response.data.items);
+      } catch (error) {
+        console.error('Error searching products:', error);
+      }
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
 
-  const fetchProducts = async () => {
+  const fetchProducts = async (cursor = null) => {
     try {
-      const response = await axios.get('/products');
-      setProducts(response.data);
+      const params = { limit: 50, archived: showArchived };
+      if (cursor) params.after = cursor;
+      const response = await axios.get('/products', { params });
+      setProducts(prev => cursor ? [...prev, ...response.data.items] : response.data.items);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error fetching products:', error);
     }
     setLoading(false);
   };
 
+  const loadMoreProducts = async () => {
+    setLoadingMore(true);
+    await fetchProducts(nextCursor);
+    setLoadingMore(false);
+  };
+
+  const copyProduct = async (productId) => {
+    try {
+      // The library only holds summaries; fetch the full sheet on demand
+      const { data: product } = await axios.get(`/products/${productId}`);
+      const content = product.generated_content.description;
+      const title = product.generated_content.title;
+      const fullContent = `${title}\n${product.price}€\n\n${content.replace(/<[^>]*>/g, '')}`;
+      await navigator.clipboard.writeText(fullContent);
+      alert('📋 Contenu copié !');
+    } catch (error) {
+      alert('❌ Erreur lors de la copie');
+    }
+  };
+
   const deleteProduct = async (productId) => {
     if (!window.confirm('Êtes-vous sûr de vouloir supprimer ce produit ?')) return;
 
     try {
       await axios.delete(`/products/${productId}`);
       setProducts(products.filter(p => p.id !== productId));
+      if (searchResults) setSearchResults(searchResults.filter(p => p.id !== productId));
       alert('✅ Produit supprimé avec succès');
     } catch (error) {
       alert('❌ Erreur lors de la suppression');
     }
   };
 
-  const filteredProducts = products.filter(product =>
-    product.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    product.brand.toLowerCase().includes(searchTerm.toLowerCase())
-  );
+  const toggleSelected = (productId) => {
+    setSelectedIds(prev => prev.includes(productId)
+      ? prev.filter(id => id !== productId)
+      : [...prev, productId]);
+  };
+
+  // One request for the whole selection: archive, restore or delete
+  const applyToSelection = async (action) => {
+    if (action === 'delete' && !window.confirm(`Supprimer définitivement ${selectedIds.length} produit(s) ?`)) return;
+
+    try {
+      await axios.post(`/products/bulk/${action}`, { ids: selectedIds });
+      setProducts(products.filter(p => !selectedIds.includes(p.id)));
+      if (searchResults) setSearchResults(searchResults.filter(p => !selectedIds.includes(p.id)));
+      setSelectedIds([]);
+    } catch (error) {
+      alert('❌ Erreur lors de l\'opération groupée');
+    }
+  };
+
+  const filteredProducts = searchResults || products;
 
   if (loading) {
     return (
@@ -676,14 +775,32 @@ const ProductsLibrary = ({ user }) => {
   return (
     <div className="products-library">
       <div className="library-header">
-        <h2>📚 Bibliothèque des produits ({filteredProducts.length})</h2>
-        <input
-          type="text"
-          className="search-bar"
-          placeholder="🔍 Rechercher un produit..."
-          value={searchTerm}
-          onChange={(e) => setSearchTerm(e.target.value)}
-        />
+        <h2>{showArchived ? '🗄️ Produits archivés' : '📚 Bibliothèque des produits'} ({filteredProducts.length})</h2>
+        <div className="library-actions">
+          {selectedIds.length > 0 && (
+            <>
+              <button className="card-btn" onClick={() => applyToSelection(showArchived ? 'restore' : 'archive')}>
+                {showArchived ? 'Restaurer' : 'Archiver'} ({selectedIds.length})
+              </button>
+              <button className="card-btn" onClick={() => applyToSelection('delete')}>
+                Supprimer ({selectedIds.length})
+              </button>
+            </>
+          )}
+          <button className="card-btn" onClick={() => setShowArchived(!showArchived)}>
+            {showArchived ? 'Bibliothèque' : 'Archives'}
+          </button>
+        </div>
+        {/* Search only covers active products */}
+        {!showArchived && (
+          <input
+            type="text"
+            className="search-bar"
+            placeholder="🔍 Rechercher un produit..."
+            value={searchTerm}
+            onChange={(e) => setSearchTerm(e.target.value)}
+          />
+        )}
       </div>
       
       {filteredProducts.length === 0 ? (
@@ -695,7 +812,16 @@ const ProductsLibrary = ({ user }) => {
         <div className="products-grid">
           {filteredProducts.map(product => (
             <div key={product.id} className="product-card">
+              {product.thumbnail && (
+                <img src={resolveImageUrl(product.thumbnail)} alt={product.name} className="product-card-thumbnail" loading="lazy" />
+              )}
               <div className="product-card-header">
+                <input
+                  type="checkbox"
+                  className="product-card-select"
+                  checked={selectedIds.includes(product.id)}
+                  onChange={() => toggleSelected(product.id)}
+                />
                 <div className="product-card-title">{product.name}</div>
                 <div className="product-card-brand">{product.brand}</div>
               </div>
@@ -707,13 +833,7 @@ const ProductsLibrary = ({ user }) => {
                 <div className="product-card-actions">
                   <button 
                     className="card-btn primary"
-                    onClick={() => {
-                      const content = product.generated_content.description;
-                      const title = product.generated_content.title;
-                      const fullContent = `${title}\n${product.price}€\n\n${content.replace(/<[^>]*>/g, '')}`;
-                      navigator.clipboard.writeText(fullContent);
-                      alert('📋 Contenu copié !');
-                    }}
+                    onClick={() => copyProduct(product.id)}
                   >
                     Copier
                   </button>
@@ -729,6 +849,14 @@ const ProductsLibrary = ({ user }) => {
           ))}
         </div>
       )}
+
+      {nextCursor && !searchResults && (
+        <div style={{ padding: '20px', textAlign: 'center' }}>
+          <button className="card-btn" onClick={loadMoreProducts} disabled={loadingMore}>
+            {loadingMore ? 'Chargement...' : 'Charger plus de produits'}
+          </button>
+        </div>
+      )}
     </div>
   );
 };